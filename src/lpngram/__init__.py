@@ -20,6 +20,12 @@ from lpngram.ngrams import (
 )
 from lpngram.ngrams import bigrams, trigrams, fourgrams
 from lpngram.ngrams import get_all_ngrams
+from lpngram.trie import ContextTrie
+from lpngram.compact import CompactTable
+from lpngram.progress import CancelToken, OperationCancelled
+
+from lpngram.evaluation import kfold_perplexity, sweep
+from lpngram.evaluation import evaluate, evaluate_records
 
 from lpngram.smoothing import smooth_dist
 from lpngram.smoothing import (
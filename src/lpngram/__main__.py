@@ -10,14 +10,184 @@ Module for command-line execution and ngram colllection.
 # Import Python standard libraries
 import argparse
 import configparser
+import json
 
 # Import our library
 import lpngram
 
 
-def main():
-    print("<not implemented in this version>")
+def _parse_orders(value):
+    """
+    Internal function for parsing a pair of orders such as "2,1".
+    """
+
+    try:
+        pre_order, post_order = [int(order) for order in value.split(",")]
+    except ValueError:
+        raise argparse.ArgumentTypeError("Orders must be given as 'PRE,POST'.")
+
+    return pre_order, post_order
+
+
+def _bench(args):
+    """
+    Internal function running the `bench` command.
+    """
+
+    # The suite is imported here, as it is not needed by other commands.
+    from lpngram import benchmark
+
+    orders = args.orders
+    if args.quick:
+        sizes, orders = [200, 1000], orders or [(1, 1)]
+    else:
+        sizes = args.sizes
+
+    results = benchmark.run_benchmarks(
+        sizes=sizes,
+        orders=orders,
+        methods=args.methods,
+        memory=not args.no_memory,
+        seed=args.seed,
+        progress=lambda result: print(benchmark.format_result(result)),
+    )
+
+    exponents = benchmark.scaling(results)
+    if exponents:
+        print("\nScaling exponents (time ~ size^k):")
+        for (name, orders), exponent in sorted(exponents.items()):
+            print("  %-22s orders=%i,%i  k=%.2f" % (name, *orders, exponent))
+
+    if args.output:
+        benchmark.save_results(results, args.output)
+
+    if args.baseline:
+        comparison = benchmark.compare(
+            results, benchmark.load_results(args.baseline), args.tolerance
+        )
+        print("\nComparison with baseline:")
+        for entry in comparison:
+            print(
+                "  %-22s size=%-8i orders=%i,%i  ratio=%.2f%s"
+                % (
+                    entry["name"],
+                    entry["size"],
+                    *entry["orders"],
+                    entry["ratio"],
+                    "  REGRESSION" if entry["regression"] else "",
+                )
+            )
+        if any([entry["regression"] for entry in comparison]):
+            return 1
+
+    return 0
+
+
+def _stats(args):
+    """
+    Internal function running the `stats` command.
+    """
+
+    # Sequences are read one per line, with states separated by spaces.
+    with open(args.corpus, encoding="utf-8") as handler:
+        corpus = [line.split() for line in handler if line.strip()]
+
+    model = lpngram.NgramModel(*args.orders)
+    model.enable_stats()
+    model.add_sequences(corpus)
+    model.train(args.method)
+    for sequence in corpus:
+        model.score(sequence)
+    if args.generate:
+        model.random_seqs(k=args.generate, seed=args.seed)
+
+    output = json.dumps(model.stats(), indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handler:
+            handler.write(output)
+    else:
+        print(output)
+
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="lpngram", description=__doc__)
+    subparsers = parser.add_subparsers(dest="command")
+
+    bench = subparsers.add_parser(
+        "bench", help="Run the benchmark suite on synthetic Zipfian corpora."
+    )
+    bench.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Numbers of sequences in the corpora (default: 1000 10000).",
+    )
+    bench.add_argument(
+        "--orders",
+        type=_parse_orders,
+        nargs="+",
+        default=None,
+        help="Pairs of preceding and following orders (default: 1,0 2,1).",
+    )
+    bench.add_argument(
+        "--methods",
+        nargs="+",
+        default=None,
+        help="Smoothing methods to train (default: all).",
+    )
+    bench.add_argument("--seed", default="lpngram", help="Random seed.")
+    bench.add_argument(
+        "--no-memory", action="store_true", help="Do not measure peak memory."
+    )
+    bench.add_argument(
+        "--quick", action="store_true", help="Run a quick suite with small corpora."
+    )
+    bench.add_argument("--output", help="Write the results to a JSON file.")
+    bench.add_argument("--baseline", help="Compare with the results in a JSON file.")
+    bench.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="Relative throughput decrease reported as regression (default: 0.2).",
+    )
+
+    stats = subparsers.add_parser(
+        "stats",
+        help="Train, score and generate with a model, dumping its statistics.",
+    )
+    stats.add_argument(
+        "corpus", help="File with one sequence per line, states separated by spaces."
+    )
+    stats.add_argument(
+        "--orders",
+        type=_parse_orders,
+        default=(2, 1),
+        help="Preceding and following orders (default: 2,1).",
+    )
+    stats.add_argument(
+        "--method", default="laplace", help="Smoothing method (default: laplace)."
+    )
+    stats.add_argument(
+        "--generate",
+        type=int,
+        default=0,
+        help="Number of random sequences to generate (default: 0).",
+    )
+    stats.add_argument("--seed", default="lpngram", help="Random seed.")
+    stats.add_argument("--output", help="Write the statistics to a JSON file.")
+
+    args = parser.parse_args(argv)
+    if args.command == "bench":
+        return _bench(args)
+    if args.command == "stats":
+        return _stats(args)
+
+    parser.print_help()
+    return 0
 
 
 if __name__ == "__main__":
-    main()
+    raise SystemExit(main())
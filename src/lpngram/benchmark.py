@@ -0,0 +1,400 @@
+"""
+Module providing a benchmark suite for the hot paths of the library.
+
+The benchmarks run on synthetic corpora whose states follow a Zipfian
+distribution, as in natural languages, measuring the throughput of ngram
+collection, counting, training, scoring and generation for different corpus
+sizes and orders, as well as their peak memory usage. Results can be stored
+as JSON and compared against a baseline, so that performance regressions can
+be detected. The suite can be run from the command line with
+`lpngram bench`.
+"""
+
+# Import Python standard libraries
+import json
+import math
+import platform
+import random
+import time
+import tracemalloc
+
+# Import from namespace
+from .ngrams import NgramModel, get_all_posngrams
+from .smoothing import _SMOOTHING_METHODS
+from .evaluation import _corpus_perplexity, _heldout_ngrams, _heldout_scores
+
+# Default parameters of the suite; all the smoothing methods of
+# `smooth_dist()` are benchmarked by default.
+DEFAULT_SIZES = [1000, 10000]
+DEFAULT_ORDERS = [(1, 0), (2, 1)]
+DEFAULT_METHODS = list(_SMOOTHING_METHODS)
+
+# Additional arguments needed by some smoothing methods; Simple Good-Turing
+# is not allowed to fail on the distributions of few contexts whose counts
+# do not follow its assumptions, as it is timed on all of them.
+_METHOD_KWARGS = {"lidstone": {"gamma": 0.5}, "sgt": {"allow_fail": False}}
+
+# Smoothing method of the models used by the scoring and generation
+# benchmarks, so that they are comparable whatever the methods trained.
+_MODEL_METHOD = "laplace"
+
+# Maximum number of sequences generated by the generation benchmark.
+_MAX_GENERATED = 1000
+
+
+def zipf_corpus(size, vocab_size=30, exponent=1.0, mean_len=6, seed=None):
+    """
+    Returns a synthetic corpus of sequences with Zipfian state frequencies.
+
+    Parameters
+    ----------
+    size: int
+        The number of sequences in the corpus.
+
+    vocab_size: int
+        The number of different states. Defaults to 30.
+
+    exponent: float
+        The exponent of the Zipfian distribution, with the frequency of
+        each state proportional to the inverse of its rank raised to it.
+        Defaults to 1.0.
+
+    mean_len: int
+        The mean length of the sequences, which are uniformly distributed
+        between 2 and `2 * mean_len - 2`. Defaults to 6.
+
+    seed: obj
+        Any hasheable object, used to feed the random number generator.
+
+    Returns
+    -------
+    corpus: list
+        A list of `size` sequences, as lists of strings.
+    """
+
+    rng = random.Random(seed)
+    states = ["s%i" % rank for rank in range(vocab_size)]
+    weights = [1.0 / (rank + 1) ** exponent for rank in range(vocab_size)]
+    max_len = max(2, 2 * mean_len - 2)
+
+    return [
+        rng.choices(states, weights, k=rng.randint(2, max_len)) for _ in range(size)
+    ]
+
+
+def _measure(func, memory):
+    """
+    Internal function for measuring the running time and the peak memory of
+    a function.
+
+    The time is measured in a first run without memory tracing, which slows
+    down execution; if requested, the peak memory is measured in a second
+    run.
+    """
+
+    start = time.perf_counter()
+    func()
+    seconds = time.perf_counter() - start
+
+    peak = None
+    if memory:
+        tracemalloc.start()
+        try:
+            func()
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return seconds, peak
+
+
+def run_benchmarks(
+    sizes=None, orders=None, methods=None, memory=True, seed=None, progress=None
+):
+    """
+    Runs the benchmark suite.
+
+    For each corpus size and pair of orders, the suite measures ngram
+    collection (`get_all_posngrams()`), counting (building an `NgramModel`),
+    training with each smoothing method, scoring (the perplexity of the
+    entire corpus, from ngrams collected before timing), and random sequence
+    generation (`.random_seqs()`).
+
+    Parameters
+    ----------
+    sizes: list
+        The numbers of sequences in the synthetic corpora. Defaults to
+        `DEFAULT_SIZES`.
+
+    orders: list
+        A list of tuples of the preceding and following orders of the models.
+        Defaults to `DEFAULT_ORDERS`.
+
+    methods: list
+        The smoothing methods for the training benchmarks. Defaults to
+        `DEFAULT_METHODS`, i.e., all the methods of `smooth_dist()`. The
+        scoring and generation benchmarks always use models trained with
+        Laplace smoothing.
+
+    memory: bool
+        Whether to measure the peak memory of each benchmark, which requires
+        a second run. Defaults to True.
+
+    seed: obj
+        Any hasheable object, used to feed the random number generator for
+        the corpora and the generation.
+
+    progress: function
+        An optional function called with each result as soon as it is
+        available.
+
+    Returns
+    -------
+    results: list
+        A list of dictionaries, one for each benchmark, with its "name", the
+        corpus "size", the "orders", the running time in "seconds", the
+        "throughput" in "unit" per second, and the "peak_memory" in bytes
+        (None if not measured).
+    """
+
+    sizes = sizes or DEFAULT_SIZES
+    orders = orders or DEFAULT_ORDERS
+    methods = methods or DEFAULT_METHODS
+
+    results = []
+
+    def _add(name, size, order, func, n_items, unit):
+        seconds, peak = _measure(func, memory)
+        result = {
+            "name": name,
+            "size": size,
+            "orders": list(order),
+            "seconds": seconds,
+            "throughput": n_items / seconds if seconds else math.inf,
+            "unit": unit,
+            "peak_memory": peak,
+        }
+        results.append(result)
+        if progress:
+            progress(result)
+
+    for size in sizes:
+        corpus = zipf_corpus(size, seed=seed)
+        for pre_order, post_order in orders:
+            order = (pre_order, post_order)
+            model = NgramModel(pre_order, post_order, sequences=corpus)
+
+            _add(
+                "collect",
+                size,
+                order,
+                lambda: [
+                    ngram
+                    for sequence in corpus
+                    for ngram in get_all_posngrams(sequence, pre_order, post_order)
+                ],
+                size,
+                "sequences",
+            )
+            _add(
+                "count",
+                size,
+                order,
+                lambda: NgramModel(pre_order, post_order, sequences=corpus),
+                size,
+                "sequences",
+            )
+            for method in methods:
+                _add(
+                    "train:%s" % method,
+                    size,
+                    order,
+                    lambda: model.train(method, **_METHOD_KWARGS.get(method, {})),
+                    len(model._ngrams),
+                    "contexts",
+                )
+
+            # Scoring is timed from ngrams collected in advance, so that it
+            # does not include the collection measured above.
+            model.train(_MODEL_METHOD)
+            heldout = _heldout_ngrams(model, corpus)
+            length_probs = (model._l, model._l0)
+            _add(
+                "score",
+                size,
+                order,
+                lambda: _corpus_perplexity(
+                    _heldout_scores(model._p, model._p0, length_probs, heldout)
+                ),
+                size,
+                "sequences",
+            )
+
+            n_generated = min(size, _MAX_GENERATED)
+            _add(
+                "random_seqs",
+                size,
+                order,
+                lambda: model.random_seqs(k=n_generated, seed=seed),
+                n_generated,
+                "sequences",
+            )
+
+    return results
+
+
+def scaling(results):
+    """
+    Returns the scaling exponents of the benchmarks.
+
+    For each benchmark and pair of orders run with more than one corpus
+    size, the exponent is the slope of a least-squares fit of the running
+    time against the corpus size, in logarithmic scale; a value of 1.0
+    indicates linear scaling.
+
+    Parameters
+    ----------
+    results: list
+        The results, as returned by `run_benchmarks()`.
+
+    Returns
+    -------
+    exponents: dict
+        A dictionary of tuples of benchmark name and orders to their
+        scaling exponents.
+    """
+
+    curves = {}
+    for result in results:
+        key = (result["name"], tuple(result["orders"]))
+        if result["seconds"] > 0:
+            curves.setdefault(key, []).append(
+                (math.log(result["size"]), math.log(result["seconds"]))
+            )
+
+    exponents = {}
+    for key, points in curves.items():
+        if len({x for x, _ in points}) < 2:
+            continue
+        mean_x = sum([x for x, _ in points]) / len(points)
+        mean_y = sum([y for _, y in points]) / len(points)
+        exponents[key] = sum([(x - mean_x) * (y - mean_y) for x, y in points]) / sum(
+            [(x - mean_x) ** 2 for x, _ in points]
+        )
+
+    return exponents
+
+
+def save_results(results, filename):
+    """
+    Writes the results of the benchmark suite to a JSON file.
+
+    Parameters
+    ----------
+    results: list
+        The results, as returned by `run_benchmarks()`.
+
+    filename: str
+        The path to the file to be written.
+    """
+
+    data = {
+        "format": "lpngram-bench",
+        "version": 1,
+        "python": platform.python_version(),
+        "results": results,
+    }
+    with open(filename, "w", encoding="utf-8") as handler:
+        json.dump(data, handler, indent=2)
+
+
+def load_results(filename):
+    """
+    Reads the results of the benchmark suite from a JSON file.
+
+    Parameters
+    ----------
+    filename: str
+        The path to a file written by `save_results()`.
+
+    Returns
+    -------
+    results: list
+        The results, as returned by `run_benchmarks()`.
+    """
+
+    with open(filename, encoding="utf-8") as handler:
+        data = json.load(handler)
+
+    if data.get("format") != "lpngram-bench":
+        raise ValueError("File '%s' is not a benchmark file." % filename)
+
+    return data["results"]
+
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    Compares the results of the benchmark suite against a baseline.
+
+    Parameters
+    ----------
+    results: list
+        The results, as returned by `run_benchmarks()`.
+
+    baseline: list
+        The results of the baseline, as returned by `run_benchmarks()` or
+        `load_results()`.
+
+    tolerance: float
+        The relative decrease of throughput allowed before a benchmark is
+        reported as a regression. Defaults to 0.2.
+
+    Returns
+    -------
+    comparison: list
+        A list of dictionaries, one for each benchmark found in both sets of
+        results, with its "name", "size" and "orders", the "ratio" of the
+        throughput to the baseline one, and whether it is a "regression".
+    """
+
+    def _key(result):
+        return result["name"], result["size"], tuple(result["orders"])
+
+    reference = {_key(result): result for result in baseline}
+
+    comparison = []
+    for result in results:
+        base = reference.get(_key(result))
+        if not base:
+            continue
+        ratio = result["throughput"] / base["throughput"]
+        comparison.append(
+            {
+                "name": result["name"],
+                "size": result["size"],
+                "orders": result["orders"],
+                "ratio": ratio,
+                "regression": ratio < 1.0 - tolerance,
+            }
+        )
+
+    return comparison
+
+
+def format_result(result):
+    """
+    Returns a line of text describing a benchmark result.
+    """
+
+    line = "%-22s size=%-8i orders=%-6s %10.4fs %14.1f %s/s" % (
+        result["name"],
+        result["size"],
+        "%i,%i" % tuple(result["orders"]),
+        result["seconds"],
+        result["throughput"],
+        result["unit"],
+    )
+    if result["peak_memory"] is not None:
+        line += "  peak=%.1fMiB" % (result["peak_memory"] / 2 ** 20)
+
+    return line
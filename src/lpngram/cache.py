@@ -0,0 +1,86 @@
+"""
+Module providing a bounded cache for the results of scoring methods.
+"""
+
+# Import Python standard libraries
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Bounded mapping which discards the least recently used entries.
+
+    The cache keeps counters of hits, misses and evictions, which are not
+    reset when the cache is cleared, so that they describe all the traffic
+    since the cache was created.
+    """
+
+    def __init__(self, maxsize):
+        """
+        Initialize an LRUCache object.
+
+        Parameters
+        ----------
+        maxsize: int
+            The maximum number of entries in the cache. Must be at least 1.
+        """
+
+        if maxsize < 1:
+            raise ValueError("Cache size must be at least 1.")
+
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key, default=None):
+        """
+        Returns the value of a key, marking it as the most recently used.
+        """
+
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+
+        return value
+
+    def put(self, key, value):
+        """
+        Stores the value of a key, discarding the least recently used entry
+        if the cache is full.
+        """
+
+        self._data[key] = value
+        self._data.move_to_end(key)
+        if len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """
+        Removes all entries from the cache.
+        """
+
+        self._data.clear()
+
+    def info(self):
+        """
+        Returns a dictionary with the statistics of the cache.
+        """
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "maxsize": self.maxsize,
+            "size": len(self._data),
+        }
+
+    def __len__(self):
+        return len(self._data)
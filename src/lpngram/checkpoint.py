@@ -0,0 +1,265 @@
+"""
+Module providing checkpoints for resuming long operations.
+
+The checkpoints of counting hold a pickled copy of a model in the middle of
+counting, along with the number of sequences counted so far and their
+digest, so that a resumed call can verify that it is given the same corpus.
+They are written atomically, replacing any previous checkpoint only once the
+new one is complete, so that a process killed while writing never leaves a
+corrupted checkpoint.
+
+The checkpoints of training are logs, so that each checkpoint only writes
+the contexts smoothed since the previous one: a header, holding a digest of
+the counts being smoothed and the training parameters, is followed by the
+records appended at each checkpoint. A record left incomplete by a process
+killed while appending it is discarded when the log is read.
+
+As checkpoints are pickles, they should only be loaded from trusted sources.
+"""
+
+# Import Python standard libraries
+import hashlib
+import os
+import pickle
+
+# Identifier and version of the format of checkpoints.
+_FORMAT = "lpngram-checkpoint"
+_VERSION = 2
+
+# Modulo for the order-independent sums of the hashes of counts.
+_DIGEST_MOD = 1 << 128
+
+
+def corpus_digest():
+    """
+    Returns a new hash object for the digest of a sequence of sequences.
+    """
+
+    return hashlib.blake2b(digest_size=16)
+
+
+def update_digest(digest, sequences):
+    """
+    Updates the digest of a corpus with a list of sequences.
+
+    Sequences are hashed from the representation of their states, so that
+    equal sequences given as strings, lists or tuples have the same digest;
+    the states must thus have a stable representation (such as strings or
+    integers).
+    """
+
+    for sequence in sequences:
+        digest.update(repr(tuple(sequence)).encode("utf-8"))
+        digest.update(b"\n")
+
+
+def _entry_hash(entry):
+    """
+    Internal function returning the hash of an entry of counts, as an integer.
+    """
+
+    digest = hashlib.blake2b(repr(entry).encode("utf-8"), digest_size=16)
+    return int.from_bytes(digest.digest(), "little")
+
+
+def counts_digest(model):
+    """
+    Returns the hexadecimal digest of the counts of a model.
+
+    The hashes of the entries of the ngram and length counts are summed, so
+    that the digest does not depend on their order (which differs, for
+    example, between models counted in memory and with `count_external()`).
+    As in `update_digest()`, the states must have a stable representation.
+    """
+
+    ngrams_sum = 0
+    for context, counter in model._ngrams.items():
+        for state, count in counter.items():
+            ngrams_sum += _entry_hash((context, state, count))
+    lengths_sum = sum(
+        [_entry_hash((length, count)) for length, count in model._seqlens.items()]
+    )
+
+    digest = corpus_digest()
+    digest.update(model._store.encode("utf-8"))
+    for value in [ngrams_sum, lengths_sum]:
+        digest.update((value % _DIGEST_MOD).to_bytes(16, "little"))
+
+    return digest.hexdigest()
+
+
+def _write_atomic(filename, state):
+    """
+    Internal function pickling a state to a file, replacing it atomically.
+    """
+
+    # The temporary file is flushed to disk before replacing the previous
+    # file, so that one of the two is always complete.
+    tmp_filename = "%s.tmp" % filename
+    with open(tmp_filename, "wb") as handler:
+        pickle.dump(state, handler, protocol=pickle.HIGHEST_PROTOCOL)
+        handler.flush()
+        os.fsync(handler.fileno())
+    os.replace(tmp_filename, filename)
+
+
+def _check_header(state, filename, stage):
+    """
+    Internal function raising a `ValueError` if a state read from a file is
+    not the header of a checkpoint written by `stage`.
+    """
+
+    if not isinstance(state, dict) or state.get("format") != _FORMAT:
+        raise ValueError("'%s' is not a checkpoint file." % filename)
+    if state["version"] != _VERSION:
+        raise ValueError(
+            "Checkpoint '%s' was written by an incompatible version." % filename
+        )
+    if state["stage"] != stage:
+        raise ValueError(
+            "Checkpoint '%s' was written by '%s', not by '%s'."
+            % (filename, state["stage"], stage)
+        )
+
+
+def write_checkpoint(filename, stage, model, position, digest=None):
+    """
+    Writes a checkpoint of a model to disk.
+
+    Parameters
+    ----------
+    filename: str
+        The path to the checkpoint file, which is replaced atomically.
+
+    stage: str
+        The name of the operation (such as "add_sequences").
+
+    model: NgramModel
+        The model to be stored.
+
+    position: int
+        The number of items of the operation processed so far.
+
+    digest: str
+        The hexadecimal digest of the items processed so far, if any.
+    """
+
+    state = {
+        "format": _FORMAT,
+        "version": _VERSION,
+        "stage": stage,
+        "position": position,
+        "digest": digest,
+        "model": model,
+    }
+
+    _write_atomic(filename, state)
+
+
+def read_checkpoint(filename, stage):
+    """
+    Reads a checkpoint written by `write_checkpoint()`.
+
+    Parameters
+    ----------
+    filename: str
+        The path to the checkpoint file.
+
+    stage: str
+        The name of the operation the checkpoint must have been written by;
+        a `ValueError` is raised if it was written by another one.
+
+    Returns
+    -------
+    state: dict
+        A dictionary with the "stage", the "position", the "digest" and the
+        "model" of the checkpoint, or None if the file does not exist.
+    """
+
+    if not os.path.exists(filename):
+        return None
+
+    with open(filename, "rb") as handler:
+        state = pickle.load(handler)
+
+    _check_header(state, filename, stage)
+
+    return state
+
+
+def start_log(filename, stage, header):
+    """
+    Starts a checkpoint log, replacing any previous file atomically.
+
+    Parameters
+    ----------
+    filename: str
+        The path to the checkpoint file.
+
+    stage: str
+        The name of the operation (such as "train").
+
+    header: dict
+        The data identifying the operation, such as the digest of its input
+        and its parameters, which is returned by `read_log()`.
+    """
+
+    state = dict(header, format=_FORMAT, version=_VERSION, stage=stage)
+    _write_atomic(filename, state)
+
+
+def append_log(filename, record):
+    """
+    Appends a record to a checkpoint log started by `start_log()`, flushing
+    it to disk.
+    """
+
+    with open(filename, "ab") as handler:
+        pickle.dump(record, handler, protocol=pickle.HIGHEST_PROTOCOL)
+        handler.flush()
+        os.fsync(handler.fileno())
+
+
+def read_log(filename, stage):
+    """
+    Reads a checkpoint log written by `start_log()` and `append_log()`.
+
+    A trailing record left incomplete by a process killed while appending it
+    is discarded and truncated from the file, so that new records can be
+    appended after the complete ones.
+
+    Parameters
+    ----------
+    filename: str
+        The path to the checkpoint file.
+
+    stage: str
+        The name of the operation the log must have been written by; a
+        `ValueError` is raised if it was written by another one.
+
+    Returns
+    -------
+    state: tuple
+        A tuple of the header (as a dictionary) and of the list of complete
+        records of the log, or None if the file does not exist.
+    """
+
+    if not os.path.exists(filename):
+        return None
+
+    records = []
+    with open(filename, "rb") as handler:
+        header = pickle.load(handler)
+        _check_header(header, filename, stage)
+        end = handler.tell()
+        while True:
+            try:
+                records.append(pickle.load(handler))
+            except (EOFError, pickle.UnpicklingError, ValueError, IndexError):
+                break
+            end = handler.tell()
+
+    if end < os.path.getsize(filename):
+        os.truncate(filename, end)
+
+    return header, records
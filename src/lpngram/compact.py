@@ -0,0 +1,284 @@
+"""
+Module providing compact, array-backed tables for inference-only models.
+
+Trained models hold their smoothed log-probabilities in dictionaries of
+dictionaries, with a hash table and a float object for each observed state
+of each context. Once a model is no longer going to be trained, the same
+data can be stored in flat arrays, with the states of each context sorted by
+an integer identifier, so that each observed state costs a state identifier
+and a double, and is found with a binary search.
+
+The module also provides the conversion of flat arrays to and from the
+states pickled by models, which use pickle protocol 5 buffers when available.
+"""
+
+# Import Python standard libraries
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+import pickle
+import sys
+
+
+class CompactTable(Mapping):
+    """
+    Read-only mapping of contexts to distributions backed by flat arrays.
+
+    The table replaces the dictionaries of observed and unobserved
+    log-probabilities of an `NgramModel`: it implements the interface of a
+    (read-only) dictionary of contexts to dictionaries of state values, built
+    on demand, while the `.unobserved` mapping gives the value of unobserved
+    states of each context. Scoring should use `.ngram_logprob()`, which
+    does not build any dictionary.
+    """
+
+    def __init__(self, dists, unobserved, elm_symbol="###"):
+        """
+        Initialize a CompactTable object.
+
+        Parameters
+        ----------
+        dists: dict
+            A dictionary of contexts to dictionaries of observed states and
+            their values, such as `NgramModel._p`.
+
+        unobserved: dict
+            A dictionary of contexts to the value of unobserved states, such
+            as `NgramModel._p0`.
+
+        elm_symbol: object
+            The symbol used as transition symbol replacement in the contexts.
+            Defaults to "###".
+        """
+
+        self._elm = elm_symbol
+        self._index = {}
+        self._state_ids = {}
+        self._symbols = []
+        self._offsets = array("q", [0])
+        self._states = array("q")
+        self._values = array("d")
+        self._unobserved = array("d")
+
+        for row, (context, dist) in enumerate(dists.items()):
+            self._index[context] = row
+            entries = sorted(
+                [(self._state_id(state), value) for state, value in dist.items()]
+            )
+            self._states.extend([state_id for state_id, _ in entries])
+            self._values.extend([value for _, value in entries])
+            self._offsets.append(len(self._states))
+            self._unobserved.append(unobserved[context])
+
+        self.unobserved = _UnobservedView(self)
+
+    @classmethod
+    def from_arrays(cls, contexts, symbols, arrays, elm_symbol="###"):
+        """
+        Builds a table directly from its arrays, without copying them.
+
+        Parameters
+        ----------
+        contexts: list
+            The contexts of the rows, in order.
+
+        symbols: list
+            The states indexed by the state identifiers of the arrays.
+
+        arrays: tuple
+            A tuple with the arrays (or memoryviews) of row offsets (one more
+            than the number of rows), state identifiers sorted within each
+            row, values, and values of unobserved states of each row.
+
+        elm_symbol: object
+            The symbol used as transition symbol replacement in the contexts.
+            Defaults to "###".
+        """
+
+        table = cls({}, {}, elm_symbol)
+        table._index = {context: row for row, context in enumerate(contexts)}
+        table._symbols = list(symbols)
+        table._state_ids = {state: idx for idx, state in enumerate(table._symbols)}
+        table._offsets, table._states, table._values, table._unobserved = arrays
+
+        return table
+
+    def _state_id(self, state):
+        """
+        Internal method returning the identifier of a state, creating it if
+        needed.
+        """
+
+        state_id = self._state_ids.get(state)
+        if state_id is None:
+            state_id = self._state_ids[state] = len(self._symbols)
+            self._symbols.append(state)
+
+        return state_id
+
+    def _row_value(self, row, state):
+        """
+        Internal method returning the value of a state in a row.
+        """
+
+        state_id = self._state_ids.get(state)
+        if state_id is not None:
+            start, end = self._offsets[row], self._offsets[row + 1]
+            pos = bisect_left(self._states, state_id, start, end)
+            if pos < end and self._states[pos] == state_id:
+                return self._values[pos]
+
+        return self._unobserved[row]
+
+    def ngram_logprob(self, ngram, state):
+        """
+        Returns the log-probability of a state in a context.
+
+        The results are the same of the dictionaries the table was built
+        from, including the chain rule backoff for unobserved contexts.
+        """
+
+        # The lookup of observed contexts is inlined, as this is the hot path
+        # of scoring.
+        row = self._index.get(ngram)
+        if row is not None:
+            state_id = self._state_ids.get(state)
+            if state_id is not None:
+                end = self._offsets[row + 1]
+                pos = bisect_left(self._states, state_id, self._offsets[row], end)
+                if pos < end and self._states[pos] == state_id:
+                    return self._values[pos]
+            return self._unobserved[row]
+
+        zero_row = self._index[(self._elm,)]
+        return sum(
+            [
+                self._row_value(
+                    zero_row, state if seq_state == self._elm else seq_state
+                )
+                for seq_state in ngram
+            ]
+        )
+
+    def __getitem__(self, context):
+        row = self._index[context]
+        start, end = self._offsets[row], self._offsets[row + 1]
+        return {
+            self._symbols[state_id]: value
+            for state_id, value in zip(self._states[start:end], self._values[start:end])
+        }
+
+    def __contains__(self, context):
+        return context in self._index
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+
+class _UnobservedView(Mapping):
+    """
+    Read-only mapping of the contexts of a CompactTable to the value of
+    their unobserved states.
+    """
+
+    def __init__(self, table):
+        self._table = table
+
+    def __getitem__(self, context):
+        return self._table._unobserved[self._table._index[context]]
+
+    def __contains__(self, context):
+        return context in self._table._index
+
+    def __iter__(self):
+        return iter(self._table._index)
+
+    def __len__(self):
+        return len(self._table._index)
+
+
+class CompactCounts:
+    """
+    Read-only collection of keys and integer counts backed by an array.
+
+    The class replaces the ngram space of an `NgramModel` used for random
+    generation, which is only iterated over, with a list of keys and an
+    array of counts.
+    """
+
+    def __init__(self, counts):
+        """
+        Initialize a CompactCounts object.
+
+        Parameters
+        ----------
+        counts: dict
+            A dictionary of keys to integer counts.
+        """
+
+        self._keys = list(counts)
+        self._counts = array("q", counts.values())
+
+    @classmethod
+    def from_arrays(cls, keys, counts):
+        """
+        Builds a collection from a list of keys and an array (or memoryview)
+        of counts, without copying them.
+        """
+
+        compact = cls({})
+        compact._keys, compact._counts = list(keys), counts
+
+        return compact
+
+    def items(self):
+        return zip(self._keys, self._counts)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def dump_array(arr, protocol):
+    """
+    Returns the pickle state of an array.
+
+    With pickle protocol 5 or higher, the memory of the array is wrapped in
+    a `pickle.PickleBuffer`, so that it is not copied when pickling and can
+    be transferred out-of-band; otherwise, a copy of the bytes is returned.
+    The state includes the type code and the byte order of the array.
+    """
+
+    # Arrays restored from a pickle are memoryviews, with their type code
+    # as format.
+    typecode = arr.typecode if isinstance(arr, array) else arr.format
+    if protocol >= 5:
+        data = pickle.PickleBuffer(arr)
+    else:
+        data = bytes(arr)
+
+    return typecode, sys.byteorder, data
+
+
+def load_array(state):
+    """
+    Returns an array-like object from a state returned by `dump_array()`.
+
+    The result is a `memoryview` of the pickled data, so that out-of-band
+    buffers are not copied, unless the byte order of the machine differs,
+    in which case a swapped copy is returned as an `array.array`.
+    """
+
+    typecode, byteorder, data = state
+
+    if byteorder != sys.byteorder:
+        arr = array(typecode, bytes(data))
+        arr.byteswap()
+        return arr
+
+    return memoryview(data).cast("B").cast(typecode)
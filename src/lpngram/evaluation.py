@@ -0,0 +1,538 @@
+"""
+Module providing methods for evaluating Ngram models on held-out data.
+
+The methods here offered build upon the `NgramModel` class, avoiding
+unnecessary recounting and resmoothing when the same corpus is used for
+evaluating different partitions or training parameters.
+"""
+
+# Import Python standard libraries
+from itertools import islice
+import math
+import random
+
+# Import from namespace
+from .ngrams import NgramModel, get_all_posngrams, _PAD_SYMBOL, _ELM_SYMBOL
+from .ngrams import _ngram_logprob, _length_logprobs, _seq_as_tuple, _seq_len
+from .smoothing import smooth_dist, _normalize_dist, _count_summary
+from .parallel import imap
+
+
+def _corpus_perplexity(scored, base=2.0):
+    """
+    Internal function returning the cross-entropy and perplexity of a corpus.
+
+    The cross-entropy is that of the entire corpus (i.e., weighted by the
+    number of states in each sequence), as in `NgramModel.perplexity()` for
+    a single sequence. `scored` is an iterable over tuples of the score and
+    the length of each sequence; the function returns a tuple of the total
+    score, the number of states, the cross-entropy, and the perplexity, the
+    last two being None if there are no states.
+    """
+
+    total_score, n_states = 0.0, 0
+    for score, length in scored:
+        total_score += score
+        n_states += length
+
+    if not n_states:
+        return total_score, n_states, None, None
+
+    cross_entropy = -(total_score / math.log(base)) / n_states
+    return total_score, n_states, cross_entropy, base ** cross_entropy
+
+
+def _heldout_ngrams(model, sequences):
+    """
+    Internal function collecting the ngrams of a set of sequences.
+
+    Returns a list with, for each sequence, the list of its ngrams as tuples
+    of context and state, and its length, so that the sequences can be
+    scored repeatedly with `_heldout_scores()` without collecting them again.
+    """
+
+    return [
+        (
+            [
+                (ngram[0], ngram[1])
+                for ngram in get_all_posngrams(
+                    sequence, model._pre, model._post, model._padsymbol
+                )
+            ],
+            _seq_len(sequence),
+        )
+        for sequence in sequences
+    ]
+
+
+def _heldout_scores(p, p0, length_probs, heldout):
+    """
+    Internal function iterating over the scores of collected ngrams.
+
+    Yields tuples of score and length for each sequence collected by
+    `_heldout_ngrams()`, scored as in `NgramModel.score()` from the
+    probability tables `p` and `p0` and the length log-probabilities
+    returned by `_length_logprobs()`.
+    """
+
+    for ngrams, length in heldout:
+        score = sum(
+            [_ngram_logprob(p, p0, context, state) for context, state in ngrams]
+        )
+        yield score + length_probs[0].get(length, length_probs[1]), length
+
+
+def _fold_perplexity(model, sequences):
+    """
+    Internal function returning the corpus perplexity of a set of sequences,
+    on a logarithmic base of 2.0 as in `NgramModel.perplexity()`.
+    """
+
+    return _corpus_perplexity(
+        [(model.score(sequence), _seq_len(sequence)) for sequence in sequences]
+    )[3]
+
+
+def kfold_perplexity(
+    sequences,
+    k=10,
+    pre_order=0,
+    post_order=0,
+    pad_symbol=_PAD_SYMBOL,
+    method="laplace",
+    normalize=False,
+    bins=None,
+    seed=None,
+    **kwargs
+):
+    """
+    Returns the held-out perplexity of a k-fold cross-validation.
+
+    The sequences are randomly partitioned in `k` folds and, for each fold, a
+    model trained on all other folds is used to compute the perplexity of
+    the held-out sequences. Instead of training `k` different models, the
+    ngrams of the full corpus are collected and smoothed a single time; the
+    sequences of each fold are then removed from the model, and only the
+    contexts affected by the removal are smoothed again, which yields the
+    same results of training on the remaining folds. If the number of bins
+    is not informed and the removal of a fold changes the number of observed
+    states, all contexts need to be smoothed again for that fold.
+
+    Parameters
+    ----------
+    sequences: list
+        The list of sequences to be evaluated.
+
+    k: int
+        The number of folds. Must be at least 2 and at most the number of
+        sequences, and each fold must hold at least one state, as the
+        perplexity of a fold is computed per state. Defaults to 10.
+
+    pre_order: int or list
+        The preceding orders of the model, as in the `NgramModel`
+        constructor. Defaults to 0.
+
+    post_order: int or list
+        The following orders of the model, as in the `NgramModel`
+        constructor. Defaults to 0.
+
+    pad_symbol: object
+        The padding symbol of the model, as in the `NgramModel` constructor.
+        Defaults to "$$$".
+
+    method: str
+        The smoothing method, as in `NgramModel.train()`. Defaults to
+        "laplace".
+
+    normalize: boolean
+        Whether to normalize the log-probabilities, as in
+        `NgramModel.train()`. Defaults to False.
+
+    bins: int
+        The number of bins, as in `NgramModel.train()`.
+
+    seed: obj
+        Any hasheable object, used to feed the random number generator for
+        partitioning the sequences in folds.
+
+    kwargs: additional arguments
+        Additional arguments passed to the smoothing method.
+
+    Returns
+    -------
+    perplexities: list
+        A list of `k` floats with the perplexity of each fold.
+    """
+
+    sequences = list(sequences)
+    if k < 2 or k > len(sequences):
+        raise ValueError("Number of folds must be in range [2, %i]." % len(sequences))
+
+    # Partition the sequences in folds, using a local random number generator
+    # in order not to interfere with the global one.
+    indices = list(range(len(sequences)))
+    random.Random(seed).shuffle(indices)
+    folds = [[sequences[idx] for idx in indices[fold::k]] for fold in range(k)]
+    if not all([any(fold) for fold in folds]):
+        raise ValueError("Held-out sequences of some fold have no states.")
+
+    # Collect and smooth the full corpus a single time, keeping references to
+    # the full smoothed distributions, which are not changed when the model
+    # is cleared by `.remove_sequences()` (a new dictionary is built).
+    model = NgramModel(pre_order, post_order, pad_symbol, sequences)
+    model.train(method=method, normalize=normalize, bins=bins, **kwargs)
+    full_bins, full_p, full_p0 = model._bins, model._p, model._p0
+
+    perplexities = []
+    for fold in folds:
+        # Collect the contexts that are affected by the fold.
+        affected = {
+            ngram[0]
+            for sequence in fold
+            for ngram in get_all_posngrams(
+                sequence, model._pre, model._post, model._padsymbol
+            )
+        }
+
+        model.remove_sequences(fold)
+        if model._get_bins(bins) != full_bins:
+            model.train(method=method, normalize=normalize, bins=bins, **kwargs)
+        else:
+            # Start from a shallow copy of the full distributions and smooth
+            # again only the affected contexts, dropping those which are no
+            # longer observed.
+            model._bins = full_bins
+            model._p, model._p0 = dict(full_p), dict(full_p0)
+            for context in affected:
+                if context in model._ngrams:
+                    model._p[context], model._p0[context] = model._smooth(
+                        model._ngrams[context]
+                    )
+                else:
+                    del model._p[context]
+                    del model._p0[context]
+            model._train_lengths()
+            model._finish_training()
+
+        perplexities.append(_fold_perplexity(model, fold))
+
+        # Restore the counts of the full corpus.
+        model.add_sequences(fold)
+
+    return perplexities
+
+
+def _sweep_group(shared, group):
+    """
+    Internal function for evaluating a group of training configurations.
+
+    All configurations in a group share the smoothing method, its arguments,
+    and the number of bins, differing only in normalization, so that the
+    smoothing is performed a single time.
+    """
+
+    counters, summaries, heldout, default_bins, length_probs = shared
+    method, kwargs, bins, normalize_flags = group
+
+    smoothed = {
+        context: smooth_dist(
+            counter,
+            method=method,
+            bins=bins or default_bins,
+            **dict(summaries[context], **kwargs)
+        )
+        for context, counter in counters.items()
+    }
+
+    perplexities = []
+    for normalize in normalize_flags:
+        if normalize:
+            dists = {
+                context: _normalize_dist(*dist) for context, dist in smoothed.items()
+            }
+        else:
+            dists = smoothed
+        p = {context: dist[0] for context, dist in dists.items()}
+        p0 = {context: dist[1] for context, dist in dists.items()}
+
+        perplexities.append(
+            _corpus_perplexity(_heldout_scores(p, p0, length_probs, heldout))[3]
+        )
+
+    return perplexities
+
+
+def sweep(model, sequences, configs, n_jobs=1):
+    """
+    Returns the held-out perplexity for a grid of training configurations.
+
+    This function evaluates different smoothing methods and parameters from
+    a single collection of ngrams, without changing the model. The
+    computation shared by all configurations is performed a single time: the
+    ngrams of the held-out sequences are collected in advance, only the
+    contexts needed for scoring them are smoothed, the default number of
+    bins and the statistics of each context (the sum of its counts and, for
+    Simple Good-Turing, the frequencies of frequencies) are computed once,
+    and configurations differing only in normalization reuse the same
+    smoothing. The results are the same of
+    training the model with each configuration and computing the perplexity
+    of the held-out sequences as a corpus (i.e., weighted by the number of
+    states in each sequence).
+
+    Parameters
+    ----------
+    model: NgramModel
+        The model holding the ngram counts, which does not need to be
+        trained.
+
+    sequences: list
+        The list of held-out sequences to be evaluated, which must hold at
+        least one state.
+
+    configs: list
+        A list of training configurations, each a tuple of `(method, kwargs,
+        normalize, bins)`, as in `NgramModel.train()`; trailing elements can
+        be omitted, defaulting to no additional arguments, no normalization,
+        and the default number of bins.
+
+    n_jobs: int
+        The number of processes for evaluating the configurations in
+        parallel. None or values lower than one use all available CPUs.
+        Defaults to 1.
+
+    Returns
+    -------
+    perplexities: list
+        A list of floats with the held-out perplexity of each configuration,
+        in the same order of `configs`.
+    """
+
+    # Collect the held-out ngrams and the contexts needed for scoring them,
+    # including the zero-context used for backoff.
+    heldout = _heldout_ngrams(model, sequences)
+    if not sum([length for _, length in heldout]):
+        raise ValueError("Held-out sequences have no states.")
+    contexts = {context for ngrams, _ in heldout for context, _ in ngrams}
+    contexts.add((_ELM_SYMBOL,))
+    counters = {
+        context: model._ngrams[context]
+        for context in contexts
+        if context in model._ngrams
+    }
+
+    # Group the configurations by smoothing, keeping track of their positions.
+    groups = {}
+    for idx, config in enumerate(configs):
+        method, kwargs, normalize, bins = (
+            tuple(config)
+            + (
+                {},
+                False,
+                None,
+            )[len(config) - 1 :]
+        )
+        kwargs = kwargs or {}
+        key = (method, tuple(sorted(kwargs.items())), bins)
+        if key not in groups:
+            groups[key] = (method, kwargs, bins, [], [])
+        groups[key][3].append(normalize)
+        groups[key][4].append(idx)
+
+    # Compute a single time the statistics of each context shared by all
+    # smoothing methods, including the frequencies of frequencies only if
+    # they are used.
+    with_fofs = any([group[0] == "sgt" for group in groups.values()])
+    summaries = {
+        context: _count_summary(counter, with_fofs)
+        for context, counter in counters.items()
+    }
+
+    shared = (
+        counters,
+        summaries,
+        heldout,
+        model._get_bins(),
+        _length_logprobs(model._seqlens),
+    )
+    tasks = [group[:4] for group in groups.values()]
+
+    perplexities = [None] * len(configs)
+    for group, results in zip(
+        groups.values(), imap(_sweep_group, tasks, n_jobs, shared)
+    ):
+        for idx, perplexity in zip(group[4], results):
+            perplexities[idx] = perplexity
+
+    return perplexities
+
+
+def _evaluate_chunk(shared, chunk):
+    """
+    Internal function for evaluating a chunk of sequences.
+
+    Each sequence is scored a single time, collecting the statistics for the
+    records returned by `evaluate_records()`.
+    """
+
+    model, base = shared
+    zero_probs = model._p.get((_ELM_SYMBOL,), {})
+
+    records = []
+    for sequence in chunk:
+        score, n_ngrams, n_backoff = 0.0, 0, 0
+        for context, state, _ in get_all_posngrams(
+            sequence, model._pre, model._post, model._padsymbol
+        ):
+            score += _ngram_logprob(model._p, model._p0, context, state)
+            n_ngrams += 1
+            if context not in model._p:
+                n_backoff += 1
+
+        length = _seq_len(sequence)
+        score += model._l.get(length, model._l0)
+        states = _seq_as_tuple(sequence)
+        record = {
+            "score": score,
+            "length": length,
+            "oov": sum([1 for state in states if state not in zero_probs]),
+            "ngrams": n_ngrams,
+            "backoff": n_backoff,
+            "entropy": None,
+            "perplexity": None,
+        }
+        if length:
+            record["entropy"] = -(score / math.log(base)) / length
+            record["perplexity"] = base ** record["entropy"]
+        records.append(record)
+
+    return records
+
+
+def evaluate_records(model, corpus, base=2.0, n_jobs=1, chunk_size=1000):
+    """
+    Build an iterator over the evaluation of each sequence in a corpus.
+
+    Each sequence is scored a single time, computing together the values
+    returned by `NgramModel.score()`, `NgramModel.entropy()` and
+    `NgramModel.perplexity()`, as well as the number of out-of-vocabulary
+    states and of ngrams whose context was not observed in training (for
+    which the log-probability is computed by backoff). The corpus is
+    consumed lazily, in chunks.
+
+    Parameters
+    ----------
+    model: NgramModel
+        The trained model to be evaluated.
+
+    corpus: iterable
+        The sequences to be evaluated.
+
+    base: float
+        The logarithmic base for the cross-entropy calculation, as in
+        `NgramModel.entropy()`. Defaults to 2.0.
+
+    n_jobs: int
+        The number of processes for evaluating the chunks in parallel. None
+        or values lower than one use all available CPUs. Defaults to 1.
+
+    chunk_size: int
+        The number of sequences in each chunk. Defaults to 1000.
+
+    Returns
+    -------
+    out: iterable
+        An iterable over dictionaries, one for each sequence and in the same
+        order of the corpus, with the "score", the "length", the "entropy"
+        and the "perplexity" of the sequence (None for empty sequences),
+        the number of out-of-vocabulary states ("oov"), and the number of
+        "ngrams" and of those computed by "backoff".
+    """
+
+    # Check the arguments when called, and not when the first record is
+    # requested, as the records are built by a generator.
+    if not model._trained:
+        raise ValueError("Ngram Model was not trained.")
+    if model._keep is not None and "score" not in model._keep:
+        raise ValueError("Ngram Model was compacted without 'score'.")
+    if chunk_size < 1:
+        raise ValueError("Chunk size must be at least 1.")
+
+    def _chunks():
+        iterator = iter(corpus)
+        while True:
+            chunk = list(islice(iterator, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+    def _records():
+        for records in imap(_evaluate_chunk, _chunks(), n_jobs, (model, base)):
+            yield from records
+
+    return _records()
+
+
+def evaluate(model, corpus, base=2.0, n_jobs=1, chunk_size=1000):
+    """
+    Returns the evaluation of a model on a corpus.
+
+    The corpus is evaluated in a single pass, as in `evaluate_records()`,
+    aggregating the statistics of all sequences. The cross-entropy and the
+    perplexity are those of the entire corpus (i.e., weighted by the number
+    of states in each sequence), as in `kfold_perplexity()`.
+
+    Parameters
+    ----------
+    model: NgramModel
+        The trained model to be evaluated.
+
+    corpus: iterable
+        The sequences to be evaluated.
+
+    base: float
+        The logarithmic base for the cross-entropy calculation. Defaults to
+        2.0.
+
+    n_jobs: int
+        The number of processes for evaluating the corpus in parallel. None
+        or values lower than one use all available CPUs. Defaults to 1.
+
+    chunk_size: int
+        The number of sequences evaluated in each chunk. Defaults to 1000.
+
+    Returns
+    -------
+    report: dict
+        A dictionary with the number of "sequences" and of "states", the
+        total "score", the "cross_entropy" and "perplexity" of the corpus,
+        the "oov_rate" (the proportion of out-of-vocabulary states), and the
+        "backoff_rate" (the proportion of ngrams whose context was not
+        observed in training).
+    """
+
+    counts = {"sequences": 0, "oov": 0, "ngrams": 0, "backoff": 0}
+
+    def _scored():
+        for record in evaluate_records(model, corpus, base, n_jobs, chunk_size):
+            counts["sequences"] += 1
+            for key in ["oov", "ngrams", "backoff"]:
+                counts[key] += record[key]
+            yield record["score"], record["length"]
+
+    total_score, n_states, cross_entropy, perplexity = _corpus_perplexity(
+        _scored(), base
+    )
+
+    report = {
+        "sequences": counts["sequences"],
+        "states": n_states,
+        "score": total_score,
+        "cross_entropy": cross_entropy,
+        "perplexity": perplexity,
+        "oov_rate": counts["oov"] / n_states if n_states else 0.0,
+        "backoff_rate": (
+            counts["backoff"] / counts["ngrams"] if counts["ngrams"] else 0.0
+        ),
+    }
+
+    return report
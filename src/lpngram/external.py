@@ -0,0 +1,146 @@
+"""
+Module providing internal methods for out-of-core ngram counting.
+
+Counts are accumulated in memory, keyed by context and state, until a
+memory budget is reached; they are then sorted and spilled to a temporary
+"run" file, one entry per line. Once all sequences are counted, the runs are
+combined with a k-way merge, which reads a single line of each run at a
+time, summing the counts of equal entries. If there are more runs than can
+be opened at once, they are first merged in groups into longer runs.
+
+Entries are keyed by the JSON representation of their context and state,
+which gives a total order for any JSON-serializable symbols and in which all
+the entries of a context are contiguous, so that merged entries can be
+grouped by context in a single pass.
+"""
+
+# Import Python standard libraries
+from itertools import groupby
+from operator import itemgetter
+import heapq
+import json
+import os
+
+# Maximum number of runs merged at once.
+MAX_FAN_IN = 64
+
+
+def run_entries(table):
+    """
+    Returns the sorted list of entries of a table of counts.
+
+    Parameters
+    ----------
+    table: dict
+        A dictionary of tuples of context and state to counts.
+
+    Returns
+    -------
+    entries: list
+        A list of tuples of entry keys (the JSON representation of context
+        and state) and counts, sorted by key.
+    """
+
+    entries = [
+        (json.dumps([list(context), state]), count)
+        for (context, state), count in table.items()
+    ]
+    entries.sort(key=itemgetter(0))
+
+    return entries
+
+
+def write_run(entries, filename):
+    """
+    Writes sorted entries to a run file, one "key<TAB>count" per line.
+
+    As JSON escapes control characters in strings, keys never hold tabs or
+    newlines.
+    """
+
+    with open(filename, "w", encoding="utf-8") as handler:
+        handler.writelines(["%s\t%i\n" % (key, count) for key, count in entries])
+
+
+def read_run(filename):
+    """
+    Iterates over the entries of a run file, as tuples of key and count.
+    """
+
+    with open(filename, encoding="utf-8") as handler:
+        for line in handler:
+            key, count = line.rsplit("\t", 1)
+            yield key, int(count)
+
+
+def merge_runs(runs):
+    """
+    Iterates over the merged entries of sorted runs, summing the counts of
+    equal keys.
+
+    Parameters
+    ----------
+    runs: list
+        A list of iterables of sorted entries, such as those returned by
+        `read_run()` or `run_entries()`.
+
+    Returns
+    -------
+    entries: iterable
+        An iterable over tuples of key and count, sorted by key, with
+        distinct keys.
+    """
+
+    merged = heapq.merge(*runs, key=itemgetter(0))
+    for key, entries in groupby(merged, key=itemgetter(0)):
+        yield key, sum([count for _, count in entries])
+
+
+def reduce_runs(filenames, dirname, fan_in=MAX_FAN_IN):
+    """
+    Merges run files in groups until there are at most `fan_in` of them.
+
+    The merged runs are written to `dirname`, and the runs merged into them
+    are deleted.
+
+    Returns
+    -------
+    filenames: list
+        The list of the remaining run files.
+    """
+
+    n_merged = 0
+    while len(filenames) > fan_in:
+        group, filenames = filenames[:fan_in], filenames[fan_in:]
+        filename = os.path.join(dirname, "merged-%i.run" % n_merged)
+        write_run(merge_runs([read_run(run) for run in group]), filename)
+        for run in group:
+            os.remove(run)
+        filenames.append(filename)
+        n_merged += 1
+
+    return filenames
+
+
+def group_contexts(entries):
+    """
+    Iterates over merged entries grouped by context.
+
+    Parameters
+    ----------
+    entries: iterable
+        An iterable over sorted tuples of keys and counts, as returned by
+        `merge_runs()`.
+
+    Returns
+    -------
+    contexts: iterable
+        An iterable over tuples of a context (as a tuple) and a list of
+        lists of state and count.
+    """
+
+    # Consecutive entries are decoded and compared by their context, as all
+    # the entries of a context are contiguous.
+    decoded = ((json.loads(key), count) for key, count in entries)
+    for context, items in groupby(decoded, key=lambda entry: entry[0][0]):
+        yield tuple(context), [[key[1], count] for key, count in items]
@@ -0,0 +1,657 @@
+"""
+Module providing internal methods for random sequence generation.
+
+The generation follows the observed transition frequencies of a trained
+`NgramModel`, as collected in its `._ngram_space`. Instead of filtering the
+entire ngram space for each new state, the ngrams are indexed in advance by
+the states preceding their last element, and the distributions of candidate
+states are cached, so that generating a state only requires a few lookups.
+"""
+
+# Import Python standard libraries
+from itertools import accumulate
+import math
+import random
+
+# Number of sequences generated with each independent random number
+# generator; this is fixed, so that the sequences generated for a seed are
+# the same no matter how many processes are used.
+_CHUNK_SIZE = 1000
+
+
+class _SearchSpace:
+    """
+    Internal class holding the search space for random sequence generation.
+
+    The candidates for the next state of a random sequence are all the
+    ngrams in the ngram space whose elements but the last match the end of
+    the sequence; the last element of each such ngram is the candidate
+    state, with a weight given by its count scaled by the ngram length
+    (favouring longer ngrams, which better capture the likelihood). As a
+    special case, ngrams of a single element are only candidates for the
+    first state of a sequence with no padding.
+    """
+
+    def __init__(self, ngram_space, pad_symbol, use_post, scale):
+        """
+        Initialize a _SearchSpace object.
+
+        Parameters
+        ----------
+        ngram_space: dict
+            The ngram space of a trained model, as in
+            `NgramModel._ngram_space`.
+
+        pad_symbol: object
+            The padding symbol of the model.
+
+        use_post: bool
+            Whether the model collected following contexts, in which case
+            sequences must end with the padding symbol, which cannot be
+            used anywhere else.
+
+        scale: numeric
+            The exponent used for weighting ngrams according to their
+            length, as in `NgramModel.random_seqs()`.
+        """
+
+        self.pad_symbol = pad_symbol
+        self.use_post = use_post
+
+        # Index the ngrams by their prefix (all elements but the last), also
+        # caching their length and their scaled weight.
+        self.prefixes = {}
+        for key, value in ngram_space.items():
+            self.prefixes.setdefault(key[:-1], []).append(
+                (len(key), key[-1], (value * len(key)) ** scale)
+            )
+        self.max_prefix = max([len(prefix) for prefix in self.prefixes] or [0])
+
+        # Collect the vocabulary of candidate states, used for the dense
+        # rows of candidate weights of batched generation.
+        self.vocab = sorted(
+            {state for entries in self.prefixes.values() for _, state, _ in entries},
+            key=repr,
+        )
+        self.vocab_idx = {state: idx for idx, state in enumerate(self.vocab)}
+
+        self.clear()
+
+    def clear(self):
+        """
+        Clears the values computed on demand by generation calls.
+
+        The distributions of candidates and the completion log-probabilities
+        are cached for each pair of context and remaining length, and can
+        take several times the memory of the model; they are only kept for
+        the duration of a call (see `NgramModel.random_seqs()`), which clears
+        them when done, so that they do not grow over many calls.
+        """
+
+        self._cache = {}
+        self._viable_cache = {}
+
+        # Tables for batched generation, built on demand by `.context_id()`.
+        self._ctx_ids = {}
+        self._ctx_keys = []
+        self._row_of = None
+        self._trans = None
+        self._rows = []
+        self._table = None
+
+    def info(self):
+        """
+        Returns a dictionary with the sizes of the search space.
+
+        The "prefixes" are the distinct ngram prefixes indexed at
+        construction, the "contexts" are the contexts whose weights were
+        computed so far, and the "viable" ones are the pairs of context and
+        remaining length whose completion log-probabilities were computed so
+        far.
+        """
+
+        return {
+            "prefixes": len(self.prefixes),
+            "contexts": len(self._cache),
+            "viable": len(self._viable_cache),
+        }
+
+    def candidates(self, history, cutoff_length, remaining):
+        """
+        Returns the distribution of candidates for the next state.
+
+        Only the candidates from which the sequence can be completed are
+        returned, with their weights multiplied by the probability of
+        completing the sequence after them (see `.completion()`), so that the
+        sequences follow the same distribution of those generated by
+        starting again whenever a dead end is found.
+
+        Parameters
+        ----------
+        history: tuple
+            The sequence generated so far, including the initial padding.
+
+        cutoff_length: int
+            The minimum length of the ngrams to be considered.
+
+        remaining: int
+            The number of states still to be generated, including the next
+            one.
+
+        Returns
+        -------
+        candidates: tuple
+            A tuple of candidate states and a tuple of their cumulative
+            weights, for usage with `random.Random.choices()`, or None if
+            there are no candidates.
+        """
+
+        cache_key = (self._context_key(history, cutoff_length), remaining)
+        if cache_key in self._cache:
+            return self._cache[cache_key]
+
+        weights = self._viable(*cache_key)[0]
+        if weights:
+            candidates = (tuple(weights), tuple(accumulate(weights.values())))
+        else:
+            candidates = None
+        self._cache[cache_key] = candidates
+
+        return candidates
+
+    def completion(self, history, cutoff_length, remaining):
+        """
+        Returns the log-probability of completing a sequence.
+
+        Parameters
+        ----------
+        history: tuple
+            The sequence generated so far, including the initial padding.
+
+        cutoff_length: int
+            The minimum length of the ngrams to be considered.
+
+        remaining: int
+            The number of states still to be generated.
+
+        Returns
+        -------
+        logprob: float
+            The log-probability that a sequence drawn without looking ahead
+            reaches the desired length (ending with the padding symbol, when
+            following contexts are used) instead of a dead end, or None if no
+            valid sequence can be generated.
+        """
+
+        return self._viable(self._context_key(history, cutoff_length), remaining)[1]
+
+    def _context_key(self, history, cutoff_length):
+        """
+        Internal method returning the key of the generation context.
+
+        Only the last `self.max_prefix` states can match a prefix, besides
+        the information on whether the sequence is empty, so that all
+        histories with the same key share their candidates.
+        """
+
+        suffix = history[max(len(history) - self.max_prefix, 0) :]
+
+        return suffix, bool(history), cutoff_length
+
+    def _next_key(self, context_key, state):
+        """
+        Internal method returning the context key following a state.
+        """
+
+        return self._context_key(context_key[0] + (state,), context_key[2])
+
+    def _weights(self, context_key, final):
+        """
+        Internal method returning a dictionary of candidates and weights.
+        """
+
+        suffix, non_empty, cutoff_length = context_key
+        weights = {}
+        for prefix_len in range(len(suffix) + 1):
+            if prefix_len + 1 < cutoff_length:
+                continue
+            if prefix_len == 0 and non_empty:
+                continue
+
+            prefix = suffix[len(suffix) - prefix_len :]
+            for _, state, weight in self.prefixes.get(prefix, []):
+                # If the new state would complete the sequence, we can only
+                # use the padding symbol (the boundary symbol) if those are
+                # used; in all other cases, we must make sure that the state
+                # is *not* a padding symbol.
+                if self.use_post and final != (state == self.pad_symbol):
+                    continue
+                weights[state] = weights.get(state, 0) + weight
+
+        return weights
+
+    def _viable(self, context_key, remaining):
+        """
+        Internal method returning the viable candidates of a context.
+
+        The method returns a dictionary of the candidates from which the
+        sequence can be completed, with their weights multiplied by the
+        probability of completing it, and the log-probability of completing
+        the sequence from the context itself (None if it cannot be completed).
+        Values are computed for each context and number of remaining states a
+        single time, with an explicit stack instead of recursion, so that long
+        sequences do not hit the recursion limit.
+
+        Whether a sequence can be completed is tracked apart from the
+        probabilities, which are kept in log space, as their products
+        underflow to zero for long sequences; the weights of the candidates
+        of a context are rescaled so that the largest is 1.0, keeping their
+        proportions.
+        """
+
+        if remaining == 0:
+            return {}, 0.0
+
+        cache = self._viable_cache
+        stack = [(context_key, remaining)]
+        while stack:
+            key = stack[-1]
+            if key in cache:
+                stack.pop()
+                continue
+
+            # Compute the following contexts first, if needed.
+            weights = self._weights(key[0], key[1] == 1)
+            if key[1] > 1:
+                following = {
+                    state: (self._next_key(key[0], state), key[1] - 1)
+                    for state in weights
+                }
+                missing = [
+                    next_key for next_key in following.values() if next_key not in cache
+                ]
+                if missing:
+                    stack.extend(missing)
+                    continue
+                completions = {
+                    state: cache[next_key][1] for state, next_key in following.items()
+                }
+            else:
+                completions = dict.fromkeys(weights, 0.0)
+
+            # Only the candidates with a completion are viable; the
+            # log-probability of completing the sequence from the context is
+            # the log-sum-exp of their log-weights, less the logarithm of the
+            # total weight of the context.
+            logweights = {
+                state: math.log(weight) + completions[state]
+                for state, weight in weights.items()
+                if completions[state] is not None
+            }
+            if logweights:
+                top = max(logweights.values())
+                viable = {
+                    state: math.exp(logweight - top)
+                    for state, logweight in logweights.items()
+                }
+                logprob = top + math.log(sum(viable.values()))
+                cache[key] = (viable, logprob - math.log(sum(weights.values())))
+            else:
+                cache[key] = ({}, None)
+            stack.pop()
+
+        return cache[(context_key, remaining)]
+
+    def context_id(self, np, history, cutoff_length):
+        """
+        Returns the integer identifier of a generation context.
+
+        Identifiers index the tables used by batched generation, which are
+        extended with `numpy` when new contexts are found; the rows for
+        candidates and the transitions to the following contexts are filled
+        on demand, with -2 and -1 marking the missing values.
+        """
+
+        key = self._context_key(history, cutoff_length)
+        ctx_id = self._ctx_ids.get(key)
+        if ctx_id is None:
+            ctx_id = len(self._ctx_keys)
+            self._ctx_ids[key] = ctx_id
+            self._ctx_keys.append(key)
+            self._grow_tables(np, ctx_id + 1, 1)
+
+        return ctx_id
+
+    def _grow_tables(self, np, n_contexts, n_remaining):
+        """
+        Internal method making sure the tables of batched generation can hold
+        the given numbers of contexts and of remaining states.
+        """
+
+        if self._row_of is None:
+            self._row_of = np.full((64, 16), -2, dtype=int)
+            self._trans = np.full((64, len(self.vocab)), -1, dtype=int)
+
+        if n_contexts > self._row_of.shape[0]:
+            size = max(n_contexts, 2 * self._row_of.shape[0])
+            row_of = np.full((size, self._row_of.shape[1]), -2, dtype=int)
+            row_of[: self._row_of.shape[0]] = self._row_of
+            trans = np.full((size, len(self.vocab)), -1, dtype=int)
+            trans[: self._trans.shape[0]] = self._trans
+            self._row_of, self._trans = row_of, trans
+
+        if n_remaining > self._row_of.shape[1]:
+            size = max(n_remaining, 2 * self._row_of.shape[1])
+            row_of = np.full((self._row_of.shape[0], size), -2, dtype=int)
+            row_of[:, : self._row_of.shape[1]] = self._row_of
+            self._row_of = row_of
+
+    def rows(self, np, ctx_ids, remaining):
+        """
+        Returns the rows of candidate weights for an array of contexts.
+
+        Parameters
+        ----------
+        np: module
+            The `numpy` module.
+
+        ctx_ids: array
+            An array of context identifiers, as returned by `.context_id()`.
+
+        remaining: array
+            An array with the number of states still to be generated for
+            each sequence, including the next one.
+
+        Returns
+        -------
+        rows: array
+            An array with the indexes of the rows of viable weights in the
+            table returned by `.table()`, or -1 for contexts with no viable
+            candidates.
+        """
+
+        self._grow_tables(np, 0, int(remaining.max()) + 1)
+        rows = self._row_of[ctx_ids, remaining]
+        for idx in np.nonzero(rows == -2)[0].tolist():
+            ctx_id, rem = int(ctx_ids[idx]), int(remaining[idx])
+            if self._row_of[ctx_id, rem] == -2:
+                weights = self._viable(self._ctx_keys[ctx_id], rem)[0]
+                if not weights:
+                    self._row_of[ctx_id, rem] = -1
+                else:
+                    row = [0.0] * len(self.vocab)
+                    for state, weight in weights.items():
+                        row[self.vocab_idx[state]] = weight
+                    self._row_of[ctx_id, rem] = len(self._rows)
+                    self._rows.append(row)
+                    self._table = None
+            rows[idx] = self._row_of[ctx_id, rem]
+
+        return rows
+
+    def next_contexts(self, np, ctx_ids, choices):
+        """
+        Returns the contexts following the choice of the next states.
+
+        Parameters
+        ----------
+        np: module
+            The `numpy` module.
+
+        ctx_ids: array
+            An array of context identifiers, as returned by `.context_id()`.
+
+        choices: array
+            An array with the index of the next state of each sequence in
+            `self.vocab`.
+
+        Returns
+        -------
+        ctx_ids: array
+            An array with the identifiers of the following contexts.
+        """
+
+        following = self._trans[ctx_ids, choices]
+        for idx in np.nonzero(following < 0)[0].tolist():
+            ctx_id, choice = int(ctx_ids[idx]), int(choices[idx])
+            if self._trans[ctx_id, choice] < 0:
+                suffix, _, cutoff_length = self._ctx_keys[ctx_id]
+                next_id = self.context_id(
+                    np, suffix + (self.vocab[choice],), cutoff_length
+                )
+                self._trans[ctx_id, choice] = next_id
+            following[idx] = self._trans[ctx_id, choice]
+
+        return following
+
+    def table(self, np):
+        """
+        Returns the table of dense rows of weights as a `numpy` array.
+
+        The array is only rebuilt if new rows were added since the last call.
+        """
+
+        if self._table is None:
+            self._table = np.array(self._rows, dtype=float).reshape(
+                len(self._rows), len(self.vocab)
+            )
+
+        return self._table
+
+
+def _viable_lengths(space, start, len_pop, len_w, extra_len, cutoff_length):
+    """
+    Internal function returning the sequence lengths that can be generated.
+
+    The lengths, with padding added, are returned with their weights only if
+    at least one sequence of that length can be generated, so that every
+    sequence that is started can be completed.
+    """
+
+    viable = [
+        (length + extra_len, weight)
+        for length, weight in zip(len_pop, len_w)
+        if space.completion(
+            start,
+            min(cutoff_length, length + extra_len),
+            length + extra_len - len(start),
+        )
+        is not None
+    ]
+
+    return [length for length, _ in viable], [weight for _, weight in viable]
+
+
+def _gen_single_rnd_seq(space, rng, start, seq_len, cutoff_length):
+    """
+    Internal function for generating a single random sequence.
+
+    Parameters
+    ----------
+    space: _SearchSpace
+        The search space for the generation.
+
+    rng: random.Random
+        The random number generator.
+
+    start: tuple
+        The initial state of the sequence (i.e., its initial padding).
+
+    seq_len: int
+        The length of the sequence, including padding, which must be viable
+        (see `_viable_lengths()`).
+
+    cutoff_length: int
+        The minimum length of the ngrams to be considered.
+
+    Returns
+    -------
+    seq: tuple
+        The generated sequence, including padding.
+    """
+
+    # Cutoff length can't obviously be larger than the sequence length, as we
+    # would not be able to find a sequence or ngram shorter than it.
+    cutoff_length = min(cutoff_length, seq_len)
+
+    # As only the candidates from which the sequence can be completed are
+    # drawn, the generation never reaches a dead end.
+    rnd_seq = start
+    while len(rnd_seq) < seq_len:
+        candidates = space.candidates(rnd_seq, cutoff_length, seq_len - len(rnd_seq))
+        rnd_seq += (rng.choices(candidates[0], cum_weights=candidates[1])[0],)
+
+    return rnd_seq
+
+
+def _gen_chunk(shared, task):
+    """
+    Internal function for generating a chunk of random sequences.
+
+    The function can be used in worker processes, with the parameters shared
+    by all chunks in `shared` and the seed and number of sequences of the
+    chunk in `task`.
+    """
+
+    space, start, seq_len, seqlens, extra_len, cutoff_length = shared
+    seed, k = task
+
+    # Get the sequence lengths, either from the user-provided ones (uniformly
+    # drawn) or from the lengths observed in training according to their
+    # frequencies, keeping only those for which a sequence can be generated.
+    if seq_len:
+        len_pop, len_w = _viable_lengths(
+            space, start, seq_len, [1] * len(seq_len), extra_len, cutoff_length
+        )
+    else:
+        len_pop, len_w = _viable_lengths(
+            space, start, seqlens.keys(), seqlens.values(), extra_len, cutoff_length
+        )
+    if not len_pop:
+        return []
+
+    rng = random.Random(seed)
+    return [
+        _gen_single_rnd_seq(
+            space, rng, start, rng.choices(len_pop, len_w)[0], cutoff_length
+        )
+        for _ in range(k)
+    ]
+
+
+def chunk_tasks(k, seed):
+    """
+    Returns the tasks for generating `k` sequences in chunks.
+
+    Each task is a pair of an independent seed, derived from `seed`, and the
+    number of sequences in the chunk.
+    """
+
+    master = random.Random(seed)
+    return [
+        (master.getrandbits(64), min(_CHUNK_SIZE, k - start))
+        for start in range(0, k, _CHUNK_SIZE)
+    ]
+
+
+def gen_batch_seqs(np, space, k, seq_len, seqlens, start, extra_len, params):
+    """
+    Returns random sequences generated in lockstep.
+
+    Instead of generating each sequence in turn, a batch of sequences is
+    advanced a state at a time: the generation context of each sequence is
+    tracked by an integer identifier, its distribution of viable candidates
+    is looked up in the table of dense rows of the search space, and the
+    next states of all sequences are drawn with a single vectorized
+    categorical sampling. As in `_gen_single_rnd_seq()`, only candidates
+    from which the sequences can be completed are drawn, so that every
+    sequence in a batch is completed.
+
+    Parameters
+    ----------
+    np: module
+        The `numpy` module.
+
+    space: _SearchSpace
+        The search space for the generation.
+
+    k: int
+        The number of sequences to be generated.
+
+    seq_len: list
+        An optional list of lengths to be uniformly drawn.
+
+    seqlens: dict
+        The sequence lengths observed in training, with their counts, to be
+        drawn according to their frequencies if `seq_len` is not given.
+
+    start: tuple
+        The initial state of the sequences (i.e., their initial padding).
+
+    extra_len: int
+        The padding added to the lengths.
+
+    params: tuple
+        A tuple of the cutoff length, the maximum batch size and the `numpy`
+        random number generator.
+
+    Returns
+    -------
+    seqs: list
+        A list of `k` sequences, including padding, or an empty list if no
+        sequence can be generated.
+    """
+
+    cutoff_length, batch_size, rng = params
+
+    if seq_len:
+        len_pop, len_w = _viable_lengths(
+            space, start, seq_len, [1] * len(seq_len), extra_len, cutoff_length
+        )
+    else:
+        len_pop, len_w = _viable_lengths(
+            space, start, seqlens.keys(), seqlens.values(), extra_len, cutoff_length
+        )
+    if not len_pop:
+        return []
+    len_p = np.array(len_w, dtype=float)
+    len_p /= len_p.sum()
+
+    rnd_seqs = []
+    while len(rnd_seqs) < k:
+        lengths = rng.choice(len_pop, min(batch_size, k - len(rnd_seqs)), p=len_p)
+
+        # All sequences in a batch start at the same position, so that we can
+        # keep a single counter; the cutoff can depend on the sequence
+        # length, so different contexts are needed for short sequences.
+        ctx = np.array(
+            [
+                space.context_id(np, start, min(cutoff_length, length))
+                for length in lengths.tolist()
+            ]
+        )
+        states = np.zeros((len(lengths), int(lengths.max()) - len(start)), dtype=int)
+
+        pos = len(start)
+        active = np.nonzero(lengths > pos)[0]
+        while active.size:
+            rows = space.rows(np, ctx[active], lengths[active] - pos)
+
+            # Draw the next state of all sequences with a single vectorized
+            # step, by comparing a uniform value scaled to the total weight
+            # of each row with its cumulative weights.
+            cum_weights = space.table(np)[rows].cumsum(axis=1)
+            thresholds = rng.random(active.size) * cum_weights[:, -1]
+            choices = (cum_weights <= thresholds[:, None]).sum(axis=1)
+
+            states[active, pos - len(start)] = choices
+            ctx[active] = space.next_contexts(np, ctx[active], choices)
+            pos += 1
+            active = active[lengths[active] > pos]
+
+        rnd_seqs += [
+            start + tuple([space.vocab[choice] for choice in row[: length - len(start)]])
+            for row, length in zip(states.tolist(), lengths.tolist())
+        ]
+
+    return rnd_seqs
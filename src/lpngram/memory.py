@@ -0,0 +1,193 @@
+"""
+Module providing memory accounting and estimation for ngram models.
+
+The size of a live model is measured with a deep size accounting, following
+all the objects referenced by its components. Before training, the size of a
+model for a corpus can be estimated from a sample: the number of distinct
+contexts and of distinct context/state entries in growing prefixes of the
+sample is estimated with a K-minimum-values sketch, a Heaps' law curve is
+fitted to these counts and extrapolated to the size of the entire corpus,
+and the costs per context and per entry are fitted on models trained on the
+sample.
+"""
+
+# Import Python standard libraries
+import hashlib
+import heapq
+import math
+import sys
+import types
+
+# Objects which are not followed by the deep size accounting, as they are
+# shared by the entire program and not owned by any model.
+_SKIP_TYPES = (
+    type,
+    types.ModuleType,
+    types.FunctionType,
+    types.BuiltinFunctionType,
+    types.MethodType,
+)
+
+# Mask for the 64-bit hash values of the sketches.
+_MASK = (1 << 64) - 1
+
+
+def deep_sizeof(obj, seen=None):
+    """
+    Returns the size in bytes of an object and all the objects it references.
+
+    Containers (dictionaries, lists, tuples, sets), objects with a `__dict__`
+    or `__slots__`, and `numpy` arrays (with the buffers they view) are
+    followed; classes, modules and functions are not.
+
+    Parameters
+    ----------
+    obj: object
+        The object to be measured.
+
+    seen: set
+        An optional set of the identifiers of objects already accounted for,
+        which are not counted again and which is updated in place. Sharing a
+        set among calls allows to measure the components of a structure
+        without counting shared objects (such as states) more than once.
+
+    Returns
+    -------
+    size: int
+        The size of the object, in bytes.
+    """
+
+    if seen is None:
+        seen = set()
+
+    size = 0
+    stack = [obj]
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, _SKIP_TYPES):
+            continue
+        seen.add(id(obj))
+        size += sys.getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif type(obj).__module__ == "numpy":
+            # Arrays only include their buffer in their size if they own it.
+            if getattr(obj, "base", None) is not None:
+                stack.append(obj.base)
+            continue
+
+        if hasattr(obj, "__dict__"):
+            stack.append(obj.__dict__)
+        for slot in getattr(type(obj), "__slots__", ()):
+            if hasattr(obj, slot):
+                stack.append(getattr(obj, slot))
+
+    return size
+
+
+class _KMVSketch:
+    """
+    K-minimum-values sketch for estimating the number of distinct items.
+
+    The sketch keeps the `k` smallest hash values of the items, normalized
+    to the unit interval; as the hashes are uniformly distributed, the k-th
+    smallest of them estimates `k / n` for `n` distinct items. The estimate
+    is exact while fewer than `k` distinct hashes were found.
+
+    Items are hashed from their representation with BLAKE2b rather than with
+    Python's `hash()`, which is randomized for strings in each process, so
+    that the estimates are reproducible; the states must thus have a stable
+    representation (such as strings or integers).
+    """
+
+    def __init__(self, k=1024):
+        self.k = k
+        self._heap = []  # negated hashes, so that the largest is on top
+        self._hashes = set()
+
+    def add(self, item):
+        value = int.from_bytes(
+            hashlib.blake2b(repr(item).encode("utf-8"), digest_size=8).digest(),
+            "little",
+        )
+
+        if value in self._hashes:
+            return
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, -value)
+            self._hashes.add(value)
+        elif value < -self._heap[0]:
+            self._hashes.discard(-heapq.heapreplace(self._heap, -value))
+            self._hashes.add(value)
+
+    def estimate(self):
+        if len(self._heap) < self.k:
+            return len(self._heap)
+
+        return (self.k - 1) / ((-self._heap[0] + 1) / (_MASK + 1))
+
+
+def _heaps_fit(points):
+    """
+    Internal function fitting Heaps' law (`distinct = K * size ** beta`) to a
+    list of tuples of size and distinct count, returning `(K, beta)`.
+
+    The fit is a least-squares regression in logarithmic scale; with fewer
+    than two distinct sizes, a linear growth (`beta = 1`) is assumed.
+    """
+
+    points = [(math.log(size), math.log(count)) for size, count in points if count]
+    if len({x for x, _ in points}) < 2:
+        if not points:
+            return 0.0, 1.0
+        x, y = points[-1]
+        return math.exp(y - x), 1.0
+
+    mean_x = sum([x for x, _ in points]) / len(points)
+    mean_y = sum([y for _, y in points]) / len(points)
+    beta = sum([(x - mean_x) * (y - mean_y) for x, y in points]) / sum(
+        [(x - mean_x) ** 2 for x, _ in points]
+    )
+
+    # Vocabularies cannot shrink, nor grow faster than the corpus.
+    beta = min(max(beta, 0.0), 1.0)
+
+    return math.exp(mean_y - beta * mean_x), beta
+
+
+def _fit_costs(measures):
+    """
+    Internal function fitting the costs per context and per entry of a
+    component, returning them as a tuple.
+
+    The costs are fitted by least squares to a list of tuples of number of
+    contexts, number of entries, and size. If the fit gives a negative cost,
+    which can happen as tables grow in steps, the size is fitted to a single
+    cost, choosing the one with the smallest error (costs are zero if there
+    are no contexts or no entries to fit them to).
+    """
+
+    scc = sum([c * c for c, _, _ in measures])
+    see = sum([e * e for _, e, _ in measures])
+    sce = sum([c * e for c, e, _ in measures])
+    scb = sum([c * b for c, _, b in measures])
+    seb = sum([e * b for _, e, b in measures])
+
+    det = scc * see - sce * sce
+    if det:
+        per_ctx = (scb * see - seb * sce) / det
+        per_ent = (seb * scc - scb * sce) / det
+        if per_ctx >= 0 and per_ent >= 0:
+            return per_ctx, per_ent
+
+    candidates = [(scb / scc if scc else 0.0, 0.0), (0.0, seb / see if see else 0.0)]
+    return min(
+        candidates,
+        key=lambda costs: sum(
+            [(b - costs[0] * c - costs[1] * e) ** 2 for c, e, b in measures]
+        ),
+    )
@@ -8,14 +8,37 @@ preceding and following context).
 """
 
 # Import Python standard libraries
+from array import array
 from collections import defaultdict, Counter
 from functools import partial
-from itertools import chain, combinations, product
+from itertools import chain, combinations, islice, product
+import copyreg
+import gzip
+import heapq
+import json
 import math
+import os
 import random
+import tempfile
+import time
 
 # Import from namespace
-from .smoothing import smooth_dist
+from .smoothing import smooth_dist, _normalize_dist, _normalize_dists
+from .smoothing import _import_numpy, _import_sparse
+from .trie import ContextTrie
+from .generation import _SearchSpace, _gen_chunk, chunk_tasks, gen_batch_seqs
+from .search import kbest_seqs
+from .parallel import imap
+from .cache import LRUCache
+from .compact import CompactTable, CompactCounts, dump_array, load_array
+from .stats import ModelStats
+from .memory import deep_sizeof, _KMVSketch, _heaps_fit, _fit_costs
+from .progress import OperationCancelled, _Tracker
+from .checkpoint import corpus_digest, update_digest, counts_digest
+from .checkpoint import read_checkpoint, write_checkpoint
+from .checkpoint import start_log, append_log, read_log
+from .external import run_entries, write_run, read_run, merge_runs
+from .external import reduce_runs, group_contexts, MAX_FAN_IN
 
 # Global padding symbol, shared across all functions/class-methods.
 _PAD_SYMBOL = "$$$"
@@ -46,6 +69,154 @@ def _seq_as_tuple(sequence):
     return tuple(sequence)
 
 
+def _seq_len(sequence):
+    """
+    Internal function returning the number of states of a sequence.
+
+    The length is the one of the tuple returned by `_seq_as_tuple()`, so that
+    strings of states separated by spaces have the same length of the
+    equivalent lists, without building the tuple.
+    """
+
+    if isinstance(sequence, str) and " " in sequence:
+        return sequence.count(" ") + 1
+
+    return len(sequence)
+
+
+def _ngram_logprob(p, p0, ngram, state):
+    """
+    Internal function returning the log-probability of a state in a context.
+
+    Parameters
+    ----------
+    p: dict
+        The smoothed log-probabilities of the observed states for each
+        context, as in `NgramModel._p`.
+
+    p0: dict
+        The smoothed log-probabilities of unobserved states for each context,
+        as in `NgramModel._p0`.
+
+    ngram: tuple
+        The context, including the element symbol.
+
+    state: object
+        The state whose log-probability will be returned.
+
+    Returns
+    -------
+    prob: float
+        The log-probability of the state in the context.
+    """
+
+    # If the ngram (the "context") is found in `p` (i.e., it was observed in
+    # training), we just need to return the probability of its state (or of
+    # the transition to unonserved states, in case the ngram was observed in
+    # training but not the state). If the ngram was not observed, we need a
+    # different backoff solution; here we rely in the chain rule and just sum
+    # the log-probabilities of each individual state in the ngram (including
+    # the state being observed), taking care of unobserved states.
+    if ngram in p:
+        if state in p[ngram]:
+            return p[ngram][state]
+
+        # TODO: correction?
+        return p0[ngram]
+
+    # Make a copy of the sequence replacing the symbol for the current state
+    # by the observed state; then, compute and sum the individual
+    # log-probabilities.
+    _seq = [state if seq_state == _ELM_SYMBOL else seq_state for seq_state in ngram]
+    return sum(
+        [
+            p[(_ELM_SYMBOL,)][seq_state]
+            if seq_state in p[(_ELM_SYMBOL,)]
+            else p0[(_ELM_SYMBOL,)]
+            for seq_state in _seq
+        ]
+    )
+
+
+def _window_logprob(p, p0, orders, max_pre, window):
+    """
+    Internal function returning the log-probability of a state in a window.
+
+    Parameters
+    ----------
+    p: dict
+        The smoothed log-probabilities of the observed states for each
+        context, as in `NgramModel._p`.
+
+    p0: dict
+        The smoothed log-probabilities of unobserved states for each context,
+        as in `NgramModel._p0`.
+
+    orders: list
+        A list of all the pairs of preceding and following orders of the
+        model.
+
+    max_pre: int
+        The maximum preceding order of the model, which is the index of the
+        state in the window.
+
+    window: tuple
+        The states around the position, including padding, with the maximum
+        preceding and following orders.
+
+    Returns
+    -------
+    prob: float
+        The sum of the log-probabilities of the state in all contexts, as
+        added to each position by `NgramModel.state_score()`.
+    """
+
+    state = window[max_pre]
+    return sum(
+        [
+            _ngram_logprob(
+                p,
+                p0,
+                window[max_pre - pre_len : max_pre]
+                + (_ELM_SYMBOL,)
+                + window[max_pre + 1 : max_pre + 1 + post_len],
+                state,
+            )
+            for pre_len, post_len in orders
+        ]
+    )
+
+
+def _length_logprobs(seqlens):
+    """
+    Internal function returning the log-probabilities of sequence lengths.
+
+    Parameters
+    ----------
+    seqlens: dict
+        A dictionary of sequence lengths to their counts.
+
+    Returns
+    -------
+    length_prob: dict
+        A dictionary of sequence lengths to their log-probabilities.
+
+    unobserved_prob: float
+        The log-probability for lengths not found in `seqlens`.
+    """
+
+    # This is easy as we just assume that the count/probability for
+    # non-observed lengths is equal to the count/probability of the less
+    # observed length (the value is added directly to `length_obs`). This is
+    # similar to ML estimation.
+    length_obs = sum(seqlens.values()) + min(seqlens.values())
+    length_prob = {
+        length: math.log(count / length_obs) for length, count in seqlens.items()
+    }
+
+    return length_prob, math.log(min(seqlens.values()) / length_obs)
+
+
 class NgramModel:
     """
     Class for operation upon sequences using ngrams models.
@@ -59,7 +230,12 @@ class NgramModel:
     """
 
     def __init__(
-        self, pre_order=0, post_order=0, pad_symbol=_PAD_SYMBOL, sequences=None
+        self,
+        pre_order=0,
+        post_order=0,
+        pad_symbol=_PAD_SYMBOL,
+        sequences=None,
+        store="dict",
     ):
         """
         Initialize an NgramModel object.
@@ -90,6 +266,14 @@ class NgramModel:
             file and a list of sequences are provided, the sequences will be
             appended to the object after loading the model, clearing any
             previous training.
+
+        store: str
+            The data structure used for storing contexts, either "dict" (a
+            dictionary indexed by context tuples) or "trie" (a `ContextTrie`,
+            in which contexts of different orders share their nodes, kept
+            in flat arrays, and scoring retrieves all the contexts of a
+            position with a single walk). Tries take less memory, but are
+            slower to fill. Defaults to "dict".
         """
 
         # Store the ngram collection parameters. While the user can pass
@@ -113,14 +297,18 @@ class NgramModel:
             self._post = post_order
 
         # Initialize internal variables for holding the model.
-        self._ngrams = defaultdict(Counter)
-        self._ngram_space = Counter()
+        if store == "dict":
+            self._ngrams = defaultdict(Counter)
+        elif store == "trie":
+            self._ngrams = ContextTrie(Counter)
+        else:
+            raise ValueError("Unknown context store '%s'." % store)
+        self._store = store
+        self._cache = None
+        self._stats = None
+        self._keep = None
         self._seqlens = Counter()
-
-        self._p = {}
-        self._p0 = {}
-        self._l = {}
-        self._l0 = {}
+        self._reset_training()
 
         # Training parameters, which are set by the .train() method
         # but initialized here. Bins are stored in separate as they might
@@ -130,12 +318,21 @@ class NgramModel:
         self._smooth_method = None
         self._bins = None
         self._smooth_kwargs = None
+        self._normalize = False
         self._trained = False
 
         # Add the user-provided sequences, concluding initialization.
         self.add_sequences(sequences)
 
-    def add_sequences(self, sequences):
+    def add_sequences(
+        self,
+        sequences,
+        progress=None,
+        cancel=None,
+        checkpoint=None,
+        checkpoint_every=1000000,
+        resume=False,
+    ):
         """
         Adds sequences to a model, collecting their ngrams.
 
@@ -147,448 +344,2110 @@ class NgramModel:
 
         Parameters
         ----------
-        sequences: list
-            A list of sequences to be added to the model.
+        sequences: iterable
+            The sequences to be added to the model, consumed a single time.
+
+        progress: function
+            An optional function called after each chunk of sequences is
+            counted, with a dictionary of the "stage" ("add_sequences"), the
+            number of sequences "done", their "total" (None if `sequences`
+            has no length), and the "elapsed" and estimated remaining ("eta")
+            seconds.
+
+        cancel: CancelToken
+            An optional token checked before each chunk of sequences. If it
+            is cancelled, `OperationCancelled` is raised, and the model holds
+            the counts of all the sequences before that chunk.
+
+        checkpoint: str
+            An optional path to a checkpoint file, where the model and the
+            number and digest of the sequences counted so far are written
+            every `checkpoint_every` sequences, when the call is cancelled,
+            and when it is complete. As each checkpoint writes all the counts
+            of the model, which keep growing with the corpus, frequent
+            checkpoints can take longer than the counting itself.
+
+        checkpoint_every: int
+            The number of sequences counted between two checkpoints, rounded
+            up to the size of the chunks. Defaults to 1000000.
+
+        resume: bool
+            Whether to resume from the `checkpoint` file, if it exists. The
+            counts of the model are replaced by those of the checkpoint, and
+            the sequences it holds are skipped, after verifying that they are
+            the same (otherwise, a `ValueError` is raised and the model is
+            left unchanged). Defaults to False, overwriting any checkpoint.
        """
 
         if sequences:
+            self._check_counts()
+            if self._stats is not None:
+                start = time.perf_counter()
+
+            total = len(sequences) if hasattr(sequences, "__len__") else None
+            sequences = iter(sequences)
+
+            # Skip the sequences of the checkpoint, if resuming, checking
+            # that they match those which were counted; they are hashed one
+            # at a time, as they might be too many to be held in memory.
+            state = None
+            if checkpoint and resume:
+                state = read_checkpoint(checkpoint, "add_sequences")
+            if state is not None:
+                restored = state["model"]
+                self._check_compatible(
+                    restored._pre, restored._post, restored._padsymbol
+                )
+                if restored._store != self._store:
+                    raise ValueError("Checkpoint uses a different context store.")
+                digest = corpus_digest()
+                skipped = 0
+                for sequence in islice(sequences, state["position"]):
+                    update_digest(digest, [sequence])
+                    skipped += 1
+                if skipped < state["position"] or digest.hexdigest() != state["digest"]:
+                    raise ValueError(
+                        "Sequences do not match checkpoint '%s'." % checkpoint
+                    )
+            else:
+                digest = corpus_digest() if checkpoint else None
+                skipped = 0
+
+            position = skipped
+            tracker = _Tracker("add_sequences", total, progress, cancel, skipped)
+            tracker.check()
+
             # Either initialize (if no model file was provided) or clear (if
             # a model file was provided) the variables for smoothed
             # probabilities. This is performed inside the conditional check
             # to guarantee that we don't loose any previsous training if there
             # is not reason for that (i.e., if no new sequences are added).
-            self._p = {}
-            self._p0 = {}
-            self._l = {}
-            self._l0 = {}
-            self._trained = False
+            self._reset_training()
+            if state is not None:
+                self._ngrams, self._seqlens = restored._ngrams, restored._seqlens
 
             # Collect all positional ngrams, using the ngram tuple as a key
-            # and the state as value (which is appended to self._ngrams()).
+            # and the state as value (which is counted in self._ngrams()).
             # The positional information (ngram[2]) is actually discarded
-            # in this stage.
-            for sequence in sequences:
-                for ngram in get_all_posngrams(
-                    sequence, self._pre, self._post, self._padsymbol
-                ):
-                    self._ngrams[ngram[0]].update(ngram[1])
+            # in this stage. We increment the count of the state directly,
+            # as `Counter.update()` would iterate over the characters of
+            # states that are strings longer than one character. Sequences
+            # are counted in chunks, with the lengths of each chunk collected
+            # along with its ngrams, so that a cancelled call leaves the
+            # model with the complete counts of the sequences before it. With
+            # a trie store, the ngrams of each chunk are first counted in a
+            # dictionary, so that each context is looked up in the trie
+            # (following one edge per symbol) only once per chunk.
+            n_states = 0
+            next_checkpoint = position + checkpoint_every
+            try:
+                for chunk in tracker.chunks(sequences):
+                    if self._store == "trie":
+                        chunk_ngrams = defaultdict(Counter)
+                    else:
+                        chunk_ngrams = self._ngrams
+                    for sequence in chunk:
+                        for ngram in get_all_posngrams(
+                            sequence, self._pre, self._post, self._padsymbol
+                        ):
+                            chunk_ngrams[ngram[0]][ngram[1]] += 1
+                    if chunk_ngrams is not self._ngrams:
+                        for context, counts in chunk_ngrams.items():
+                            context_counts = self._ngrams[context]
+                            for state, count in counts.items():
+                                context_counts[state] += count
+
+                    # Collect sequence lengths.
+                    lengths = [_seq_len(sequence) for sequence in chunk]
+                    self._seqlens.update(lengths)
+                    n_states += sum(lengths)
+
+                    position += len(chunk)
+                    if checkpoint:
+                        update_digest(digest, chunk)
+                        if position >= next_checkpoint:
+                            write_checkpoint(
+                                checkpoint,
+                                "add_sequences",
+                                self,
+                                position,
+                                digest.hexdigest(),
+                            )
+                            next_checkpoint = position + checkpoint_every
+            except OperationCancelled:
+                if checkpoint:
+                    write_checkpoint(
+                        checkpoint, "add_sequences", self, position, digest.hexdigest()
+                    )
+                raise
+
+            if checkpoint:
+                write_checkpoint(
+                    checkpoint, "add_sequences", self, position, digest.hexdigest()
+                )
 
-            # Collect sequence lengths.
-            self._seqlens.update([len(sequence) for sequence in sequences])
+            if self._stats is not None:
+                self._stats.record(
+                    "add_sequences",
+                    time.perf_counter() - start,
+                    {"sequences": position - skipped, "states": n_states},
+                    {"contexts": len(self._ngrams)},
+                )
 
-    def train(self, method="laplace", normalize=False, bins=None, **kwargs):
+    def remove_sequences(self, sequences):
         """
-        Train a model after ngrams have been collected.
+        Removes sequences from a model, discounting their ngrams.
 
-        This method does not return any value, but sets the internal variables
-        with smoothed probabilities (such as `self._p` and `self._p0`) and
-        internally marks the model as having been trained.
+        This method is the inverse of `.add_sequences()`: the counts of all
+        the ngrams and lengths of the sequences are decremented, and contexts
+        and lengths whose counts reach zero are dropped. As when adding
+        sequences, any previous training is cleared. The sequences must have
+        been previously added to the model, otherwise a `ValueError` is
+        raised and the model is left unchanged.
 
         Parameters
         ----------
-        method: str
-            The name of the smoothing method to be used, as used by
-            `smooth_dist()`. Either "uniform", "random", "mle", "lidstone",
-            "laplace", "ele", "wittenbell", "certaintydegree", or "sgt".
-            Defaults to "laplace".
+        sequences: list
+            A list of sequences to be removed from the model.
+        """
 
-        normalize: boolean
-            Whether to normalize the log-probabilities for each ngram in the
-            model after smoothing, i.e., to guarantee that the probabilities
-            (with the probability for unobserved transitions counted a single
-            time) sum to 1.0. This is computationally expansive, and should be
-            only used if the model is intended for later serialization. While
-            experiments with real data demonstrated that this normalization
-            does not improve the results or performance of the methods, the
-            computational cost of normalizing the probabilities might be
-            justified if descriptive statistics of the model, like samples
-            from the matrix of transition probabilities or the
-            entropy/perplexity of a sequence, are needed (such as for
-            publication), as they will be more in line with what is generally
-            expected and will facilitate the comparison of different models.
+        if sequences:
+            self._check_counts()
 
-        bins: int
-            The number of bins to be assumed when smoothing, for the smoothing
-            methods that use this information. Defaults to the number of
-            unique states observed, as gathered from the count of ngrams with
-            no context.
-       """
+            # Collect all the counts to be removed before changing the model,
+            # so that we can check them all in advance and never leave the
+            # model in an inconsistent state.
+            removal = defaultdict(Counter)
+            for sequence in sequences:
+                for ngram in get_all_posngrams(
+                    sequence, self._pre, self._post, self._padsymbol
+                ):
+                    removal[ngram[0]][ngram[1]] += 1
+            lengths = Counter([_seq_len(sequence) for sequence in sequences])
+
+            # We use `.get()` in order not to create new entries in the
+            # defaultdict while checking.
+            for context, counter in removal.items():
+                observed = self._ngrams.get(context, {})
+                for state, count in counter.items():
+                    if observed.get(state, 0) < count:
+                        raise ValueError(
+                            "State %r in context %r was not observed in the model."
+                            % (state, context)
+                        )
+            for length, count in lengths.items():
+                if self._seqlens.get(length, 0) < count:
+                    raise ValueError(
+                        "Sequence length %i was not observed in the model." % length
+                    )
+
+            # Perform the actual removal.
+            self._reset_training()
+            for context, counter in removal.items():
+                observed = self._ngrams[context]
+                for state, count in counter.items():
+                    observed[state] -= count
+                    if not observed[state]:
+                        del observed[state]
+                if not observed:
+                    del self._ngrams[context]
+
+            self._seqlens.subtract(lengths)
+            for length in lengths:
+                if not self._seqlens[length]:
+                    del self._seqlens[length]
+
+    def _reset_training(self):
+        """
+        Internal method for clearing the smoothed probabilities.
 
-        # No need to initialize/clean `self._p` and `self._p0` (as well as the
-        # corresponding variables for length probabilities) as they are
-        # cleaned by `self.add_sequences()` everytime a sequence is added.
+        This method is called every time the ngram counts of the model change,
+        so that a model cannot be used for scoring with probabilities that no
+        longer reflect its counts.
+        """
 
-        # If the number of bins was not informed, use the number of transition
-        # states from the zero-context.
-        # The triple `or` is intended to prevent aberrant cases in which the
-        # no-context ngram is not available, to which we resort to the number
-        # of states (this default will only take place on user-crafted cases);
-        # likewise, the `or 1` guarantees that we don't have divisions by zero
-        # if the users trains on an empty collection (yielding results in
-        # line with what is probably expected).
-        if (_ELM_SYMBOL,) in self._ngrams:
-            self._bins = bins or len(self._ngrams[(_ELM_SYMBOL,)])
+        # With a trie store, the tries for observed and unobserved states
+        # share their nodes, so that scoring requires a single walk, as well
+        # as those of the counts, which already hold all the contexts to be
+        # smoothed.
+        if self._store == "trie":
+            self._p = ContextTrie(nodes=self._ngrams)
+            self._p0 = ContextTrie(nodes=self._p)
         else:
-            self._bins = bins or len(self._ngrams) or 1
+            self._p = {}
+            self._p0 = {}
+        self._l = {}
+        self._l0 = {}
+        self._max_p = 0.0
+        self._ngram_space = None
+        self._spaces = {}
+        self._entropies = {}
+        self._trained = False
+        if self._cache is not None:
+            self._cache.clear()
 
-        # Internally store the `**kwargs`, if any.
-        self._smooth_kwargs = kwargs
+    def _check_capability(self, capability):
+        """
+        Internal method asserting that the model was trained and that a
+        capability ("score" or "generate") was not dropped by `.compact()`.
+        """
+
+        assert self._trained, "Ngram Model was not trained."
+        assert (
+            self._keep is None or capability in self._keep
+        ), "Ngram Model was compacted without '%s'." % capability
+
+    def _check_counts(self):
+        """
+        Internal method asserting that the model still holds its counts,
+        which are dropped by `.compact()`.
+        """
+
+        assert self._keep is None, "Ngram Model was compacted and holds no counts."
+
+    def _check_compatible(self, pre_order, post_order, pad_symbol):
+        """
+        Internal method for checking if ngram collection parameters match.
+
+        Counts collected with different orders or padding symbols cannot be
+        combined, as the contexts would not be comparable; a `ValueError` is
+        raised in such cases.
+        """
 
-        # Perform the probability smoothing.
-        for context, counter in self._ngrams.items():
-            self._p[context], self._p0[context] = smooth_dist(
-                counter, method=method, bins=self._bins, **kwargs
+        if pad_symbol != self._padsymbol:
+            raise ValueError(
+                "Padding symbols do not match (%r != %r)."
+                % (pad_symbol, self._padsymbol)
             )
 
-        # Normalize, if so requested. See comments in the docstring for more
-        # information.
-        if normalize:
-            for context, probs in self._p.items():
-                # We remap the log-probabilities into probabilities in the
-                # temporary variable `_prob`, sum them in order to obtain the
-                # used probability space (which includes a single occurence
-                # for the unobserved probability), and finally reset
-                # `self._p` and `self._p0` as normalized log-probabilities.
-                _prob = {state: math.exp(prob) for state, prob in probs.items()}
-                _prob0 = math.exp(self._p0[context])
-                _prob_sum = sum(_prob.values()) + _prob0
-
-                self._p[context] = {
-                    state: math.log(prob / _prob_sum) for state, prob in _prob.items()
-                }
-                self._p0[context] = math.log(_prob0 / _prob_sum)
-
-        # Compute the log-probabilities for lengths. This is easy as we just
-        # assume that the count/probability for non-observed lengths is equal
-        # to the count/probability of the less observed length (the value is
-        # added directly to `length_obs`). This is similar to ML estimation.
-        length_obs = sum(self._seqlens.values()) + min(self._seqlens.values())
-        self._l = {
-            length: math.log(count / length_obs)
-            for length, count in self._seqlens.items()
-        }
-        self._l0 = math.log(min(self._seqlens.values()) / length_obs)
+        if list(pre_order) != list(self._pre):
+            raise ValueError(
+                "Preceding orders do not match (%s != %s)."
+                % (list(pre_order), list(self._pre))
+            )
 
-        # Collect the ngram space keys and values for random sequence
-        # generation.
-        for context, counter in self._ngrams.items():
-            for key, value in counter.items():
-                key = tuple(s if s != _ELM_SYMBOL else key for s in context)
-                self._ngram_space[key] += value
+        if list(post_order) != list(self._post):
+            raise ValueError(
+                "Following orders do not match (%s != %s)."
+                % (list(post_order), list(self._post))
+            )
 
-        # Internally inform that the model was trained.
-        self._trained = True
+    def merge(self, other):
+        """
+        Merges the ngram counts of another model into the current one.
 
-    def state_score(self, sequence):
+        This allows to combine models whose ngrams were collected
+        independently, such as from different shards of a corpus, before a
+        single training. The resulting counts are the same that would be
+        obtained by adding all the sequences to a single model. As with
+        `.add_sequences()`, any previous training is cleared.
+
+        Parameters
+        ----------
+        other: NgramModel
+            The model whose counts will be added to the current one. It must
+            have been built with the same preceding and following orders and
+            the same padding symbol, otherwise a `ValueError` is raised.
         """
-        Returns the relative likelihood for each state in a sequence.
 
-        Please note that this does not perform correction due to sequence
-        length, as optionally and by default performed by the `.score()`
-        method. The model must have been trained in advance.
+        self._check_compatible(other._pre, other._post, other._padsymbol)
+        self._check_counts()
+        other._check_counts()
+
+        if other._ngrams or other._seqlens:
+            self._reset_training()
+
+            # `Counter.update()` adds counts when given a mapping, which is
+            # exactly what we need for combining the contexts.
+            for context, counter in other._ngrams.items():
+                self._ngrams[context].update(counter)
+
+            self._seqlens.update(other._seqlens)
+
+    @classmethod
+    def from_counts(
+        cls, ngrams, seqlens, pre_order=0, post_order=0, pad_symbol=_PAD_SYMBOL
+    ):
+        """
+        Builds an untrained model directly from ngram and length counts.
 
         Parameters
         ----------
-        sequence: list
-            A list of states to be scored.
+        ngrams: dict
+            A dictionary of contexts (tuples including the `###` element
+            symbol) to dictionaries of state counts, in the same format of
+            the internal `._ngrams` variable.
+
+        seqlens: dict
+            A dictionary of sequence lengths to their counts.
+
+        pre_order: int or list
+            The preceding orders used for collecting the counts, as in the
+            class constructor.
+
+        post_order: int or list
+            The following orders used for collecting the counts, as in the
+            class constructor.
+
+        pad_symbol: object
+            The padding symbol used for collecting the counts, as in the class
+            constructor.
 
         Returns
         -------
-        prob: list
-            A list of floats, of the same length of `sequence`, with the
-            individual log-probability for each state.
+        model: NgramModel
+            A new model holding the counts, which must be trained before
+            being used.
         """
 
-        # Assert the model was trained.
-        assert self._trained, "Ngram Model was not trained."
+        model = cls(pre_order, post_order, pad_symbol)
+        for context, counter in ngrams.items():
+            model._ngrams[tuple(context)].update(counter)
+        model._seqlens.update(seqlens)
 
-        # Pre-allocate the list holding the probability (i.e., the relative
-        # likelihood) for each state in `sequence`.
-        s_prob = [0.0] * len(sequence)
+        return model
 
-        # We collect all positional ngrams in `sequence`, using the same
-        # parameters for the model ngram collection, and compute the state
-        # probability in each case, appending/adding the results to the
-        # correct element in `s_prob`.
-        for ngram, state, idx in get_all_posngrams(
-            sequence, self._pre, self._post, self._padsymbol
-        ):
-            # If the ngram (the "context") is found in `self._p` (i.e., it was
-            # observed in training), we just need to append to `_p` the
-            # probability of its state (or of the transition to unonserved
-            # states, in case the ngram was observed in training but not the
-            # state). If the ngram was not observed, we need a different
-            # backoff solution; here we rely in the chain rule and just sum
-            # the log-probabilities of each individual state in the ngram
-            # (including the state being observed), taking care of
-            # unobserved states.
-            if ngram in self._p:
-                if state in self._p[ngram]:
-                    _p = self._p[ngram][state]
-                else:
-                    # TODO: correction?
-                    _p = self._p0[ngram]
-            else:
-                # Make a copy of the sequence replacing the symbol for the
-                # current state by the observed state; then, compute and sum
-                # the individual log-probabilities.
-                _seq = [
-                    state if seq_state == _ELM_SYMBOL else seq_state
-                    for seq_state in ngram
-                ]
-                _p = sum(
-                    [
-                        self._p[(_ELM_SYMBOL,)][seq_state]
-                        if seq_state in self._p[(_ELM_SYMBOL,)]
-                        else self._p0[(_ELM_SYMBOL,)]
-                        for seq_state in _seq
-                    ]
-                )
+    def to_sparse(self):
+        """
+        Exports the counts and log-probabilities as sparse matrices.
 
-            # Update the log-probability of the correct state.
-            s_prob[idx] += _p
+        Both matrices have contexts as rows and states as columns, in the
+        order of the returned lists, and share the same structure (i.e., the
+        same stored positions), so that their `.data` arrays are aligned;
+        log-probabilities of zero are stored explicitly. The model must have
+        been trained in advance, and the `scipy` library is required.
 
-        return s_prob
+        Returns
+        -------
+        counts: scipy.sparse.csr_matrix
+            A matrix with the ngram counts of each state in each context.
 
-    def score(self, sequence, use_length=True):
+        logprobs: scipy.sparse.csr_matrix
+            A matrix with the smoothed log-probabilities of the observed
+            states in each context.
+
+        p0: numpy.ndarray
+            An array with the log-probability of unobserved states in each
+            context.
+
+        contexts: list
+            The list of contexts (tuples including the `###` element symbol)
+            of the rows.
+
+        states: list
+            The list of states of the columns.
         """
-        Returns the relative likelihood of a sequence.
 
-        The model must have been trained before using this function.
+        # Assert the model was trained and still holds its counts.
+        self._check_capability("score")
+        self._check_counts()
+
+        sparse = _import_sparse()
+        if not sparse:
+            raise ImportError("The package `scipy` is needed by sparse export.")
+        np = _import_numpy()
+
+        contexts = list(self._p)
+        states = sorted(
+            {state for context in contexts for state in self._p[context]}
+            | {state for context in contexts for state in self._ngrams[context]},
+            key=repr,
+        )
+        state_idx = {state: idx for idx, state in enumerate(states)}
+
+        # Build the structure shared by both matrices, with the states of each
+        # row in column order.
+        indptr, indices, count_data, prob_data = [0], [], [], []
+        for context in contexts:
+            counter, probs = self._ngrams[context], self._p[context]
+            row = sorted(set(counter) | set(probs), key=state_idx.get)
+            indices += [state_idx[state] for state in row]
+            count_data += [counter.get(state, 0) for state in row]
+            prob_data += [probs.get(state, self._p0[context]) for state in row]
+            indptr.append(len(indices))
+
+        shape = (len(contexts), len(states))
+        counts = sparse.csr_matrix(
+            (np.array(count_data, dtype=np.int64), indices, indptr), shape=shape
+        )
+        logprobs = sparse.csr_matrix(
+            (np.array(prob_data, dtype=float), indices, indptr), shape=shape
+        )
+        p0 = np.array([self._p0[context] for context in contexts], dtype=float)
+
+        return counts, logprobs, p0, contexts, states
+
+    @classmethod
+    def from_sparse(
+        cls,
+        counts,
+        logprobs,
+        p0,
+        contexts,
+        states,
+        seqlens,
+        pre_order=0,
+        post_order=0,
+        pad_symbol=_PAD_SYMBOL,
+    ):
+        """
+        Builds a trained model directly from sparse matrices.
+
+        The matrices are in the format returned by `.to_sparse()`, and the
+        log-probabilities are used as they are, with no smoothing; the
+        states with log-probabilities are those stored in `logprobs`, even
+        if they are zero, so that any matrix with the same structure of
+        `counts` can be used.
 
         Parameters
         ----------
-        sequence: list
-            A list of states to be scored.
+        counts: scipy.sparse matrix
+            A matrix with the ngram counts of each state in each context.
 
-        use_length: bool
-            Whether to correct the sequence relative likelihood by using
-            length probability. Defaults to True.
+        logprobs: scipy.sparse matrix
+            A matrix with the log-probabilities of the observed states.
 
-        Returns
-        -------
-        prob: list
-            A list of floats, of the same length of `sequence`, with the
-            individual log-probability for each state.
-        """
+        p0: list
+            The log-probability of unobserved states in each context.
 
-        # Assert the model was trained.
-        assert self._trained, "Ngram Model was not trained."
+        contexts: list
+            The list of contexts of the rows.
 
-        # Get the sum of individual log-probabilities, correct them with the
-        # sequence length probability if requested and return.
-        _prob = sum(self.state_score(sequence))
-        if use_length:
-            if len(sequence) in self._l:
-                _prob += self._l[len(sequence)]
-            else:
-                _prob += self._l0
+        states: list
+            The list of states of the columns.
 
-        return _prob
+        seqlens: dict
+            A dictionary of sequence lengths to their counts.
 
-    # TODO: should we cache this, too? Or rewrite using some iteration tool?
-    def model_entropy(self):
-        """
-        Return the model entropy.
+        pre_order: int or list
+            The preceding orders used for collecting the counts, as in the
+            class constructor.
 
-        This methods collects the P x log(P) for all contexts, returning
-        their sum. This is different from a sequence cross-entropy,
-        and should be used to estimate the complexity of a model.
+        post_order: int or list
+            The following orders used for collecting the counts, as in the
+            class constructor.
 
-        Please note that for very large models the computation of this
-        entropy might run into underflow problems.
+        pad_symbol: object
+            The padding symbol used for collecting the counts, as in the class
+            constructor.
 
         Returns
         -------
-        h: float
-            The model entropy.
+        model: NgramModel
+            A new trained model.
         """
 
-        # Our probabilities are already stored as logarithms in `self._p`,
-        # so we need to recover the probability itself by running exp(),
-        # which is computationally very expansive. However, considering how
-        # log-probabilities make all normal operations faster, this is
-        # justified in terms of favoring the most common operations.
-        lentropy = []
-        for context in self._p:
-            _probs = [math.exp(p) for p in self._p[context].values()]
-            _probs.append(math.exp(self._p0[context]))
-            lentropy += [-p * math.log(p, 2.0) for p in _probs]
+        model = cls(pre_order, post_order, pad_symbol)
+        model._seqlens.update(seqlens)
+
+        counts, logprobs = counts.tocsr(), logprobs.tocsr()
+        for row, context in enumerate(contexts):
+            context = tuple(context)
+            start, end = counts.indptr[row], counts.indptr[row + 1]
+            for col, count in zip(
+                counts.indices[start:end].tolist(), counts.data[start:end].tolist()
+            ):
+                if count:
+                    model._ngrams[context][states[col]] = count
+
+            start, end = logprobs.indptr[row], logprobs.indptr[row + 1]
+            model._p[context] = dict(
+                zip(
+                    [states[col] for col in logprobs.indices[start:end].tolist()],
+                    logprobs.data[start:end].tolist(),
+                )
+            )
+            model._p0[context] = float(p0[row])
 
-        return sum(lentropy)
+        model._bins = len(states)
+        model._train_lengths()
+        model._finish_training()
 
-    def entropy(self, sequence, base=2.0):
+        return model
+
+    def save_counts(self, filename):
         """
-        Calculates the cross-entropy of a sequence.
+        Writes the ngram and length counts of the model to disk.
+
+        The counts are written in a line-oriented JSON format, with a header
+        holding the collection parameters and the sequence lengths followed
+        by one line per context, so that shards counted by independent jobs
+        can be combined with `NgramModel.load_counts()`. If `filename` ends
+        in `.gz`, the file is compressed. Note that all symbols must be
+        serializable as JSON values (usually strings).
 
         Parameters
         ----------
-        sequence: list
-            The sequence whose cross-entropy will be calculated.
+        filename: str
+            The path to the file to be written.
+        """
 
-        base: float
-            The logarithmic base for the cross-entropy calculation. Defaults to
-            2.0, following the standard approach set by Shannon that allows
-            to consider entropy in terms of bits needed for unique
-            representation.
+        self._check_counts()
 
-        Returns
-        -------
-        ch: float
-            The cross-entropy calculated for the sequence, a real number.
-        """
-        return -(self.score(sequence) / math.log(base)) / len(sequence)
+        with _open_counts(filename, "w") as handler:
+            _write_counts_header(
+                handler, self._pre, self._post, self._padsymbol, self._seqlens
+            )
+            for context, counter in self._ngrams.items():
+                _write_counts_line(handler, context, counter.items())
 
-    def perplexity(self, sequence):
+    @classmethod
+    def load_counts(cls, filenames):
         """
-        Calculates the perplexity of a model.
+        Builds an untrained model from one or more files of counts.
 
-        As per definition, this is simply 2.0 to the cross-entropy of the
-        given sequence on logarithmic base of 2.0.
+        Multiple files, as written by `.save_counts()` from different shards
+        of a corpus, are combined by summing their counts, yielding a model
+        equivalent to one collected from the full corpus. All the files must
+        share the same collection parameters, otherwise a `ValueError` is
+        raised.
 
         Parameters
         ----------
-        sequence: list
-            The sequence whose perplexity should be calculated.
+        filenames: str or list
+            The path to a single file or a list of paths to the shards.
 
         Returns
         -------
-        perplexity: float
-            The calculated perplexity for the sequence.
+        model: NgramModel
+            A new model holding the combined counts, which must be trained
+            before being used.
         """
-        return 2.0 ** self.entropy(sequence)
 
-    def _gen_single_rnd_seq(self, seq_len, cutoff_length, scale, tries=10):
-        """
-        Internal function for random sequence generation.
-
-        This function is intended for internal usage; for generating a single
-        random sequence, use the standard `self._random_seq()` function
-        with a `k` parameter of 1.
-        """
-        # Set the initial state for the random sequence, which is just the
-        # pad symbol times the maximum preceding order.
-        rnd_seq = (self._padsymbol,) * max(self._pre)
-
-        # If the sequence length was not specified, it must be randomly
-        # selected.
-        if not seq_len:
-            len_pop = list(self._seqlens.keys())
-            len_w = list(self._seqlens.values())
-            seq_len = random.choices(len_pop, len_w)[0]
-            seq_len += max(self._pre)
-            if max(self._post) > 0:
-                seq_len += 1
-
-        # Cutoff length can't obviously be larger than the sequence length,
-        # as we would not be able to find a sequence or ngram shorter than
-        # it.
-        cutoff_length = min(cutoff_length, seq_len)
-
-        # Repeatedly build a dictionary with the search space for next element
-        # given the current value of `rnd_seq`, checking if we are able to
-        # generate it (we might run into some unsolvable situation).
-        gen_tries = 0
-        while True:
-            # Filter all the elements from `self._ngram_space` that match the
-            # specified `cutoff_length`; as the conditional checking is a bit
-            # expensive and not always used, we first check if we just make
-            # a copy of the contents (casting the Counter to a dictionary,
-            # which is fast) if no cutoff is specified (i.e., if it equals 1).
-            if cutoff_length == 1:
-                sspace = dict(self._ngram_space)
-            else:
-                sspace = {
-                    key: value
-                    for key, value in self._ngram_space.items()
-                    if len(key) >= cutoff_length
+        if isinstance(filenames, str):
+            filenames = [filenames]
+
+        model = None
+        for filename in filenames:
+            with _open_counts(filename, "r") as handler:
+                header = json.loads(handler.readline())
+                if header.get("format") != "lpngram-counts":
+                    raise ValueError("'%s' is not a file of counts." % filename)
+
+                # The first shard sets the parameters for all others.
+                if model is None:
+                    model = cls(
+                        header["pre_order"], header["post_order"], header["pad_symbol"]
+                    )
+                else:
+                    model._check_compatible(
+                        header["pre_order"], header["post_order"], header["pad_symbol"]
+                    )
+
+                model._seqlens.update(
+                    {length: count for length, count in header["seqlens"]}
+                )
+                for line in handler:
+                    context, counts = json.loads(line)
+                    counter = model._ngrams[tuple(context)]
+                    for state, count in counts:
+                        counter[state] += count
+
+        return model
+
+    @classmethod
+    def count_external(
+        cls,
+        sequences,
+        pre_order=0,
+        post_order=0,
+        pad_symbol=_PAD_SYMBOL,
+        store="dict",
+        memory_budget=2 ** 30,
+        output=None,
+        tmpdir=None,
+        progress=None,
+        cancel=None,
+    ):
+        """
+        Counts the ngrams of sequences out of core, within a memory budget.
+
+        The counts are accumulated in memory until their estimated size
+        reaches `memory_budget`; they are then sorted and spilled to a
+        temporary run file, and counting starts again from an empty table.
+        Once all sequences are counted, the runs are combined with a k-way
+        merge, which only holds one entry of each run in memory, building
+        an untrained model or writing a file of counts, in the format of
+        `.save_counts()`, which never holds all the counts in memory. The
+        size of the counts is estimated from a deep accounting of their
+        table, measured after the first chunk of sequences and again each
+        time the budget seems to be reached; sorting a run temporarily needs
+        about as much memory again. All symbols must be serializable as JSON
+        values (usually strings), as in `.save_counts()`.
+
+        Parameters
+        ----------
+        sequences: iterable
+            The sequences to be counted, consumed a single time.
+
+        pre_order: int or list
+            The preceding orders of the model, as in `NgramModel()`.
+
+        post_order: int or list
+            The following orders of the model, as in `NgramModel()`.
+
+        pad_symbol: object
+            The padding symbol of the model, as in `NgramModel()`.
+
+        store: str
+            The context store of the model, as in `NgramModel()`.
+
+        memory_budget: int
+            The number of bytes of counts held in memory before spilling
+            them to a run. Defaults to 2 ** 30 (1 GiB).
+
+        output: str
+            An optional path to a file of counts to be written instead of
+            building a model. If it ends in `.gz`, the file is compressed.
+
+        tmpdir: str
+            An optional directory for the temporary runs, which are deleted
+            when counting is complete. Defaults to the system directory for
+            temporary files.
+
+        progress: function
+            An optional function called after each chunk of sequences is
+            counted, as in `.add_sequences()` (with "count_external" as
+            "stage").
+
+        cancel: CancelToken
+            An optional token checked before each chunk of sequences. If it
+            is cancelled, `OperationCancelled` is raised and the runs are
+            deleted.
+
+        Returns
+        -------
+        model: NgramModel
+            A new model holding the counts, which must be trained before
+            being used, or None if `output` was given.
+        """
+
+        if memory_budget <= 0:
+            raise ValueError("The memory budget must be positive.")
+
+        model = cls(pre_order, post_order, pad_symbol, store=store)
+        total = len(sequences) if hasattr(sequences, "__len__") else None
+        tracker = _Tracker("count_external", total, progress, cancel)
+
+        # Counts are keyed by tuples of context and state in a single table,
+        # so that the number of entries is always known.
+        table = Counter()
+        entry_cost = None
+        with tempfile.TemporaryDirectory(prefix="lpngram-", dir=tmpdir) as dirname:
+            runs = []
+            for chunk in tracker.chunks(sequences):
+                for sequence in chunk:
+                    for ngram in get_all_posngrams(
+                        sequence, model._pre, model._post, model._padsymbol
+                    ):
+                        table[ngram[:2]] += 1
+                model._seqlens.update([_seq_len(sequence) for sequence in chunk])
+
+                # Measure the cost of entries on the first chunk and when the
+                # budget seems to be reached, spilling if it actually is.
+                if entry_cost is None or len(table) * entry_cost >= memory_budget:
+                    entry_cost = deep_sizeof(table) / max(len(table), 1)
+                    if len(table) * entry_cost >= memory_budget:
+                        runs.append(os.path.join(dirname, "run-%i.run" % len(runs)))
+                        write_run(run_entries(table), runs[-1])
+                        table = Counter()
+
+            # If the counts fit in the budget, the model is built directly.
+            if not runs:
+                for (context, state), count in table.items():
+                    model._ngrams[context][state] = count
+                table = None
+                if output:
+                    model.save_counts(output)
+                    return None
+                return model
+
+            # Otherwise, the entries still in memory are merged along with
+            # the runs, without being spilled.
+            runs = reduce_runs(runs, dirname, MAX_FAN_IN - 1)
+            last_run = run_entries(table)
+            table = None
+            contexts = group_contexts(
+                merge_runs([read_run(run) for run in runs] + [last_run])
+            )
+
+            if output:
+                with _open_counts(output, "w") as handler:
+                    _write_counts_header(
+                        handler,
+                        model._pre,
+                        model._post,
+                        model._padsymbol,
+                        model._seqlens,
+                    )
+                    for context, counts in contexts:
+                        _write_counts_line(handler, context, counts)
+                return None
+
+            for context, counts in contexts:
+                model._ngrams[context].update(dict(counts))
+
+        return model
+
+    def train(
+        self,
+        method="laplace",
+        normalize=False,
+        bins=None,
+        progress=None,
+        cancel=None,
+        checkpoint=None,
+        checkpoint_every=100000,
+        resume=False,
+        **kwargs
+    ):
+        """
+        Train a model after ngrams have been collected.
+
+        This method does not return any value, but sets the internal variables
+        with smoothed probabilities (such as `self._p` and `self._p0`) and
+        internally marks the model as having been trained.
+
+        Parameters
+        ----------
+        method: str
+            The name of the smoothing method to be used, as used by
+            `smooth_dist()`. Either "uniform", "random", "mle", "lidstone",
+            "laplace", "ele", "wittenbell", "certaintydegree", or "sgt".
+            Defaults to "laplace".
+
+        normalize: boolean
+            Whether to normalize the log-probabilities for each ngram in the
+            model after smoothing, i.e., to guarantee that the probabilities
+            (with the probability for unobserved transitions counted a single
+            time) sum to 1.0. The normalization is performed with a
+            numerically stable log-sum-exp, vectorized if `numpy` is
+            available, but still adds to the cost of training. While
+            experiments with real data demonstrated that this normalization
+            does not improve the results or performance of the methods, the
+            computational cost of normalizing the probabilities might be
+            justified if descriptive statistics of the model, like samples
+            from the matrix of transition probabilities or the
+            entropy/perplexity of a sequence, are needed (such as for
+            publication), as they will be more in line with what is generally
+            expected and will facilitate the comparison of different models.
+
+        bins: int
+            The number of bins to be assumed when smoothing, for the smoothing
+            methods that use this information. Defaults to the number of
+            unique states observed, as gathered from the count of ngrams with
+            no context.
+
+        progress: function
+            An optional function called after each chunk of contexts is
+            smoothed, with a dictionary of the "stage" ("train"), the number
+            of contexts "done" and their "total", and the "elapsed" and
+            estimated remaining ("eta") seconds.
+
+        cancel: CancelToken
+            An optional token checked before each chunk of contexts. If it is
+            cancelled, `OperationCancelled` is raised and the model is left
+            untrained, with its counts unchanged.
+
+        checkpoint: str
+            An optional path to a checkpoint file, starting with a digest of
+            the counts and the training parameters, to which the contexts
+            smoothed since the previous checkpoint are appended every
+            `checkpoint_every` contexts, when the training is cancelled, and
+            when it is complete (all the contexts, if normalizing).
+
+        checkpoint_every: int
+            The number of contexts smoothed between two checkpoints, rounded
+            up to the size of the chunks. Defaults to 100000.
+
+        resume: bool
+            Whether to resume from the `checkpoint` file, if it exists, only
+            smoothing the contexts it does not hold. The counts of the model
+            (verified with their digest) and the training parameters must be
+            the same of the checkpoint, otherwise a `ValueError` is raised.
+            Defaults to False, overwriting any checkpoint.
+       """
+
+        # The smoothed probabilities of any previous training are cleared,
+        # so that a model being trained (or a checkpoint of it) only holds
+        # the contexts smoothed with the current parameters.
+        self._check_counts()
+        if self._stats is not None:
+            start = time.perf_counter()
+        self._reset_training()
+
+        # Compute the number of bins, if it was not informed, and internally
+        # store the training parameters, which are used by `._smooth()`.
+        self._bins = self._get_bins(bins)
+        self._smooth_method = method
+        self._smooth_kwargs = kwargs
+        self._normalize = normalize
+
+        # Restore the contexts smoothed in the checkpoint, if resuming, as
+        # long as they were smoothed from the same counts and parameters,
+        # which are identified by their digest (without holding a second
+        # copy of the counts). Otherwise, a new checkpoint log is started.
+        complete = False
+        if checkpoint:
+            header = {
+                "counts": counts_digest(self),
+                "params": [method, self._bins, kwargs, normalize],
+            }
+            state = read_log(checkpoint, "train") if resume else None
+            if state is None:
+                start_log(checkpoint, "train", header)
+            else:
+                if state[0]["counts"] != header["counts"]:
+                    raise ValueError(
+                        "Counts do not match checkpoint '%s'." % checkpoint
+                    )
+                if state[0]["params"] != header["params"]:
+                    raise ValueError(
+                        "Training parameters do not match checkpoint '%s'." % checkpoint
+                    )
+                for record in state[1]:
+                    for context, (prob, prob0) in record["dists"].items():
+                        self._p[context], self._p0[context] = prob, prob0
+                    complete = record["complete"]
+
+        if complete:
+            contexts = []
+        elif len(self._p):
+            contexts = (
+                (context, counter)
+                for context, counter in self._ngrams.items()
+                if context not in self._p
+            )
+        else:
+            contexts = self._ngrams.items()
+
+        # Perform the probability smoothing, in chunks of contexts. If
+        # normalization was requested, all contexts are normalized at once
+        # after smoothing, which is much faster than normalizing each one in
+        # turn (see `_normalize_dists()`); until then, the tables hold the
+        # smoothed log-probabilities, so that they can be checkpointed. Each
+        # checkpoint appends the contexts smoothed since the previous one to
+        # the log. If the training is cancelled, the model is left untrained.
+        position = len(self._p)
+        next_checkpoint = position + checkpoint_every
+        pending = {}
+        tracker = _Tracker("train", len(self._ngrams), progress, cancel, position)
+        try:
+            for chunk in tracker.chunks(contexts):
+                for context, counter in chunk:
+                    self._p[context], self._p0[context] = smooth_dist(
+                        counter, method=method, bins=self._bins, **kwargs
+                    )
+                    if checkpoint:
+                        pending[context] = (self._p[context], self._p0[context])
+
+                position += len(chunk)
+                if checkpoint and position >= next_checkpoint:
+                    append_log(checkpoint, {"dists": pending, "complete": False})
+                    pending = {}
+                    next_checkpoint = position + checkpoint_every
+        except OperationCancelled:
+            if checkpoint and pending:
+                append_log(checkpoint, {"dists": pending, "complete": False})
+            self._reset_training()
+            raise
+
+        if normalize and not complete:
+            smoothed = list(self._p)
+            dists = _normalize_dists(
+                [(self._p[context], self._p0[context]) for context in smoothed]
+            )
+            for context, (_, prob0) in zip(smoothed, dists):
+                self._p0[context] = prob0
+
+        # Compute the log-probabilities for lengths. As normalization changes
+        # all the tables, the last record of the log holds all of them in
+        # that case, and only the contexts smoothed since the previous
+        # record otherwise.
+        self._train_lengths()
+        self._finish_training()
+        if checkpoint and not complete:
+            if normalize:
+                pending = {
+                    context: (probs, self._p0[context])
+                    for context, probs in self._p.items()
                 }
+            append_log(checkpoint, {"dists": pending, "complete": True})
+
+        if self._stats is not None:
+            self._stats.record(
+                "train",
+                time.perf_counter() - start,
+                {"contexts": len(self._ngrams)},
+            )
+
+    def _finish_training(self):
+        """
+        Internal method for concluding the training of a model.
+
+        Clears the data computed with the previous training, including the
+        data used for random generation, which is only built when first
+        needed, and marks the model as trained.
+        """
+
+        self._ngram_space = None
+        self._spaces = {}
+        self._entropies = {}
+
+        # Store the highest log-probability of the model, which tells whether
+        # scores can only decrease as log-probabilities are added (see
+        # `.score_at_least()`).
+        self._max_p = max(
+            [
+                max(list(probs.values()) + [self._p0[context]])
+                for context, probs in self._p.items()
+            ],
+            default=0.0,
+        )
+
+        # Clear the scores computed with the previous training, if any.
+        if self._cache is not None:
+            self._cache.clear()
+
+        # Internally inform that the model was trained.
+        self._trained = True
+
+    def _get_bins(self, bins=None):
+        """
+        Internal method returning the number of bins to be used in training.
+
+        If the number of bins was not informed, we use the number of
+        transition states from the zero-context.
+        """
+
+        # The triple `or` is intended to prevent aberrant cases in which the
+        # no-context ngram is not available, to which we resort to the number
+        # of states (this default will only take place on user-crafted cases);
+        # likewise, the `or 1` guarantees that we don't have divisions by zero
+        # if the users trains on an empty collection (yielding results in
+        # line with what is probably expected).
+        if (_ELM_SYMBOL,) in self._ngrams:
+            return bins or len(self._ngrams[(_ELM_SYMBOL,)])
+
+        return bins or len(self._ngrams) or 1
+
+    def _smooth(self, counter):
+        """
+        Internal method for smoothing the counts of a single context.
+
+        The smoothing uses the parameters stored by the last call to
+        `.train()`, returning the log-probabilities for the observed states
+        and for unobserved ones. This allows to re-smooth only the contexts
+        affected by a change in the counts.
+        """
+
+        probs, prob0 = smooth_dist(
+            counter,
+            method=self._smooth_method,
+            bins=self._bins,
+            **self._smooth_kwargs
+        )
+
+        # Normalize, if so requested. See comments in the docstring of
+        # `.train()` for more information.
+        if self._normalize:
+            probs, prob0 = _normalize_dist(probs, prob0)
+
+        return probs, prob0
+
+    def _train_lengths(self):
+        """
+        Internal method for computing the log-probabilities of lengths.
+        """
+
+        self._l, self._l0 = _length_logprobs(self._seqlens)
+
+    def state_score(self, sequence):
+        """
+        Returns the relative likelihood for each state in a sequence.
+
+        Please note that this does not perform correction due to sequence
+        length, as optionally and by default performed by the `.score()`
+        method. The model must have been trained in advance.
+
+        Parameters
+        ----------
+        sequence: list
+            A list of states to be scored.
+
+        Returns
+        -------
+        prob: list
+            A list of floats, of the same length of `sequence`, with the
+            individual log-probability for each state.
+        """
+
+        # Assert the model was trained.
+        self._check_capability("score")
+
+        # Sequences are scored as tuples, so that strings of states separated
+        # by spaces have the same results (and cache entries) of the
+        # equivalent lists.
+        sequence = _seq_as_tuple(sequence)
+        if self._cache is None:
+            return self._state_score(sequence)
+
+        # Cached values are stored as tuples and returned as new lists, so
+        # that the caller cannot change them.
+        key = ("state_score", sequence)
+        s_prob = self._cache.get(key)
+        if s_prob is None:
+            s_prob = tuple(self._state_score(sequence))
+            self._cache.put(key, s_prob)
+
+        return list(s_prob)
+
+    def _state_score(self, sequence):
+        """
+        Internal method for scoring the states of a sequence, without cache.
+        """
+
+        if self._stats is not None:
+            return self._timed_state_score(sequence)
+
+        # Compacted models look up array-backed tables; padded sequences in
+        # trie stores are scored with a single walk per position.
+        if self._keep is not None:
+            return self._compact_state_score(sequence)
+        if self._store == "trie" and self._padsymbol:
+            return self._trie_state_score(sequence)
+
+        return self._dict_state_score(sequence)
+
+    def _timed_state_score(self, sequence):
+        """
+        Internal method for scoring the states of a sequence, recording the
+        statistics of the call.
+
+        Besides the time, the number of states and of backoffs (i.e., of
+        contexts not observed in training, whose probabilities are computed
+        with the chain rule) are counted; the latter requires an additional
+        collection of the ngrams of the sequence, which is not timed.
+        """
+
+        start = time.perf_counter()
+        if self._keep is not None:
+            s_prob = self._compact_state_score(sequence)
+        elif self._store == "trie" and self._padsymbol:
+            s_prob = self._trie_state_score(sequence)
+        else:
+            s_prob = self._dict_state_score(sequence)
+        seconds = time.perf_counter() - start
+
+        backoffs = sum(
+            [
+                1
+                for ngram, _, _ in get_all_posngrams(
+                    sequence, self._pre, self._post, self._padsymbol
+                )
+                if ngram not in self._p
+            ]
+        )
+        self._stats.record(
+            "state_score", seconds, {"states": len(s_prob), "backoffs": backoffs}
+        )
+
+        return s_prob
+
+    def _dict_state_score(self, sequence):
+        """
+        Internal method for scoring the states of a sequence by looking up
+        each of its positional ngrams.
+        """
+
+        # Pre-allocate the list holding the probability (i.e., the relative
+        # likelihood) for each state in `sequence`.
+        s_prob = [0.0] * len(sequence)
+
+        # We collect all positional ngrams in `sequence`, using the same
+        # parameters for the model ngram collection, and compute the state
+        # probability in each case, appending/adding the results to the
+        # correct element in `s_prob`.
+        for ngram, state, idx in get_all_posngrams(
+            sequence, self._pre, self._post, self._padsymbol
+        ):
+            s_prob[idx] += _ngram_logprob(self._p, self._p0, ngram, state)
+
+        return s_prob
+
+    def _compact_state_score(self, sequence):
+        """
+        Internal method for scoring the states of a sequence with the
+        array-backed tables of a compacted model.
+        """
+
+        ngram_logprob = self._p.ngram_logprob
+        s_prob = [0.0] * len(sequence)
+        for ngram, state, idx in get_all_posngrams(
+            sequence, self._pre, self._post, self._padsymbol
+        ):
+            s_prob[idx] += ngram_logprob(ngram, state)
+
+        return s_prob
+
+    def _trie_state_score(self, sequence):
+        """
+        Internal method for scoring the states of a sequence with a trie store.
+
+        The results are the same of `.state_score()`, but all the contexts of
+        each position are retrieved with a single walk on the trie, instead
+        of building and looking up a tuple for each context order.
+        """
+
+        max_pre, max_post = max(self._pre), max(self._post)
+        seq = _seq_as_tuple(sequence)
+        padded = (self._padsymbol,) * max_pre + seq + (self._padsymbol,) * max_post
+
+        zero_p = self._p.get((_ELM_SYMBOL,), {})
+        zero_p0 = self._p0.get((_ELM_SYMBOL,))
+        orders = list(product(self._pre, self._post))
+
+        s_prob = [0.0] * len(seq)
+        for idx in range(len(seq)):
+            center = idx + max_pre
+            state = padded[center]
+            found = {
+                (pre_len, post_len): node
+                for pre_len, post_len, node in self._p.walk(
+                    padded[center - max_pre : center][::-1],
+                    padded[center + 1 : center + 1 + max_post],
+                )
+            }
+
+            for pre_len, post_len in orders:
+                node = found.get((pre_len, post_len))
+                if node is not None:
+                    probs = self._p.node_value(node)
+                    if state in probs:
+                        s_prob[idx] += probs[state]
+                    else:
+                        s_prob[idx] += self._p0.node_value(node)
+                else:
+                    # Use the same chain rule backoff of `_ngram_logprob()`.
+                    s_prob[idx] += sum(
+                        [
+                            zero_p.get(seq_state, zero_p0)
+                            for seq_state in padded[
+                                center - pre_len : center + 1 + post_len
+                            ]
+                        ]
+                    )
+
+        return s_prob
+
+    def score(self, sequence, use_length=True):
+        """
+        Returns the relative likelihood of a sequence.
+
+        The model must have been trained before using this function.
+
+        Parameters
+        ----------
+        sequence: list
+            A list of states to be scored.
+
+        use_length: bool
+            Whether to correct the sequence relative likelihood by using
+            length probability. Defaults to True.
+
+        Returns
+        -------
+        prob: list
+            A list of floats, of the same length of `sequence`, with the
+            individual log-probability for each state.
+        """
+
+        # Assert the model was trained.
+        self._check_capability("score")
+
+        # Sequences are scored as tuples, as in `.state_score()`.
+        sequence = _seq_as_tuple(sequence)
+        if self._cache is not None:
+            key = ("score", sequence, use_length)
+            _prob = self._cache.get(key)
+            if _prob is None:
+                _prob = self._score(sequence, use_length)
+                self._cache.put(key, _prob)
+            return _prob
+
+        return self._score(sequence, use_length)
+
+    def _score(self, sequence, use_length):
+        """
+        Internal method for scoring a sequence, without cache.
+        """
+
+        # Get the sum of individual log-probabilities, correct them with the
+        # sequence length probability if requested and return.
+        _prob = sum(self._state_score(sequence))
+        if use_length:
+            if len(sequence) in self._l:
+                _prob += self._l[len(sequence)]
+            else:
+                _prob += self._l0
+
+        return _prob
+
+    def enable_cache(self, maxsize=100000):
+        """
+        Enable a bounded cache for the results of scoring methods.
+
+        When enabled, the results of `.state_score()` and `.score()` (and
+        thus of `.entropy()` and `.perplexity()`, which are computed from
+        the latter) are stored for each sequence, discarding the least
+        recently used ones when the cache is full. Sequences are normalized
+        as tuples, so that a string and the corresponding list of states
+        share their entry. The cache is cleared every time the model changes
+        (e.g., when sequences are added or the model is trained).
+
+        Parameters
+        ----------
+        maxsize: int
+            The maximum number of cached results. Defaults to 100000.
+        """
+
+        self._cache = LRUCache(maxsize)
+
+    def disable_cache(self):
+        """
+        Disable the cache of scoring results, discarding it.
+        """
+
+        self._cache = None
+
+    def cache_info(self):
+        """
+        Returns the statistics of the cache of scoring results.
+
+        Returns
+        -------
+        info: dict
+            A dictionary with the number of "hits", "misses" and "evictions"
+            since the cache was enabled, its "maxsize" and its current
+            "size", or None if the cache is not enabled.
+        """
+
+        if self._cache is None:
+            return None
+
+        return self._cache.info()
+
+    def enable_stats(self, callback=None):
+        """
+        Enable the collection of statistics on the model stages.
+
+        When enabled, the wall time and the number of calls of the main
+        stages of the model are recorded, along with counters and sizes
+        specific to each one: "add_sequences" (sequences and states added,
+        and number of contexts), "train" (contexts smoothed and size of the
+        ngram space), "state_score" (states scored and backoffs to the chain
+        rule for unobserved contexts, also for `.score()` and the methods
+        built on it) and "generation" (sequences returned and sizes of the
+        search space). Results served by the cache, as well as calls
+        performed in worker processes, are not recorded. Enabling the
+        statistics discards any previously collected ones.
+
+        Parameters
+        ----------
+        callback: function
+            An optional function called after each recorded call, with the
+            name of the stage, its wall time in seconds, and a dictionary
+            with its counters and sizes.
+        """
+
+        self._stats = ModelStats(callback)
+
+    def disable_stats(self):
+        """
+        Disable the collection of statistics, discarding them.
+        """
+
+        self._stats = None
+
+    def stats(self):
+        """
+        Returns the statistics collected on the model stages.
+
+        Returns
+        -------
+        stats: dict
+            A dictionary of stage names to dictionaries with their number of
+            "calls", their total time in "seconds", and their counters and
+            sizes, or None if statistics are not enabled.
+        """
+
+        if self._stats is None:
+            return None
+
+        return self._stats.as_dict()
+
+    def _record_generation(self, start, scale, counters):
+        """
+        Internal method for recording the statistics of random generation.
+        """
+
+        self._stats.record(
+            "generation",
+            time.perf_counter() - start,
+            counters,
+            self._search_space(scale).info(),
+        )
+
+    def __reduce_ex__(self, protocol):
+        """
+        Returns the pickle representation of the model.
+
+        Instead of the nested dictionaries of the model, which would be
+        pickled with all their tuples and floats, the state holds a
+        vocabulary of symbols, the contexts as flat arrays of symbol
+        identifiers, and the counts and log-probabilities as flat arrays
+        (see `_dump_mapping()`). With pickle protocol 5 or higher the arrays
+        are pickled as `pickle.PickleBuffer` objects, which are not copied and
+        can be transferred out-of-band; the arrays of compacted models are
+        used directly, without copies, when unpickled. The scoring cache and
+        the search spaces are not pickled, but the cache is enabled again
+        with the same size.
+        """
+
+        return copyreg.__newobj__, (type(self),), self._pickle_state(protocol)
+
+    def _pickle_state(self, protocol):
+        """
+        Internal method returning the pickle state of the model.
+        """
+
+        compact_p = isinstance(self._p, CompactTable)
+        space = self._ngram_space
+        if not isinstance(space, CompactCounts):
+            space = None
+
+        # Collect the vocabulary of symbols, starting with those of compacted
+        # tables so that their state identifiers can be kept. Trie stores
+        # hold the symbols of their contexts in their own structure.
+        symbols = {}
+        if compact_p:
+            symbols.update(dict.fromkeys(self._p._symbols))
+            symbols.update(dict.fromkeys(chain.from_iterable(self._p)))
+        for table in [self._ngrams, None if compact_p else self._p]:
+            if table is not None:
+                symbols.update(dict.fromkeys(chain.from_iterable(table.values())))
+                if not isinstance(table, ContextTrie):
+                    symbols.update(dict.fromkeys(chain.from_iterable(table)))
+        if space is not None:
+            symbols.update(dict.fromkeys(chain.from_iterable(space)))
+        symbols = list(symbols)
+        symbol_ids = {symbol: idx for idx, symbol in enumerate(symbols)}
+
+        state = {
+            "attrs": {
+                key: value
+                for key, value in self.__dict__.items()
+                if key not in _PICKLED_TABLES
+            },
+            "symbols": symbols,
+            "ngrams": None,
+            "p": None,
+            "ngram_space": None,
+            "cache_size": self._cache.maxsize if self._cache is not None else None,
+        }
+
+        if self._ngrams is not None:
+            state["ngrams"] = _dump_mapping(self._ngrams, symbol_ids, protocol)[0]
+
+        if compact_p:
+            state["p"] = (
+                "compact",
+                _dump_tuples(list(self._p), symbol_ids, protocol),
+                tuple(
+                    dump_array(arr, protocol)
+                    for arr in [
+                        self._p._offsets,
+                        self._p._states,
+                        self._p._values,
+                        self._p._unobserved,
+                    ]
+                ),
+            )
+        elif self._p is not None:
+            # The values of unobserved states follow the order of the keys
+            # (contexts or trie nodes) of the observed ones.
+            # Tries sharing the nodes of the counts are pickled without their
+            # structure, which is restored from the counts.
+            shared = (
+                isinstance(self._p, ContextTrie)
+                and self._ngrams is not None
+                and self._p._edges is self._ngrams._edges
+            )
+            p_state, keys = _dump_mapping(
+                self._p, symbol_ids, protocol, structure=not shared
+            )
+            if isinstance(self._p, ContextTrie):
+                probs0 = [self._p0._get_node(node) for node in keys]
+            else:
+                probs0 = [self._p0[context] for context in keys]
+            state["p"] = ("table", p_state, dump_array(array("d", probs0), protocol))
+
+        # The ngram space of models which are not compacted is not pickled,
+        # as it is built again from the counts when needed.
+        if space is not None:
+            state["ngram_space"] = (
+                _dump_tuples(space, symbol_ids, protocol),
+                dump_array(space._counts, protocol),
+            )
+
+        return state
+
+    def __setstate__(self, state):
+        """
+        Restores the model from the state returned by `.__reduce_ex__()`.
+        """
+
+        self.__dict__.update(state["attrs"])
+        symbols = state["symbols"]
+
+        self._ngrams = None
+        if state["ngrams"] is not None:
+            if self._store == "trie":
+                self._ngrams = ContextTrie(Counter)
+            else:
+                self._ngrams = defaultdict(Counter)
+            _load_mapping(
+                state["ngrams"],
+                symbols,
+                self._ngrams,
+                lambda items: Counter(dict(items)),
+            )
+
+        self._p, self._p0 = None, None
+        if state["p"] is not None and state["p"][0] == "compact":
+            _, contexts, arrays = state["p"]
+            self._p = CompactTable.from_arrays(
+                _load_tuples(contexts, symbols),
+                symbols,
+                tuple(load_array(arr) for arr in arrays),
+                _ELM_SYMBOL,
+            )
+            self._p0 = self._p.unobserved
+        elif state["p"] is not None:
+            _, p_state, probs0 = state["p"]
+            if self._store == "trie":
+                if p_state[0][1] is None:
+                    self._p = ContextTrie(nodes=self._ngrams)
+                else:
+                    self._p = ContextTrie()
+                self._p0 = ContextTrie(nodes=self._p)
+                keys = _load_mapping(p_state, symbols, self._p, dict)
+                self._p0._load_values(keys, load_array(probs0))
+            else:
+                self._p = {}
+                keys = _load_mapping(p_state, symbols, self._p, dict)
+                self._p0 = dict(zip(keys, load_array(probs0)))
+
+        self._ngram_space = None
+        if state["ngram_space"] is not None:
+            keys, counts = state["ngram_space"]
+            self._ngram_space = CompactCounts.from_arrays(
+                _load_tuples(keys, symbols), load_array(counts)
+            )
+
+        self._cache = None
+        if state["cache_size"] is not None:
+            self._cache = LRUCache(state["cache_size"])
+        self._spaces = {}
+
+    def memory_usage(self):
+        """
+        Returns the memory used by the model, by component.
+
+        Sizes are computed with a deep accounting of all the objects held by
+        each component. Objects shared among components (such as states,
+        contexts, or the nodes of trie stores) are only counted for the first
+        component holding them, in the order "ngrams" (counts), "ngram_space"
+        (counts for generation), "p" and "p0" (smoothed log-probabilities),
+        "lengths" (length counts and log-probabilities), and "caches"
+        (scoring cache, search spaces, and entropies), so that the values
+        add up to the total.
+
+        Returns
+        -------
+        usage: dict
+            A dictionary of component names to their sizes in bytes, with the
+            size of the entire model, including the objects not listed among
+            the components, as "total".
+        """
+
+        components = {
+            "ngrams": [self._ngrams],
+            "ngram_space": [self._ngram_space],
+            "p": [self._p],
+            "p0": [self._p0],
+            "lengths": [self._seqlens, self._l, self._l0],
+            "caches": [self._cache, self._spaces, self._entropies],
+        }
+
+        seen = set()
+        usage = {
+            name: sum([deep_sizeof(obj, seen) for obj in objs])
+            for name, objs in components.items()
+        }
+        usage["total"] = sum(usage.values()) + deep_sizeof(self, seen)
+
+        return usage
+
+    def compact(self, keep=("score",)):
+        """
+        Drops the structures not needed for inference, compacting the others.
+
+        Trained models hold, besides their log-probabilities, the raw counts
+        used for training and the ngram space used for random generation.
+        This method turns the model into an inference-only one, dropping
+        the counts and any structure not needed for the requested
+        capabilities, and storing the remaining ones in compact array-backed
+        tables (see `CompactTable`), which take a fraction of the memory at
+        the cost of somewhat slower lookups. Compacted models cannot be
+        changed nor trained again, and using a dropped capability fails with
+        an `AssertionError`, as using an untrained model does.
+
+        Parameters
+        ----------
+        keep: tuple
+            The capabilities to be kept, "score" (all scoring methods, as well
+            as entropies and `.best_seqs()`) and/or "generate" (random
+            generation). Defaults to `("score",)`.
+        """
+
+        keep = tuple(keep)
+        if not keep or any(
+            [capability not in ["score", "generate"] for capability in keep]
+        ):
+            raise ValueError("Capabilities must be 'score' and/or 'generate'.")
+        for capability in keep:
+            self._check_capability(capability)
+
+        # The ngram space must be built before dropping the counts.
+        if "generate" in keep:
+            self._ngram_space = CompactCounts(self._get_ngram_space())
+        else:
+            self._ngram_space = None
+            self._spaces = {}
+
+        if "score" in keep:
+            if not isinstance(self._p, CompactTable):
+                self._p = CompactTable(self._p, self._p0, _ELM_SYMBOL)
+                self._p0 = self._p.unobserved
+        else:
+            self._p, self._p0 = None, None
+            self._entropies = {}
+            if self._cache is not None:
+                self._cache.clear()
+
+        self._ngrams = None
+        self._keep = keep
+
+    @classmethod
+    def estimate_memory(
+        cls,
+        sequences,
+        pre_order=0,
+        post_order=0,
+        pad_symbol=_PAD_SYMBOL,
+        sample=0.1,
+        seed=None,
+        sketch_size=1024,
+        store="dict",
+    ):
+        """
+        Estimates the memory of a trained model for a corpus, from a sample.
+
+        A fraction of the sequences is drawn at random, and the number of
+        distinct contexts and of distinct context/state entries (i.e., the
+        ngrams stored by the model) is estimated with K-minimum-values
+        sketches at growing prefixes of the sample. A Heaps' law curve fitted
+        to the largest prefixes is extrapolated to the number of sequences in
+        the corpus; as vocabularies grow slower than the curve when they
+        saturate, the estimates tend to be conservative. The cost per context
+        and per entry of each component is fitted on models trained on the
+        prefixes, so that the sample must fit in memory. The estimate
+        includes the ngram space and the search space (under "caches", as in
+        `.memory_usage()`), which models only build when first used for
+        random generation. Besides them, each generation call holds the
+        candidates and completion probabilities of the contexts it visits,
+        for each number of remaining states, which are released when it is
+        done; they depend on the call (mostly on the sequence lengths), and
+        can take several times the memory of the model.
+
+        Parameters
+        ----------
+        sequences: list
+            The corpus the model would be built from.
+
+        pre_order: int or list
+            The preceding orders, as in the class constructor.
+
+        post_order: int or list
+            The following orders, as in the class constructor.
+
+        pad_symbol: object
+            The padding symbol, as in the class constructor.
+
+        sample: float
+            The fraction of the sequences to be sampled. Defaults to 0.1.
+
+        seed: obj
+            Any hasheable object, used to feed the random number generator
+            drawing the sample.
+
+        sketch_size: int
+            The number of hash values kept by the sketches; estimates of
+            distinct counts have a relative error of about
+            `1 / sqrt(sketch_size)`. Defaults to 1024.
+
+        store: str
+            The context store, as in the class constructor.
+
+        Returns
+        -------
+        estimate: dict
+            A dictionary with the number of "sequences" in the corpus and of
+            "sampled" ones, the estimated numbers of "contexts" and
+            "entries", the fitted "heaps_exponent" of the entries, the
+            estimated sizes of the components in "bytes" (as in
+            `.memory_usage()`), and their "total".
+        """
+
+        if not sequences:
+            raise ValueError("Corpus must have at least one sequence.")
+        if not 0 < sample <= 1:
+            raise ValueError("Sample must be a fraction in (0, 1].")
+
+        model = cls(pre_order, post_order, pad_symbol, store=store)
+        rng = random.Random(seed)
+        n_sample = max(1, round(len(sequences) * sample))
+        sampled = [
+            sequences[idx]
+            for idx in sorted(rng.sample(range(len(sequences)), n_sample))
+        ]
+
+        # Estimate the distinct counts at geometrically growing prefixes of
+        # the sample, for fitting Heaps' law.
+        checkpoints = {math.ceil(n_sample / 2 ** exp) for exp in range(8)}
+        contexts, entries = _KMVSketch(sketch_size), _KMVSketch(sketch_size)
+        ctx_points, ent_points = [], []
+        for idx, sequence in enumerate(sampled):
+            for ngram, state, _ in get_all_posngrams(
+                sequence, model._pre, model._post, model._padsymbol
+            ):
+                contexts.add(ngram)
+                entries.add((ngram, state))
+            if idx + 1 in checkpoints:
+                ctx_points.append((idx + 1, contexts.estimate()))
+                ent_points.append((idx + 1, entries.estimate()))
+
+        # The curves are fitted to the largest prefixes, as the growth of
+        # vocabularies slows down with size.
+        ctx_k, ctx_beta = _heaps_fit(ctx_points[-2:])
+        ent_k, ent_beta = _heaps_fit(ent_points[-2:])
+        n_contexts = ctx_k * len(sequences) ** ctx_beta
+        n_entries = ent_k * len(sequences) ** ent_beta
+
+        # Measure the sizes of models trained on growing prefixes of the
+        # sample, fitting for each component a cost per context and a cost
+        # per entry which are used for extrapolation. The ngram space and the
+        # search space (with the default scale of `.random_seqs()`) are only
+        # built by the first generation call, so they are built explicitly.
+        measures = []
+        prefixes = sorted(checkpoints)[-4:]
+        for begin, end in zip([0] + prefixes, prefixes):
+            model.add_sequences(sampled[begin:end])
+            model.train()
+            model._search_space(2)
+            measures.append(
+                (
+                    len(model._ngrams),
+                    sum([len(counter) for counter in model._ngrams.values()]),
+                    model.memory_usage(),
+                )
+            )
+
+        estimate = {}
+        for name in ["ngrams", "ngram_space", "p", "p0", "caches"]:
+            per_ctx, per_ent = _fit_costs(
+                [(n_ctx, n_ent, usage[name]) for n_ctx, n_ent, usage in measures]
+            )
+            estimate[name] = round(per_ctx * n_contexts + per_ent * n_entries)
+        estimate["lengths"] = measures[-1][2]["lengths"]
+
+        return {
+            "sequences": len(sequences),
+            "sampled": n_sample,
+            "contexts": round(n_contexts),
+            "entries": round(n_entries),
+            "heaps_exponent": ent_beta,
+            "bytes": estimate,
+            "total": sum(estimate.values()),
+        }
+
+    def score_at_least(self, sequences, threshold, use_length=True):
+        """
+        Returns whether sequences reach a minimum relative likelihood.
+
+        The log-probabilities of each sequence are accumulated in the same
+        order of `.score()`, so that full scores are exactly the same, and a
+        sequence is abandoned as soon as its partial score (with the length
+        correction) falls below `threshold`. As log-probabilities cannot be
+        positive, the partial score can only decrease, so that such a
+        sequence can never reach the threshold. If
+        the model holds positive log-probabilities (as possible with some
+        smoothing methods without normalization), all sequences are fully
+        scored.
+
+        Parameters
+        ----------
+        sequences: list
+            A list of sequences to be scored.
+
+        threshold: float
+            The minimum log-probability score for a sequence to pass.
+
+        use_length: bool
+            Whether to correct the sequence relative likelihood by using
+            length probability, as in `.score()`. Defaults to True.
+
+        Returns
+        -------
+        results: list
+            A list of tuples, one for each sequence, with a boolean informing
+            whether the sequence reached the threshold and its score, equal to
+            the one returned by `.score()`, or a partial score (an upper bound
+            of the full one) for the sequences that were abandoned.
+        """
+
+        # Assert the model was trained.
+        self._check_capability("score")
+
+        # Check, a single time, whether early exit is possible at all.
+        can_exit = self._max_p <= 0.0
+
+        return [
+            self._score_above(sequence, threshold, use_length, can_exit)
+            for sequence in sequences
+        ]
+
+    def _score_above(self, sequence, threshold, use_length, can_exit):
+        """
+        Internal method for scoring a sequence with early exit.
+
+        Returns a tuple of whether the score reaches `threshold` (always true
+        if the threshold is None) and the full or partial score, as in
+        `.score_at_least()`.
+        """
+
+        if threshold is None:
+            threshold, can_exit = -math.inf, False
+
+        # Sequences are scored as tuples, as in `.score()`.
+        sequence = _seq_as_tuple(sequence)
+        length_prob = 0.0
+        if use_length:
+            length_prob = self._l.get(len(sequence), self._l0)
+            if can_exit and length_prob < threshold:
+                return False, length_prob
+
+        if self._keep is not None:
+            ngram_logprob = self._p.ngram_logprob
+        else:
+            ngram_logprob = partial(_ngram_logprob, self._p, self._p0)
+
+        # The log-probabilities are added in the same order of `.score()`
+        # (the orders of each state, then the states, then the length), so
+        # that full scores are exactly the same. As adding a non-positive
+        # value cannot increase a floating point sum, the partial score with
+        # the length correction is an upper bound of the full score.
+        ngrams = [[] for _ in range(len(sequence))]
+        for ngram, state, idx in get_all_posngrams(
+            sequence, self._pre, self._post, self._padsymbol
+        ):
+            ngrams[idx].append((ngram, state))
+
+        _prob = 0.0
+        for state_ngrams in ngrams:
+            s_prob = 0.0
+            for ngram, state in state_ngrams:
+                s_prob += ngram_logprob(ngram, state)
+                if can_exit:
+                    bound = _prob + s_prob
+                    if use_length:
+                        bound += length_prob
+                    if bound < threshold:
+                        return False, bound
+            _prob += s_prob
+
+        if use_length:
+            _prob += length_prob
+
+        return _prob >= threshold, _prob
+
+    def rank(self, candidates, k=10, use_length=True, n_jobs=1, chunk_size=10000):
+        """
+        Returns the best scoring sequences among a collection of candidates.
+
+        Candidates are consumed lazily, in chunks, keeping only the `k` best
+        ones found so far in a heap, so that iterables of any size can be
+        ranked without being materialized. Once `k` candidates are found, the
+        lowest score in the heap is used as a threshold for scoring the
+        following ones with early exit, as in `.score_at_least()`. When
+        running in parallel, each chunk is ranked by a worker process, using
+        the threshold available when the chunk is sent, and the results are
+        merged in the heap.
+
+        Parameters
+        ----------
+        candidates: iterable
+            The candidate sequences to be ranked.
+
+        k: int
+            The number of sequences to be returned, which must be at least 1.
+            Defaults to 10.
+
+        use_length: bool
+            Whether to correct the sequence relative likelihood by using
+            length probability, as in `.score()`. Defaults to True.
+
+        n_jobs: int
+            The number of processes for ranking the chunks in parallel. None
+            or values lower than one use all available CPUs. Defaults to 1.
+
+        chunk_size: int
+            The number of candidates in each chunk. Defaults to 10000.
+
+        Returns
+        -------
+        ranked: list
+            A list of at most `k` tuples of a candidate and its score, sorted
+            by decreasing score; candidates with the same score are kept in
+            their original order.
+        """
+
+        # Assert the model was trained.
+        self._check_capability("score")
+        if k < 1:
+            raise ValueError("Number of ranked sequences must be at least 1.")
+
+        # The heap holds tuples of score, negative index (so that earlier
+        # candidates are preferred in ties), and candidate, with the worst
+        # candidate on top.
+        heap = []
+
+        def _tasks():
+            iterator = iter(candidates)
+            start = 0
+            while True:
+                chunk = list(islice(iterator, chunk_size))
+                if not chunk:
+                    return
+                yield chunk, start, heap[0][0] if len(heap) == k else None
+                start += len(chunk)
+
+        shared = (self, k, use_length, self._max_p <= 0.0)
+        for results in imap(_rank_chunk, _tasks(), n_jobs, shared):
+            for entry in results:
+                if len(heap) < k:
+                    heapq.heappush(heap, entry)
+                elif entry > heap[0]:
+                    heapq.heapreplace(heap, entry)
+
+        return [(entry[2], entry[0]) for entry in sorted(heap, reverse=True)]
+
+    def model_entropy(self, by=None):
+        """
+        Return the model entropy.
+
+        This methods collects the P x log(P) for all contexts, returning
+        their sum. This is different from a sequence cross-entropy,
+        and should be used to estimate the complexity of a model.
 
-            # Filter all the items in the search space `sspace` that do not
-            # start with what we have in the random sequence so far.
-            sspace = {
-                key: value
-                for key, value in sspace.items()
-                if key[:-1] == rnd_seq[-len(key) + 1 :]
-            }
+        The terms are computed directly from the log-probabilities (as
+        `-exp(logp) * logp`), so that there is no underflow problem when
+        recovering very small probabilities. Contexts are processed in
+        chunks, with vectorized operations if `numpy` is available, without
+        collecting the terms of the entire model, and the results are cached
+        until the model is trained again.
 
-            # If the random sequence plus the new element would match the
-            # sequence length, we can only use entries that end with the
-            # padding symbol (the boundary symbol) if those are used
-            # (max(self._post)>0); in all other cases, we must make sure that
-            # the element is *not* a padding symbol. `seq_len` here already
-            # includes the maximum padding on the left and at most one
-            # padding on the right, if the model was trained as such.
-            if max(self._post) > 0:
-                if len(rnd_seq) + 1 == seq_len:
-                    sspace = {
-                        key: value
-                        for key, value in sspace.items()
-                        if key[-1] == self._padsymbol
-                    }
-                else:
-                    sspace = {
-                        key: value
-                        for key, value in sspace.items()
-                        if key[-1] != self._padsymbol
-                    }
-
-            # Scale the counts by key length (so we favor longer ngrams that
-            # should be able to better capture the likelihood, while keeping
-            # room for less frequent but observed elements) and by the
-            # provided `scale`, which can be set to 1 for no effect.
-            sspace = {key: (value * len(key)) ** scale for key, value in sspace.items()}
-
-            # If we were unable to get a suitable searching space, the
-            # generation failed and we must signal that; otherwise, let's
-            # choose a random ngram for the search space and append its new
-            # element (at the end, index -1) to our random sequence.
-            if not sspace:
-                # We will get to this point if the generation failed because no
-                # suitable search space was found. We just reset the random
-                # sequence to the initial state and keep trying until we
-                # exhaust the number of tries, retuning `None` on failure.
-                # There would be better logics for this, but they might
-                # impact the idea of having this function as a "primitive" if
-                # we ever move to a different architecture.
-                gen_tries += 1
-                if gen_tries < tries:
-                    rnd_seq = (self._padsymbol,) * max(self._pre)
-                else:
-                    return None
+        Parameters
+        ----------
+        by: str
+            An optional breakdown of the entropy, either "context" (the
+            entropy of each context) or "order" (the sum of the entropies of
+            the contexts of each combination of preceding and following
+            orders). If not given, the total entropy is returned.
+
+        Returns
+        -------
+        h: float or dict
+            The model entropy, or a dictionary with the breakdown of the
+            entropy, indexed by contexts or by tuples of the preceding and
+            the following order.
+        """
+
+        if by not in [None, "context", "order"]:
+            raise ValueError("Unknown entropy breakdown '%s'." % by)
+        if self._keep is not None:
+            self._check_capability("score")
+
+        if by not in self._entropies:
+            if by == "context":
+                entropy = {}
+                for chunk, entropies in self._iter_context_entropies():
+                    entropy.update(zip(chunk, entropies))
+            elif by == "order":
+                entropy = defaultdict(float)
+                for chunk, entropies in self._iter_context_entropies():
+                    for context, context_entropy in zip(chunk, entropies):
+                        idx = context.index(_ELM_SYMBOL)
+                        entropy[idx, len(context) - idx - 1] += context_entropy
+                entropy = dict(entropy)
             else:
-                pop = list(sspace.keys())
-                weight = list(sspace.values())
-                rnd_seq += (random.choices(pop, weight)[0][-1],)
+                entropy = math.fsum(
+                    [
+                        math.fsum(entropies)
+                        for _, entropies in self._iter_context_entropies()
+                    ]
+                )
+            self._entropies[by] = entropy
+
+        # Return copies of dictionaries, so that the cache cannot be changed.
+        entropy = self._entropies[by]
+        return dict(entropy) if isinstance(entropy, dict) else entropy
+
+    def _iter_context_entropies(self, chunk_size=65536):
+        """
+        Internal method for iterating over the entropies of contexts.
+
+        Returns an iterator over tuples of a chunk of contexts and a list with
+        their entropies, so that the entropies of the entire model are never
+        collected at once.
+        """
+
+        np = _import_numpy()
+        contexts = iter(self._p)
+        while True:
+            chunk = list(islice(contexts, chunk_size))
+            if not chunk:
+                return
+
+            probs = [self._p[context] for context in chunk]
+            probs0 = [self._p0[context] for context in chunk]
+            if not np:
+                yield chunk, [
+                    -(
+                        math.exp(prob0) * prob0
+                        + sum([math.exp(prob) * prob for prob in row.values()])
+                    )
+                    / math.log(2.0)
+                    for prob0, row in zip(probs0, probs)
+                ]
+                continue
+
+            # The terms of each row are summed from the cumulative sum of
+            # all terms, which also handles empty rows.
+            ends = np.cumsum(
+                np.fromiter(map(len, probs), dtype=np.int64, count=len(probs))
+            )
+            values = np.fromiter(
+                chain.from_iterable(row.values() for row in probs),
+                dtype=float,
+                count=int(ends[-1]),
+            )
+            cumsum = np.concatenate([[0.0], np.cumsum(np.exp(values) * values)])
+            probs0 = np.array(probs0, dtype=float)
+            entropies = -(
+                cumsum[ends] - cumsum[ends - np.diff(ends, prepend=0)]
+                + np.exp(probs0) * probs0
+            ) / math.log(2.0)
+
+            yield chunk, entropies.tolist()
+
+    def entropy(self, sequence, base=2.0):
+        """
+        Calculates the cross-entropy of a sequence.
+
+        Parameters
+        ----------
+        sequence: list
+            The sequence whose cross-entropy will be calculated.
+
+        base: float
+            The logarithmic base for the cross-entropy calculation. Defaults to
+            2.0, following the standard approach set by Shannon that allows
+            to consider entropy in terms of bits needed for unique
+            representation.
+
+        Returns
+        -------
+        ch: float
+            The cross-entropy calculated for the sequence, a real number.
+        """
+        return -(self.score(sequence) / math.log(base)) / _seq_len(sequence)
+
+    def perplexity(self, sequence):
+        """
+        Calculates the perplexity of a model.
+
+        As per definition, this is simply 2.0 to the cross-entropy of the
+        given sequence on logarithmic base of 2.0.
+
+        Parameters
+        ----------
+        sequence: list
+            The sequence whose perplexity should be calculated.
 
-                # If we are now at the requested length for the random
-                # sequence, let's exit the loop and the return the random
-                # sequence.
-                if len(rnd_seq) == seq_len:
-                    return rnd_seq
+        Returns
+        -------
+        perplexity: float
+            The calculated perplexity for the sequence.
+        """
+        return 2.0 ** self.entropy(sequence)
 
     def random_seqs(
-        self, k=1, seq_len=None, scale=2, only_longest=False, attempts=10, seed=None
+        self,
+        k=1,
+        seq_len=None,
+        scale=2,
+        only_longest=False,
+        attempts=10,
+        seed=None,
+        n_jobs=1,
+        unique=False,
+        exclude=None,
+        progress=None,
+        cancel=None,
     ):
         """
         Return a set of random sequences based in the observed transition
         frequencies.
 
-        This function tries to generate a set of `k` random sequences from the
-        internal model. Given that the random selection and the parameters
-        might lead to a long or infinite search loop, the number of attempts
-        for each word generation is limited, meaning that there is no guarantee
-        that the returned list will be of length `k`, but only that it will be
-        at most of length `k`.
+        This function generates a set of `k` random sequences from the
+        internal model. For each context and number of states still to be
+        generated, the probability of completing the sequence is computed in
+        advance (in log space, so that it does not underflow for long
+        sequences), and only the states from which the sequence can be
+        completed are drawn, with their weights multiplied by that probability; the
+        sequences follow the same distribution of those obtained by starting
+        again whenever a dead end is found, but no generation is wasted.
+        Sequence lengths for which no sequence can be generated are never
+        drawn.
 
         Parameters
         ----------
         k: int
-            The desired and maximum number of random sequences to be returned.
-            While the algorithm should be robust enough for most cases, there
-            is no guarantee that the desired number or even that a single
-            random sequence will be returned. In case of missing sequences, try
-            increasing the parameter `attempts`.
+            The number of random sequences to be returned. Exactly `k`
+            sequences are returned, unless no sequence can be generated for
+            any of the lengths, in which case an empty list is returned.
 
         seq_len: int or list
             An optional integer with length of the sequences to be generated or
@@ -608,19 +2467,45 @@ class NgramModel:
             Whether the algorithm should only collect the longest possible
             ngrams when computing the search space from which each new random
             character is obtained. This usually translates into less variation
-            in the generated sequences and a longer searching time, which might
-            need to be increased via the `attempts` parameters. Defaults to
-            False.
+            in the generated sequences. Defaults to False.
 
-        tries: int
-            The number of times the algorithm will try to generate a random
-            sequence. If the algorithm is unable to generate a suitable random
-            sequence after the specified number of `attempts`, the loop will
-            advance to the following sequence (if any). Defaults to 10.
+        attempts: int
+            The maximum number of sequences drawn for each requested one when
+            `unique` is True, after which fewer than `k` sequences might be
+            returned. Otherwise ignored, as the generation of a sequence
+            cannot fail. Defaults to 10.
 
         seed: obj
             Any hasheable object, used to feed the random number generator and
-            thus reproduce the generated set of random sequences.
+            thus reproduce the generated set of random sequences. The
+            sequences are generated in chunks, each with an independent random
+            number generator seeded from `seed`, so that the same sequences
+            are returned no matter the number of processes. The global random
+            number generator is not affected.
+
+        n_jobs: int
+            The number of processes for generating the sequences in parallel.
+            None or values lower than one use all available CPUs. Defaults
+            to 1.
+
+        unique: bool
+            Whether to return only distinct sequences, as in
+            `.unique_random_seqs()`. Defaults to False.
+
+        exclude: iterable
+            An optional collection of sequences (such as the training ones)
+            which must not be returned when `unique` is True.
+
+        progress: function
+            An optional function called after each chunk of sequences is
+            generated, with a dictionary of the "stage" ("random_seqs"), the
+            number of sequences "done" and their "total" (`k`), and the
+            "elapsed" and estimated remaining ("eta") seconds.
+
+        cancel: CancelToken
+            An optional token checked between chunks of sequences. If it is
+            cancelled, `OperationCancelled` is raised and no sequence is
+            returned; the model is not changed by generation.
 
         Returns
         -------
@@ -628,52 +2513,634 @@ class NgramModel:
             A list of size `k` with random sequences.
         """
 
-        # Set the random seed.
-        random.seed(seed)
+        if unique:
+            return self.unique_random_seqs(
+                k,
+                seq_len,
+                scale,
+                only_longest,
+                attempts,
+                seed,
+                n_jobs,
+                exclude,
+                progress,
+                cancel,
+            )[0]
+
+        if self._stats is not None:
+            start = time.perf_counter()
+
+        # The chunks are consumed one at a time, so that a cancelled call
+        # stops (and shuts down the worker processes) at a chunk boundary.
+        tracker = _Tracker("random_seqs", k, progress, cancel)
+        tracker.check()
+        rnd_seqs = []
+        chunks = self._rnd_seq_chunks(
+            chunk_tasks(k, seed), seq_len, scale, only_longest, n_jobs
+        )
+        try:
+            for chunk in chunks:
+                rnd_seqs += chunk
+                tracker.update(len(chunk))
+                tracker.check()
+
+            if self._stats is not None:
+                self._record_generation(start, scale, {"sequences": len(rnd_seqs)})
+        finally:
+            chunks.close()
+            self._search_space(scale).clear()
+
+        return rnd_seqs
+
+    def unique_random_seqs(
+        self,
+        k=1,
+        seq_len=None,
+        scale=2,
+        only_longest=False,
+        attempts=10,
+        seed=None,
+        n_jobs=1,
+        exclude=None,
+        progress=None,
+        cancel=None,
+    ):
+        """
+        Return a set of distinct random sequences and the saturation of their
+        distribution.
+
+        Sequences are drawn as in `.random_seqs()`, in chunks, and collected
+        in a hash set, skipping duplicates and excluded sequences, until `k`
+        distinct sequences are found or `attempts * k` sequences are drawn.
+        The saturation is the Good-Turing estimate of the coverage of the
+        drawn sample (i.e., one minus the proportion of draws found a single
+        time), which estimates the probability that a new draw is a sequence
+        already found; values close to one indicate that few new sequences
+        can be expected from further generation.
+
+        Parameters
+        ----------
+        k: int
+            The number of distinct random sequences to be returned.
+
+        seq_len: int or list
+            The length or lengths of the sequences, as in `.random_seqs()`.
+
+        scale: numeric
+            The exponent used for weighting ngram probabilities according to
+            their length, as in `.random_seqs()`. Defaults to 2.
+
+        only_longest: bool
+            Whether only the longest possible ngrams should be used, as in
+            `.random_seqs()`. Defaults to False.
+
+        attempts: int
+            The maximum number of sequences drawn for each requested one,
+            after which fewer than `k` sequences might be returned. Defaults
+            to 10.
+
+        seed: obj
+            Any hasheable object, used to feed the random number generator,
+            as in `.random_seqs()`.
+
+        n_jobs: int
+            The number of processes for generating the sequences in parallel,
+            as in `.random_seqs()`. Defaults to 1.
+
+        exclude: iterable
+            An optional collection of sequences (such as the training ones)
+            which must not be returned.
+
+        progress: function
+            An optional function reporting the progress, as in
+            `.random_seqs()`, with the number of distinct sequences found as
+            "done".
+
+        cancel: CancelToken
+            An optional token checked between chunks of sequences, as in
+            `.random_seqs()`.
+
+        Returns
+        -------
+        seqs: list
+            A list of at most `k` distinct random sequences, in the order in
+            which they were first drawn.
+
+        saturation: float
+            The estimated coverage of the distribution of random sequences.
+        """
+
+        if self._stats is not None:
+            start = time.perf_counter()
+
+        excluded = {_seq_as_tuple(sequence) for sequence in exclude or []}
+        tracker = _Tracker("unique_random_seqs", k, progress, cancel)
+        tracker.check()
+
+        # The chunks are consumed lazily, so that generation stops as soon as
+        # enough sequences are found (or the call is cancelled).
+        seen = Counter()
+        rnd_seqs = []
+        chunks = self._rnd_seq_chunks(
+            chunk_tasks(k * attempts, seed), seq_len, scale, only_longest, n_jobs
+        )
+        try:
+            for chunk in chunks:
+                for rnd_seq in chunk:
+                    seen[rnd_seq] += 1
+                    if seen[rnd_seq] == 1 and rnd_seq not in excluded:
+                        rnd_seqs.append(rnd_seq)
+                        if len(rnd_seqs) == k:
+                            break
+                tracker.update(len(rnd_seqs) - tracker.done)
+                if len(rnd_seqs) == k:
+                    break
+                tracker.check()
+
+            n_draws = sum(seen.values())
+            if self._stats is not None:
+                self._record_generation(
+                    start, scale, {"sequences": len(rnd_seqs), "draws": n_draws}
+                )
+        finally:
+            chunks.close()
+            self._search_space(scale).clear()
+
+        if not n_draws:
+            return rnd_seqs, 0.0
+
+        singletons = sum([1 for count in seen.values() if count == 1])
+        return rnd_seqs, 1.0 - singletons / n_draws
+
+    def _search_space(self, scale):
+        """
+        Internal method returning the search space for random generation.
+
+        Search spaces are cached for each scale until the model is trained
+        again, so that repeated calls do not rebuild them; the values they
+        compute during a call are cleared when it is done (see
+        `_SearchSpace.clear()`).
+        """
+
+        if self._keep is not None:
+            self._check_capability("generate")
+
+        if scale not in self._spaces:
+            self._spaces[scale] = _SearchSpace(
+                self._get_ngram_space(), self._padsymbol, max(self._post) > 0, scale
+            )
+
+        return self._spaces[scale]
+
+    def _get_ngram_space(self):
+        """
+        Internal method returning the ngram space for random generation.
+
+        The ngram space maps each full ngram (with the element symbol replaced
+        by the state) to its count. It is only built when first needed, as
+        models used only for scoring do not need it, and is empty if the
+        model was not trained.
+        """
+
+        if self._ngram_space is None:
+            self._ngram_space = Counter()
+            if self._trained:
+                for context, counter in self._ngrams.items():
+                    for key, value in counter.items():
+                        key = tuple(s if s != _ELM_SYMBOL else key for s in context)
+                        self._ngram_space[key] += value
+
+        return self._ngram_space
+
+    def _rnd_seq_chunks(self, tasks, seq_len, scale, only_longest, n_jobs):
+        """
+        Internal method for generating chunks of random sequences.
+
+        Parameters are the same of `.random_seqs()`, with `tasks` as returned
+        by `chunk_tasks()`; the method returns an iterator over lists of
+        random sequences, without padding.
+        """
 
         # Build the list of sequence lengths, if any.
         if isinstance(seq_len, int):
             seq_len = [seq_len]
 
         # Setup the cutoff length according to whether we should only use the
-        # longest possible ngrams or not. The filtering is done inside the
-        # main loop by selecting only ngrams which are equal in length or
-        # larger than the specified `cutoff_length`. The unitary element
-        # accounts for having at least the element being generated.
+        # longest possible ngrams or not. The filtering is done when
+        # collecting the candidates by selecting only ngrams which are equal
+        # in length or larger than the specified `cutoff_length`. The unitary
+        # element accounts for having at least the element being generated.
         if only_longest:
             cutoff_length = max(self._pre) + 1 + max(self._post)
         else:
             cutoff_length = 1
 
-        # Initialize the list for holding the random sequences and cache
-        # some values used repeatedly.
-        rnd_seqs = []
-        for _ in range(k * attempts):
-            # Get a sequence length, if any -- if not sequence length is
-            # specified, this will be randomly selected by the
-            # `._gen_single_rnd_seq()` method. We already append here
-            # the maximum value for the left context (self._pre) and
-            # an element for the right context if it exists.
-            if seq_len:
-                rnd_seq_len = max(self._pre) + random.choice(seq_len)
-                if max(self._post) > 0:
-                    rnd_seq_len += 1
-            else:
-                rnd_seq_len = None
-
-            # Try to generate a random sequence and append it if successful.
-            _rnd_seq = self._gen_single_rnd_seq(rnd_seq_len, cutoff_length, scale)
-            if _rnd_seq:
-                rnd_seqs.append(_rnd_seq)
-
-            # Break the loop if we already got what we wanted.
-            if len(rnd_seqs) == k:
-                break
+        # The generated sequences start with the padding symbol times the
+        # maximum preceding order, and end with a padding symbol if following
+        # contexts were collected; these are added to the sequence lengths.
+        use_post = max(self._post) > 0
+        start = (self._padsymbol,) * max(self._pre)
+        extra_len = max(self._pre) + int(use_post)
+
+        # Generate the chunks of sequences with the search space, shared by
+        # all of them.
+        shared = (
+            self._search_space(scale),
+            start,
+            seq_len,
+            self._seqlens,
+            extra_len,
+            cutoff_length,
+        )
 
         # Return the randomly generated sequences, if any, without the
         # padding symbols; we don't need to query each element in each sequence
         # for identity and can just cut with the right indexes.
-        return [rnd_seq[max(self._pre) : -1] for rnd_seq in rnd_seqs]
+        for rnd_seqs in imap(_gen_chunk, tasks, n_jobs, shared):
+            yield [
+                rnd_seq[max(self._pre) : len(rnd_seq) - int(use_post)]
+                for rnd_seq in rnd_seqs
+            ]
+
+    def batch_random_seqs(
+        self,
+        k=1,
+        seq_len=None,
+        scale=2,
+        only_longest=False,
+        attempts=10,
+        seed=None,
+        batch_size=10000,
+    ):
+        """
+        Return a set of random sequences generated in batches.
+
+        This method returns sequences following the same distribution of
+        those returned by `.random_seqs()`, with the same parameters, but
+        generates many sequences in lockstep: at each position, the
+        distributions of candidates of all sequences in a batch are looked
+        up in a precomputed table and all the next states are drawn with a
+        single vectorized sampling step. It requires the `numpy` library and
+        is the fastest option for generating large numbers of sequences.
+
+        Parameters
+        ----------
+        k: int
+            The number of random sequences to be returned, as in
+            `.random_seqs()`.
+
+        seq_len: int or list
+            An optional integer with length of the sequences to be generated
+            or a list of lengths to be uniformly drawn, as in
+            `.random_seqs()`.
+
+        scale: numeric
+            The exponent used for weighting ngram probabilities according to
+            their length, as in `.random_seqs()`. Defaults to 2.
+
+        only_longest: bool
+            Whether only the longest possible ngrams should be used, as in
+            `.random_seqs()`. Defaults to False.
+
+        attempts: int
+            Kept for backwards compatibility and ignored, as in
+            `.random_seqs()`.
+
+        seed: obj
+            Any hasheable object, used to feed the random number generator
+            and thus reproduce the generated set of random sequences. Please
+            note that the sequences are not the same of those returned by
+            `.random_seqs()` for the same seed.
+
+        batch_size: int
+            The maximum number of sequences generated in lockstep. Defaults
+            to 10000.
+
+        Returns
+        -------
+        seqs: list
+            A list of size `k` with random sequences.
+        """
+
+        np = _import_numpy()
+        if not np:
+            raise ImportError("The package `numpy` is needed by batched generation.")
+
+        if self._stats is not None:
+            start = time.perf_counter()
+
+        if isinstance(seq_len, int):
+            seq_len = [seq_len]
+
+        if only_longest:
+            cutoff_length = max(self._pre) + 1 + max(self._post)
+        else:
+            cutoff_length = 1
+
+        # Setup the padding and the search space as in `.random_seqs()`.
+        use_post = max(self._post) > 0
+        padding = (self._padsymbol,) * max(self._pre)
+        extra_len = max(self._pre) + int(use_post)
+        space = self._search_space(scale)
+
+        # `numpy` only accepts integers as seeds, so we derive one from any
+        # hasheable object.
+        rng = np.random.default_rng(chunk_tasks(1, seed)[0][0])
+
+        try:
+            rnd_seqs = gen_batch_seqs(
+                np,
+                space,
+                k,
+                seq_len,
+                self._seqlens,
+                padding,
+                extra_len,
+                (cutoff_length, batch_size, rng),
+            )
+
+            if self._stats is not None:
+                self._record_generation(start, scale, {"sequences": len(rnd_seqs)})
+        finally:
+            space.clear()
+
+        return [
+            rnd_seq[max(self._pre) : len(rnd_seq) - int(use_post)]
+            for rnd_seq in rnd_seqs
+        ]
+
+    def best_seqs(self, k=1, seq_len=None, beam_width=100, use_length=True):
+        """
+        Return the most probable sequences according to the model.
+
+        Sequences are scored as in `.score()` and built from the states
+        observed in training. The search extends partial sequences a state at
+        a time, keeping for each combination of the last states (those which
+        are part of the contexts of the following positions) only the `k`
+        best partial sequences; when `beam_width` is None, this is an exact
+        k-best Viterbi search, whose cost grows with the number of states to
+        the power of the sum of the maximum orders and is thus only
+        practical for models with short contexts (such as models with only
+        preceding contexts). Otherwise, only the `beam_width` best partial
+        sequences are kept after each state (a beam search), which is much
+        faster but offers no guarantee that the best sequences are found.
+
+        Parameters
+        ----------
+        k: int
+            The number of sequences to be returned. Defaults to 1.
+
+        seq_len: int or list
+            An optional integer with length of the sequences to be searched
+            or a list of lengths. If the parameter is not specified, the
+            lengths observed in training are used.
+
+        beam_width: int
+            The number of partial sequences kept by the beam search, or None
+            for an exact search. Values lower than `k` are taken as `k`.
+            Defaults to 100.
+
+        use_length: bool
+            Whether to correct the sequence relative likelihood by using
+            length probability, as in `.score()`. Defaults to True.
+
+        Returns
+        -------
+        seqs: list
+            A list of at most `k` tuples of a sequence (as a tuple of states)
+            and its score, sorted by decreasing score.
+        """
+
+        # Assert the model was trained.
+        self._check_capability("score")
+
+        if not self._padsymbol:
+            raise ValueError("Sequence search requires a padding symbol.")
+
+        if seq_len is None:
+            seq_len = sorted(self._seqlens)
+        elif isinstance(seq_len, int):
+            seq_len = [seq_len]
+
+        max_pre, max_post = max(self._pre), max(self._post)
+        orders = list(product(self._pre, self._post))
+        vocab = sorted(
+            [
+                state
+                for state in self._p.get((_ELM_SYMBOL,), {})
+                if state != self._padsymbol
+            ],
+            key=repr,
+        )
+        window_score = partial(_window_logprob, self._p, self._p0, orders, max_pre)
+
+        results = []
+        for length in seq_len:
+            length_prob = 0.0
+            if use_length:
+                length_prob = self._l.get(length, self._l0)
+
+            results += [
+                (seq, score + length_prob)
+                for score, seq in kbest_seqs(
+                    window_score,
+                    vocab,
+                    length,
+                    k,
+                    beam_width,
+                    max_pre,
+                    max_post,
+                    self._padsymbol,
+                )
+            ]
+
+        return sorted(results, key=lambda result: result[1], reverse=True)[:k]
+
+
+def _rank_chunk(shared, task):
+    """
+    Internal function for ranking a chunk of candidates.
+
+    The function can be used in worker processes, with the model and the
+    ranking parameters in `shared`, and the chunk, the index of its first
+    candidate, and the current threshold (if any) in `task`. It returns the
+    entries of the `k` best candidates of the chunk, as in `NgramModel.rank()`.
+    """
+
+    model, k, use_length, can_exit = shared
+    chunk, start, threshold = task
+
+    heap = []
+    for idx, candidate in enumerate(chunk, start):
+        passed, _prob = model._score_above(candidate, threshold, use_length, can_exit)
+        if not passed:
+            continue
+
+        entry = (_prob, -idx, candidate)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+        elif entry > heap[0]:
+            heapq.heapreplace(heap, entry)
+
+        # Raise the threshold as soon as the chunk fills the heap.
+        if len(heap) == k:
+            threshold = heap[0][0] if threshold is None else max(threshold, heap[0][0])
+
+    return heap
+
+
+# Attributes of models which are pickled as flat arrays or not pickled.
+_PICKLED_TABLES = {"_ngrams", "_p", "_p0", "_ngram_space", "_cache", "_spaces"}
+
+
+def _int_array(values, max_value):
+    """
+    Internal function returning an array of non-negative integers, with the
+    smallest type able to hold `max_value`.
+    """
+
+    for typecode in "BHI":
+        if max_value < 2 ** (8 * array(typecode).itemsize):
+            return array(typecode, values)
+
+    return array("q", values)
+
+
+def _dump_tuples(tuples, symbol_ids, protocol):
+    """
+    Internal function returning the pickle state of a list of tuples of
+    symbols (such as contexts), as arrays of their lengths and of the
+    identifiers of their symbols.
+    """
+
+    lengths = [len(entry) for entry in tuples]
+    flat = list(map(symbol_ids.__getitem__, chain.from_iterable(tuples)))
+
+    return (
+        dump_array(_int_array(lengths, max(lengths, default=0)), protocol),
+        dump_array(_int_array(flat, len(symbol_ids)), protocol),
+    )
+
+
+def _load_tuples(state, symbols):
+    """
+    Internal function returning the list of tuples pickled by
+    `_dump_tuples()`.
+    """
+
+    lengths, flat = [load_array(arr) for arr in state]
+    flat = map(symbols.__getitem__, flat)
+
+    return [tuple(islice(flat, length)) for length in lengths]
+
+
+def _dump_mapping(table, symbol_ids, protocol, structure=True):
+    """
+    Internal function returning the pickle state of a table of contexts to
+    dictionaries of states (such as counts or log-probabilities), along with
+    its keys.
+
+    Dictionaries are stored with their contexts (see `_dump_tuples()`) and
+    tries with their structure as flat arrays, keyed by node; the structure
+    is left out if `structure` is False, for tries sharing the nodes of
+    another one (whose structure is stored in its place). In both cases,
+    the dictionaries of states are stored as arrays of their lengths, of the
+    identifiers of their states, and of their values, as integers if
+    possible and as doubles otherwise.
+    """
+
+    if isinstance(table, ContextTrie):
+        trie_symbols, edge_keys, children, keys, dists = table._dump()
+        index = (
+            "trie",
+            trie_symbols if structure else None,
+            dump_array(array("q", edge_keys), protocol) if structure else None,
+            dump_array(_int_array(children, len(children)), protocol)
+            if structure
+            else None,
+            dump_array(_int_array(keys, len(children)), protocol),
+        )
+    else:
+        keys, dists = list(table), list(table.values())
+        index = ("dict", _dump_tuples(keys, symbol_ids, protocol))
+
+    lengths = [len(dist) for dist in dists]
+    states = list(map(symbol_ids.__getitem__, chain.from_iterable(dists)))
+    values = list(chain.from_iterable([dist.values() for dist in dists]))
+    try:
+        if min(values, default=0) >= 0:
+            values = _int_array(values, max(values, default=0))
+        else:
+            values = array("q", values)
+    except TypeError:
+        values = array("d", values)
+
+    rows = (
+        dump_array(_int_array(lengths, max(lengths, default=0)), protocol),
+        dump_array(_int_array(states, len(symbol_ids)), protocol),
+        dump_array(values, protocol),
+    )
+
+    return (index, rows), keys
+
+
+def _load_mapping(state, symbols, table, factory):
+    """
+    Internal function filling a table with the contexts and dictionaries
+    pickled by `_dump_mapping()`, building the dictionaries with `factory`,
+    and returning its keys (contexts or trie nodes).
+    """
+
+    index, (lengths, states, values) = state
+    items = zip(map(symbols.__getitem__, load_array(states)), load_array(values))
+    dists = [factory(islice(items, length)) for length in load_array(lengths)]
+
+    if index[0] == "trie":
+        _, trie_symbols, edge_keys, children, keys = index
+        if trie_symbols is not None:
+            table._load(trie_symbols, load_array(edge_keys), load_array(children))
+        keys = load_array(keys).tolist()
+        table._load_values(keys, dists)
+    else:
+        keys = _load_tuples(index[1], symbols)
+        table.update(zip(keys, dists))
+
+    return keys
+
+
+def _open_counts(filename, mode):
+    """
+    Internal function for opening a file of counts, compressed or not.
+    """
+
+    if filename.endswith(".gz"):
+        return gzip.open(filename, mode + "t", encoding="utf-8")
+
+    return open(filename, mode, encoding="utf-8")
+
+
+def _write_counts_header(handler, pre_order, post_order, pad_symbol, seqlens):
+    """
+    Internal function for writing the header of a file of counts.
+    """
+
+    header = {
+        "format": "lpngram-counts",
+        "version": 1,
+        "pre_order": list(pre_order),
+        "post_order": list(post_order),
+        "pad_symbol": pad_symbol,
+        "seqlens": sorted(seqlens.items()),
+    }
+    handler.write(json.dumps(header) + "\n")
+
+
+def _write_counts_line(handler, context, counts):
+    """
+    Internal function for writing the counts of a context to a file.
+    """
+
+    handler.write(json.dumps([list(context), [list(item) for item in counts]]) + "\n")
 
 
 # This method with zip, besides returning an iterator as desired, is faster
@@ -0,0 +1,107 @@
+"""
+Module providing internal methods for parallel computation.
+
+The methods distribute work to a pool of processes, sending data shared by
+all tasks (such as a trained model) a single time to each worker.
+"""
+
+# Import Python standard libraries
+from collections import deque
+import os
+
+# Data shared by all the tasks of a worker process, set by `_init_worker()`.
+_SHARED = None
+
+
+def _init_worker(shared):
+    """
+    Internal function for initializing a worker process.
+    """
+
+    global _SHARED
+    _SHARED = shared
+
+
+def _run_task(func, item):
+    """
+    Internal function for running a task in a worker process.
+    """
+
+    return func(_SHARED, item)
+
+
+def get_n_jobs(n_jobs):
+    """
+    Returns the number of processes to be used.
+
+    Parameters
+    ----------
+    n_jobs: int
+        The number of processes requested. None or values lower than one
+        are taken as a request for as many processes as available CPUs.
+
+    Returns
+    -------
+    n_jobs: int
+        The number of processes to be used.
+    """
+
+    if n_jobs is None or n_jobs < 1:
+        return os.cpu_count() or 1
+
+    return n_jobs
+
+
+def imap(func, items, n_jobs=1, shared=None):
+    """
+    Build an iterator over the results of a function applied to items.
+
+    The function is called as `func(shared, item)` and the results are
+    returned in the same order of the items. When using more than one
+    process, `func` must be a module-level function and both `shared` and the
+    items must be picklable; `shared` is sent a single time to each worker.
+    Items are consumed lazily, with a bounded number of tasks in flight, so
+    that long iterables are never fully materialized.
+
+    Parameters
+    ----------
+    func: function
+        The function to be applied.
+
+    items: iterable
+        The items to which the function will be applied.
+
+    n_jobs: int
+        The number of processes to be used. If equal to 1, all computation
+        is performed in the current process. Defaults to 1.
+
+    shared: object
+        The data shared by all tasks, passed as first argument to `func`.
+
+    Returns
+    -------
+    out: iterable
+        An iterable over the results of the function.
+    """
+
+    n_jobs = get_n_jobs(n_jobs)
+    if n_jobs == 1:
+        for item in items:
+            yield func(shared, item)
+        return
+
+    # The executor is imported here, as loading `multiprocessing` slows down
+    # the import of the package and is not needed for serial computation.
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(
+        max_workers=n_jobs, initializer=_init_worker, initargs=(shared,)
+    ) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(_run_task, func, item))
+            if len(pending) >= 2 * n_jobs:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
@@ -0,0 +1,163 @@
+"""
+Module providing progress reporting and cooperative cancellation.
+
+Long operations of ngram models (counting, training, and generation) process
+their items in chunks; between chunks, they report their progress to an
+optional callback and check an optional `CancelToken`. When the token is
+cancelled, the operation stops at the next chunk boundary, leaving the model
+in a consistent state, and raises `OperationCancelled`.
+"""
+
+# Import Python standard libraries
+from itertools import islice
+import time
+
+# Number of items processed between two progress reports and cancellation
+# checks.
+CHUNK_SIZE = 1000
+
+
+class CancelToken:
+    """
+    Token for requesting the cancellation of long operations.
+
+    The token can be cancelled explicitly, for example from another thread,
+    or automatically once a time budget is exhausted.
+    """
+
+    def __init__(self, timeout=None):
+        """
+        Initialize a CancelToken object.
+
+        Parameters
+        ----------
+        timeout: float
+            An optional number of seconds, counted from the creation of the
+            token, after which it is cancelled.
+        """
+
+        self._cancelled = False
+        if timeout is None:
+            self._deadline = None
+        else:
+            self._deadline = time.monotonic() + timeout
+
+    def cancel(self):
+        """
+        Requests the cancellation of the operations checking the token.
+        """
+
+        self._cancelled = True
+
+    @property
+    def cancelled(self):
+        """
+        Whether cancellation was requested or the time budget is exhausted.
+        """
+
+        if (
+            not self._cancelled
+            and self._deadline is not None
+            and time.monotonic() >= self._deadline
+        ):
+            self._cancelled = True
+
+        return self._cancelled
+
+
+class OperationCancelled(Exception):
+    """
+    Exception raised when an operation is stopped by a `CancelToken`.
+
+    The exception carries the name of the operation (`stage`), the number of
+    items processed before it stopped (`done`), and the total number of
+    items, if known (`total`).
+    """
+
+    def __init__(self, stage, done, total=None):
+        super().__init__(
+            "Operation '%s' was cancelled after %i of %s items."
+            % (stage, done, "?" if total is None else total)
+        )
+        self.stage = stage
+        self.done = done
+        self.total = total
+
+
+class _Tracker:
+    """
+    Internal class tracking the progress of an operation.
+
+    The progress callback is called with a dictionary holding the name of
+    the operation ("stage"), the number of items processed ("done"), the
+    total number of items ("total", None if unknown), the seconds since the
+    start of the operation ("elapsed"), and the estimated number of seconds
+    to its end ("eta", None if the total is unknown).
+    """
+
+    def __init__(self, stage, total=None, callback=None, token=None, done=0):
+        # Items already done when the tracker is created (e.g., by a resumed
+        # operation) are not used for estimating the remaining time.
+        self.stage = stage
+        self.total = total
+        self.done = done
+        self._initial = done
+        self._callback = callback
+        self._token = token
+        self._start = time.perf_counter()
+
+    def check(self):
+        """
+        Raises `OperationCancelled` if the token was cancelled, unless all
+        the items were already processed.
+        """
+
+        if self._token is None:
+            return
+        if self.total is not None and self.done >= self.total:
+            return
+        if self._token.cancelled:
+            raise OperationCancelled(self.stage, self.done, self.total)
+
+    def update(self, n_items):
+        """
+        Adds processed items, reporting the progress to the callback.
+        """
+
+        self.done += n_items
+        if self._callback is None:
+            return
+
+        elapsed = time.perf_counter() - self._start
+        eta = None
+        if self.total is not None:
+            if self.done >= self.total:
+                eta = 0.0
+            elif self.done > self._initial:
+                eta = elapsed * (self.total - self.done) / (self.done - self._initial)
+
+        self._callback(
+            {
+                "stage": self.stage,
+                "done": self.done,
+                "total": self.total,
+                "elapsed": elapsed,
+                "eta": eta,
+            }
+        )
+
+    def chunks(self, items, size=CHUNK_SIZE):
+        """
+        Iterates over lists of at most `size` items, checking the token
+        before each list is returned and reporting the progress after it is
+        processed.
+        """
+
+        items = iter(items)
+        while True:
+            chunk = list(islice(items, size))
+            if not chunk:
+                return
+            self.check()
+            yield chunk
+            self.update(len(chunk))
@@ -0,0 +1,110 @@
+"""
+Module providing internal methods for searching the most probable sequences.
+
+The score of a sequence in an `NgramModel` is a sum of terms, one for each
+position, which only depend on the states in a window around the position
+(the preceding context, the state itself, and the following context). The
+search here implemented extends partial sequences a state at a time, adding
+the term of each position as soon as its window is complete; partial
+sequences ending with the same states share all their future terms, so that
+only the `k` best of them need to be kept (as in the Viterbi algorithm), and
+the search can be additionally restricted to a beam of the best partial
+sequences.
+"""
+
+# Import Python standard libraries
+import heapq
+from operator import itemgetter
+
+
+def kbest_seqs(window_score, vocab, seq_len, k, beam_width, max_pre, max_post, pad):
+    """
+    Returns the `k` highest scoring sequences of a given length.
+
+    Parameters
+    ----------
+    window_score: function
+        A function returning the log-probability term of a position from the
+        tuple of states in its window, of length `max_pre + 1 + max_post`
+        with the state in position `max_pre`.
+
+    vocab: list
+        The states that can be used in the sequences.
+
+    seq_len: int
+        The length of the sequences.
+
+    k: int
+        The number of sequences to be returned.
+
+    beam_width: int
+        The maximum number of partial sequences kept after each state. If
+        None, no pruning is performed and the search is exact.
+
+    max_pre: int
+        The maximum preceding order of the model.
+
+    max_post: int
+        The maximum following order of the model.
+
+    pad: object
+        The padding symbol of the model.
+
+    Returns
+    -------
+    seqs: list
+        A list of at most `k` tuples of a score and a sequence, sorted by
+        decreasing score.
+    """
+
+    # Terms are cached by window, as the same windows are reached by many
+    # partial sequences.
+    terms = {}
+
+    # Partial sequences are grouped by their last `max_pre + max_post` states
+    # (including padding), which are all that is needed for computing the
+    # terms of the following positions; each group is a list of tuples of
+    # the partial score and the sequence.
+    hyps = {(pad,) * (max_pre + max_post): [(0.0, ())]}
+    for idx in range(seq_len + max_post):
+        # After the last state, the windows are completed with padding.
+        states = vocab if idx < seq_len else (pad,)
+
+        # The window ending at the new state is centered in the state
+        # `max_post` positions before it, whose term can now be computed.
+        has_term = idx >= max_post
+
+        expanded = {}
+        for key, entries in hyps.items():
+            for state in states:
+                window = key + (state,)
+                term = 0.0
+                if has_term:
+                    term = terms.get(window)
+                    if term is None:
+                        term = terms[window] = window_score(window)
+
+                tail = (state,) if idx < seq_len else ()
+                expanded.setdefault(window[1:], []).extend(
+                    [(score + term, seq + tail) for score, seq in entries]
+                )
+
+        hyps = {
+            key: heapq.nlargest(k, entries, key=itemgetter(0))
+            for key, entries in expanded.items()
+        }
+
+        # Keep only the best partial sequences in the beam, if requested.
+        if beam_width is not None:
+            best = heapq.nlargest(
+                max(beam_width, k),
+                [(entry, key) for key, entries in hyps.items() for entry in entries],
+                key=lambda item: item[0][0],
+            )
+            hyps = {}
+            for entry, key in best:
+                hyps.setdefault(key, []).append(entry)
+
+    return heapq.nlargest(
+        k, [entry for entries in hyps.values() for entry in entries], key=itemgetter(0)
+    )
@@ -9,23 +9,70 @@ Bird at al. as close as possible.
 # Import Python standard libraries
 import math
 import random
+from collections import Counter
 from functools import partial
+from itertools import chain
 
-# Try to load the scientific libraries needed for Simple Good-Turing smoothing.
-try:
-    import numpy as np
-except ImportError:
-    np = False
-
-try:
-    from scipy import linalg, stats
-except ImportError:
-    linalg, stats = False, False
 
 # Default probability for unobserved samples.
 _UNOBS = 1e-10
 
 
+def _import_numpy():
+    """
+    Internal function for loading `numpy` on demand.
+
+    The scientific libraries are not imported with the module, as importing
+    them is expensive and most methods don't need them; after the first
+    call, the import statement just queries the modules already loaded by
+    Python. Returns the module, or None if it is not installed.
+
+    Not intended to be called directly by users.
+    """
+
+    try:
+        import numpy
+    except ImportError:
+        return None
+
+    return numpy
+
+
+def _import_scipy():
+    """
+    Internal function for loading the `scipy` modules on demand.
+
+    Returns the `linalg` and `stats` modules, or a pair of None if the
+    library is not installed.
+
+    Not intended to be called directly by users.
+    """
+
+    try:
+        from scipy import linalg, stats
+    except ImportError:
+        return None, None
+
+    return linalg, stats
+
+
+def _import_sparse():
+    """
+    Internal function for loading the `scipy.sparse` module on demand.
+
+    Returns the module, or None if the library is not installed.
+
+    Not intended to be called directly by users.
+    """
+
+    try:
+        from scipy import sparse
+    except ImportError:
+        return None
+
+    return sparse
+
+
 def _check_probdist_args(freqdist, **kwargs):
     """
     Internal function for validing arguments for smoothing functions.
@@ -67,6 +114,128 @@ def _check_probdist_args(freqdist, **kwargs):
             raise ValueError("p-value must be in range (0.0, 1.0).")
 
 
+def _count_summary(freqdist, freqs_of_freqs=False):
+    """
+    Internal function returning the statistics of a frequency distribution.
+
+    The statistics are those shared by different smoothing methods, so that
+    they can be computed a single time when the same distribution is smoothed
+    with many methods or parameters (as in `sweep()`): the "total" number of
+    observations and, optionally, the "freqs_of_freqs" (the number of samples
+    observed with each positive count) used by Simple Good-Turing. The
+    returned dictionary can be passed as additional arguments to the
+    smoothing functions.
+
+    Not intended to be called directly by users.
+    """
+
+    summary = {"total": sum(freqdist.values())}
+    if freqs_of_freqs:
+        summary["freqs_of_freqs"] = dict(
+            Counter([count for count in freqdist.values() if count > 0])
+        )
+
+    return summary
+
+
+def _get_total(freqdist, kwargs):
+    """
+    Internal function returning the total number of observations of a
+    frequency distribution, unless it was already computed by
+    `_count_summary()`.
+
+    Not intended to be called directly by users.
+    """
+
+    total = kwargs.get("total", None)
+    if total is None:
+        total = sum(freqdist.values())
+
+    return total
+
+
+def _normalize_dist(probdist, prob_unk):
+    """
+    Internal function for normalizing a log-probability distribution.
+
+    The log-probabilities are normalized so that the probabilities of all
+    samples, with the probability for unobserved samples counted a single
+    time, sum to 1.0.
+
+    Not intended to be called directly by users.
+    """
+
+    # The normalization is a numerically stable log-sum-exp: the largest
+    # log-probability is subtracted before exponentiation, so that no value
+    # underflows, and the log of the sum is subtracted from each
+    # log-probability, with no need to convert them back and forth.
+    _max = max([prob_unk, *probdist.values()])
+    _lse = _max + math.log(
+        math.exp(prob_unk - _max)
+        + sum([math.exp(prob - _max) for prob in probdist.values()])
+    )
+
+    return {sample: prob - _lse for sample, prob in probdist.items()}, prob_unk - _lse
+
+
+def _normalize_dists(dists):
+    """
+    Internal function for normalizing many log-probability distributions.
+
+    The results are the same of `_normalize_dist()` for each distribution
+    (a tuple of the log-probabilities of observed samples and of the one of
+    unobserved samples), within float tolerance, but the dictionaries of
+    log-probabilities are updated in place, with no new dictionaries built.
+    If `numpy` is available, the log-sum-exp of all distributions is
+    computed with a single vectorized operation over a flat array of rows,
+    whose maxima and sums are computed with `reduceat`.
+
+    Not intended to be called directly by users.
+    """
+
+    np = _import_numpy()
+    if not np or not dists:
+        lse = []
+        for probdist, prob_unk in dists:
+            _max = max([prob_unk, *probdist.values()])
+            lse.append(
+                _max
+                + math.log(
+                    math.exp(prob_unk - _max)
+                    + sum([math.exp(prob - _max) for prob in probdist.values()])
+                )
+            )
+    else:
+        # Each row starts with the log-probability for unobserved samples, so
+        # that no row is empty.
+        lengths = np.fromiter(
+            (len(probdist) + 1 for probdist, _ in dists), dtype=np.int64, count=len(dists)
+        )
+        values = np.fromiter(
+            chain.from_iterable(
+                chain((prob_unk,), probdist.values()) for probdist, prob_unk in dists
+            ),
+            dtype=float,
+            count=int(lengths.sum()),
+        )
+        starts = np.zeros(len(dists), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+
+        row_max = np.maximum.reduceat(values, starts)
+        lse = row_max + np.log(
+            np.add.reduceat(np.exp(values - np.repeat(row_max, lengths)), starts)
+        )
+        lse = lse.tolist()
+
+    normalized = []
+    for (probdist, prob_unk), _lse in zip(dists, lse):
+        for sample in probdist:
+            probdist[sample] -= _lse
+        normalized.append((probdist, prob_unk - _lse))
+
+    return normalized
+
+
 # This kind of work-around to keeping track of which smoothing method was used
 # (needed for easier serialization) is not the most elegant or efficient
 # (particularly when considering the if/elif structure here employed), but
@@ -98,7 +267,8 @@ def smooth_dist(freqdist, method, **kwargs):
 
     kwargs: additional arguments
         Additional arguments passed to the appropriate smoothing method
-        function.
+        function, possibly including the precomputed statistics of the
+        frequency distribution returned by `_count_summary()`.
 
     Returns
     -------
@@ -113,25 +283,8 @@ def smooth_dist(freqdist, method, **kwargs):
 
     """
 
-    if method == "uniform":
-        sm_func = uniform_dist
-    elif method == "random":
-        sm_func = random_dist
-    elif method == "mle":
-        sm_func = mle_dist
-    elif method == "lidstone":
-        sm_func = lidstone_dist
-    elif method == "laplace":
-        sm_func = laplace_dist
-    elif method == "ele":
-        sm_func = ele_dist
-    elif method == "wittenbell":
-        sm_func = wittenbell_dist
-    elif method == "certaintydegree":
-        sm_func = certaintydegree_dist
-    elif method == "sgt":
-        sm_func = sgt_dist
-    else:
+    sm_func = _SMOOTHING_METHODS.get(method)
+    if sm_func is None:
         raise ValueError("Unknown probability smoothing method '%s'." % method)
 
     return sm_func(freqdist, **kwargs)
@@ -282,7 +435,7 @@ def mle_dist(freqdist, **kwargs):
 
     # Run the estimator by simply collecting the sum of values and dividing the
     # counts of each sample by such value.
-    value_sum = sum(freqdist.values())
+    value_sum = _get_total(freqdist, kwargs)
     probdist = {
         sample: math.log((count / value_sum) * (1.0 - unobs_prob))
         for sample, count in freqdist.items()
@@ -346,7 +499,7 @@ def lidstone_dist(freqdist, **kwargs):
     _check_probdist_args(freqdist, gamma=gamma, bins=bins)
 
     # Obtain the parameters for probability calculation.
-    N = sum(freqdist.values())
+    N = _get_total(freqdist, kwargs)
     if not bins:
         B = len(freqdist)
     else:
@@ -483,7 +636,7 @@ def wittenbell_dist(freqdist, **kwargs):
     # Obtain the parameters for probability calculation; we are replacing `B`
     # by `T` as a notation, here, to make it clear that it is not necessarily
     # the same `B` value computed in other probability distributions.
-    N = sum(freqdist.values())
+    N = _get_total(freqdist, kwargs)
     T = len(freqdist)
     if not bins:
         Z = 1.0
@@ -554,7 +707,7 @@ def certaintydegree_dist(freqdist, **kwargs):
     _check_probdist_args(freqdist, bins=bins)
 
     # Obtain the parameters for probability calculation.
-    N = sum(freqdist.values())
+    N = _get_total(freqdist, kwargs)
     B = len(freqdist)
     Z = bins or B
 
@@ -645,10 +798,12 @@ def sgt_dist(freqdist, **kwargs):
         distribution.
     """
 
-    # Make sure the scientific libraries have been loaded, raising an
-    # ImportError if not
+    # Load the scientific libraries, raising an ImportError if they are not
+    # available.
+    np = _import_numpy()
     if not np:
         raise ImportError("The package `numpy` is needed by SGT.")
+    linalg, stats = _import_scipy()
     if not linalg or not stats:
         raise ImportError("The package `scipy` is needed by SGT.")
 
@@ -667,13 +822,13 @@ def sgt_dist(freqdist, **kwargs):
     freqdist = {sample: count for sample, count in freqdist.items() if count > 0}
 
     # Prepare vectors for frequencies (`r` in G&S) and frequencies of
-    # frequencies (`Nr` in G&S). freqdist.values() is cast to a tuple because
-    # we can't consume the iterable a single time. `freqs_keys` is sorted to
-    # make vector computations faster later on (so we query lists and not
-    # dictionaries).
-    freqs = tuple(freqdist.values())
-    freqs_keys = sorted(set(freqs))  # r -> n (G&S)
-    freqs_of_freqs = {c: freqs.count(c) for c in freqs_keys}
+    # frequencies (`Nr` in G&S), unless the latter were already computed by
+    # `_count_summary()`. `freqs_keys` is sorted to make vector computations
+    # faster later on (so we query lists and not dictionaries).
+    freqs_of_freqs = kwargs.get("freqs_of_freqs", None)
+    if freqs_of_freqs is None:
+        freqs_of_freqs = _count_summary(freqdist, True)["freqs_of_freqs"]
+    freqs_keys = sorted(freqs_of_freqs)  # r -> n (G&S)
 
     # The papers and the implementations are not clear on how to calculate the
     # probability of unobserved states in case of missing single-count samples
@@ -687,9 +842,9 @@ def sgt_dist(freqdist, **kwargs):
     # TODO: Investigate and discuss other possible solutions, including
     #       user-defined `gamma`, `bins`, and/or `N`.
     if 1 in freqs_keys:
-        p0 = freqs_of_freqs[1] / sum(freqs)
+        p0 = freqs_of_freqs[1] / _get_total(freqdist, kwargs)
     else:
-        p0 = default_p0 or (1.0 / (sum(freqs) + 1))
+        p0 = default_p0 or (1.0 / (_get_total(freqdist, kwargs) + 1))
 
     # Compute Sampson's Z: for each count `j`, we set Z[j] to the linear
     # interpolation of {i, j, k}, where `i` is the greatest observed count less
@@ -786,3 +941,18 @@ def sgt_dist(freqdist, **kwargs):
             probdist[sample] = math.log(prob)
 
     return probdist, prob_unk
+
+
+# Smoothing functions by the names used in `smooth_dist()`, which can be
+# listed by other modules (such as the benchmark suite).
+_SMOOTHING_METHODS = {
+    "uniform": uniform_dist,
+    "random": random_dist,
+    "mle": mle_dist,
+    "lidstone": lidstone_dist,
+    "laplace": laplace_dist,
+    "ele": ele_dist,
+    "wittenbell": wittenbell_dist,
+    "certaintydegree": certaintydegree_dist,
+    "sgt": sgt_dist,
+}
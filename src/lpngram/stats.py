@@ -0,0 +1,73 @@
+"""
+Module providing the instrumentation of ngram models.
+
+The statistics are collected per stage (such as counting, training, scoring,
+and generation), recording the number of calls, the wall time, and counters
+and sizes specific to each stage. The instrumentation is opt-in: models only
+hold a statistics object when it is enabled, so that there is no overhead
+besides a single check per call when it is not.
+"""
+
+
+class ModelStats:
+    """
+    Collection of per-stage timers and counters.
+    """
+
+    def __init__(self, callback=None):
+        """
+        Initialize a ModelStats object.
+
+        Parameters
+        ----------
+        callback: function
+            An optional function called after each recorded call, with the
+            name of the stage, the wall time in seconds, and a dictionary
+            with the counters and sizes of the call.
+        """
+
+        self.callback = callback
+        self.stages = {}
+
+    def record(self, stage, seconds, counters=None, sizes=None):
+        """
+        Records a call to a stage.
+
+        Parameters
+        ----------
+        stage: str
+            The name of the stage.
+
+        seconds: float
+            The wall time of the call.
+
+        counters: dict
+            Optional values to be added to the counters of the stage (e.g.,
+            the number of sequences processed).
+
+        sizes: dict
+            Optional values replacing the previous ones of the stage (e.g.,
+            the number of contexts in the model after the call).
+        """
+
+        entry = self.stages.setdefault(stage, {"calls": 0, "seconds": 0.0})
+        entry["calls"] += 1
+        entry["seconds"] += seconds
+        for name, value in (counters or {}).items():
+            entry[name] = entry.get(name, 0) + value
+        entry.update(sizes or {})
+
+        if self.callback:
+            self.callback(stage, seconds, dict(counters or {}, **(sizes or {})))
+
+    def as_dict(self):
+        """
+        Returns a copy of the statistics, indexed by stage.
+        """
+
+        return {stage: dict(entry) for stage, entry in self.stages.items()}
+
+    def __getstate__(self):
+        # The callback is not pickled (e.g., when sending a model to worker
+        # processes), as it might not be picklable and would have no effect.
+        return {"callback": None, "stages": self.stages}
@@ -0,0 +1,452 @@
+"""
+Module providing a trie for storing ngram contexts.
+
+Ngram models collect contexts for every combination of preceding and
+following orders, such as `('$$$', '###')`, `('$$$', '$$$', '###')`, and
+`('$$$', '$$$', '###', 'a')`, which share most of their structure. The trie
+here implemented organizes the contexts around the element symbol, so that
+contexts of different orders share nodes and all the contexts of a position
+can be retrieved with a single walk.
+"""
+
+# Import Python standard libraries
+from array import array
+from collections.abc import ItemsView, MutableMapping, ValuesView
+
+# Edges are indexed by a single integer combining the parent node and the
+# symbol identifier, which is cheaper to store and hash than a tuple.
+_SHIFT = 32
+
+# Sentinel for nodes holding no value.
+_EMPTY = object()
+
+# Multiplier (the 64-bit golden ratio) and shift for hashing edge keys to the
+# slots of an edge table, which are taken from the middle bits of the product.
+_HASH_MULT = 0x9E3779B97F4A7C15
+_HASH_SHIFT = 29
+
+# Marker of the empty slots of an edge table.
+_NO_KEY = -1
+
+
+class _EdgeTable:
+    """
+    Internal class mapping the edge keys of a trie to their child nodes.
+
+    The edges are stored in an open addressing hash table, with linear
+    probing, backed by two arrays of 64-bit integers (the keys and their
+    child nodes), which is kept at most two thirds full. Compared to a
+    dictionary, which holds a key object, a child object and an entry for
+    each edge (about 100 bytes on 64-bit CPython), each edge takes between
+    24 and 48 bytes, at the cost of somewhat slower lookups. Edges are
+    never removed, as the nodes of a trie are kept when their values are
+    deleted.
+    """
+
+    def __init__(self, n_slots=8):
+        self._keys = array("q", [_NO_KEY]) * n_slots
+        self._children = array("q", [0]) * n_slots
+        self._mask = n_slots - 1
+        self._size = 0
+
+    def _slot(self, key):
+        """
+        Internal method returning the slot of a key, or the empty slot where
+        it would be inserted.
+        """
+
+        keys, mask = self._keys, self._mask
+        slot = (key * _HASH_MULT >> _HASH_SHIFT) & mask
+        while keys[slot] != key and keys[slot] != _NO_KEY:
+            slot = (slot + 1) & mask
+
+        return slot
+
+    def get(self, key, default=None):
+        # The probing of `._slot()` is repeated here, as this is the method
+        # called for each edge followed by walks and lookups.
+        keys, mask = self._keys, self._mask
+        slot = (key * _HASH_MULT >> _HASH_SHIFT) & mask
+        while True:
+            found = keys[slot]
+            if found == key:
+                return self._children[slot]
+            if found == _NO_KEY:
+                return default
+            slot = (slot + 1) & mask
+
+    def __setitem__(self, key, child):
+        slot = self._slot(key)
+        if self._keys[slot] == _NO_KEY:
+            if 3 * (self._size + 1) > 2 * len(self._keys):
+                self._grow()
+                slot = self._slot(key)
+            self._keys[slot] = key
+            self._size += 1
+        self._children[slot] = child
+
+    def _grow(self):
+        """
+        Internal method doubling the number of slots of the table.
+        """
+
+        items = list(self.items())
+        self.__init__(2 * len(self._keys))
+        self.update(items)
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for key in self._keys:
+            if key != _NO_KEY:
+                yield key
+
+    def values(self):
+        for key, child in zip(self._keys, self._children):
+            if key != _NO_KEY:
+                yield child
+
+    def items(self):
+        for key, child in zip(self._keys, self._children):
+            if key != _NO_KEY:
+                yield key, child
+
+    def update(self, items):
+        for key, child in items:
+            self[key] = child
+
+    def clear(self):
+        self.__init__()
+
+
+class ContextTrie(MutableMapping):
+    """
+    Mapping of ngram contexts to values organized as a trie.
+
+    Each context is stored as a path starting with the preceding context
+    read from the element symbol backwards, followed by the element symbol
+    and by the following context. As such, `('b', 'a', '###', 'c')` is
+    stored in the path `a -> b -> ### -> c`, sharing its nodes with
+    `('a', '###')`, `('b', 'a', '###')`, and `('a', '###', 'c')`. Edges are
+    kept in a single array-backed hash table indexed by parent node and
+    symbol, and values in a list indexed by node, so that no tuple nor
+    integer object is stored for each context.
+
+    The class implements the interface of a dictionary (including the
+    `default_factory` of a `collections.defaultdict`), and can be used in
+    place of the dictionaries of contexts of an `NgramModel`.
+    """
+
+    def __init__(self, default_factory=None, nodes=None, elm_symbol="###"):
+        """
+        Initialize a ContextTrie object.
+
+        Parameters
+        ----------
+        default_factory: function
+            An optional function for building the value of missing contexts
+            when they are accessed, as in `collections.defaultdict`.
+
+        nodes: ContextTrie
+            An optional trie whose nodes will be shared by the new one, so
+            that different values for the same contexts (such as the
+            probabilities of observed and unobserved states) can be
+            retrieved with a single walk.
+
+        elm_symbol: object
+            The symbol used as transition symbol replacement in the contexts.
+            Defaults to "###".
+        """
+
+        self.default_factory = default_factory
+        self._elm = elm_symbol
+        if nodes is None:
+            self._edges = _EdgeTable()
+            self._symbols = {}
+        else:
+            self._edges = nodes._edges
+            self._symbols = nodes._symbols
+
+        # Values are stored in a list indexed by node, which is extended on
+        # demand as nodes might be created by another trie sharing them.
+        self._values = []
+        self._size = 0
+
+    def _path(self, context):
+        """
+        Internal method returning the path of symbols for a context.
+        """
+
+        try:
+            idx = context.index(self._elm)
+        except (AttributeError, ValueError):
+            raise KeyError(context)
+
+        return context[idx - 1 :: -1][:idx] + context[idx:]
+
+    def _find(self, context):
+        """
+        Internal method returning the node of a context, or None.
+        """
+
+        node = 0
+        for symbol in self._path(context):
+            sid = self._symbols.get(symbol)
+            if sid is None:
+                return None
+            node = self._edges.get(node << _SHIFT | sid)
+            if node is None:
+                return None
+
+        return node
+
+    def _insert(self, context):
+        """
+        Internal method returning the node of a context, creating it if needed.
+        """
+
+        node = 0
+        for symbol in self._path(context):
+            sid = self._symbols.setdefault(symbol, len(self._symbols))
+            child = self._edges.get(node << _SHIFT | sid)
+            if child is None:
+                # As each new edge leads to a new node, the number of edges
+                # is a unique identifier for the next node (the root is 0).
+                child = len(self._edges) + 1
+                self._edges[node << _SHIFT | sid] = child
+            node = child
+
+        if node >= len(self._values):
+            self._values.extend([_EMPTY] * (len(self._edges) + 1 - len(self._values)))
+
+        return node
+
+    def _get_node(self, node):
+        """
+        Internal method returning the value of a node, or `_EMPTY`.
+        """
+
+        if node is None or node >= len(self._values):
+            return _EMPTY
+
+        return self._values[node]
+
+    def __getitem__(self, context):
+        value = self._get_node(self._find(context))
+        if value is not _EMPTY:
+            return value
+
+        if self.default_factory is None:
+            raise KeyError(context)
+
+        value = self.default_factory()
+        self[context] = value
+
+        return value
+
+    def __setitem__(self, context, value):
+        node = self._insert(context)
+        if self._values[node] is _EMPTY:
+            self._size += 1
+        self._values[node] = value
+
+    def __delitem__(self, context):
+        node = self._find(context)
+        if self._get_node(node) is _EMPTY:
+            raise KeyError(context)
+
+        # The nodes are kept, as they might be shared with other contexts.
+        self._values[node] = _EMPTY
+        self._size -= 1
+
+    def __contains__(self, context):
+        try:
+            node = self._find(context)
+        except KeyError:
+            return False
+
+        return self._get_node(node) is not _EMPTY
+
+    def get(self, context, default=None):
+        # Overridden so that missing contexts are not created by the
+        # `default_factory`, as in `collections.defaultdict`.
+        try:
+            value = self._get_node(self._find(context))
+        except KeyError:
+            return default
+
+        return default if value is _EMPTY else value
+
+    def __iter__(self):
+        for context, _ in self._iter_items():
+            yield context
+
+    def items(self):
+        return _TrieItemsView(self)
+
+    def values(self):
+        return _TrieValuesView(self)
+
+    def _iter_items(self):
+        """
+        Internal method iterating over the contexts and their values.
+
+        Values are read from the nodes reached by the traversal, so that
+        iterating over items or values does not look up each context again.
+        """
+
+        # Build a temporary map of children for a depth-first traversal,
+        # rebuilding the contexts from the paths.
+        symbols = {sid: symbol for symbol, sid in self._symbols.items()}
+        mask = (1 << _SHIFT) - 1
+        children = {}
+        for key, child in self._edges.items():
+            children.setdefault(key >> _SHIFT, []).append((symbols[key & mask], child))
+
+        stack = [(0, (), None)]
+        while stack:
+            node, pre, post = stack.pop()
+            if post is not None:
+                value = self._get_node(node)
+                if value is not _EMPTY:
+                    yield pre + (self._elm,) + post, value
+
+            for symbol, child in children.get(node, []):
+                if post is not None:
+                    stack.append((child, pre, post + (symbol,)))
+                elif symbol == self._elm:
+                    stack.append((child, pre, ()))
+                else:
+                    stack.append((child, (symbol,) + pre, None))
+
+    def __len__(self):
+        return self._size
+
+    def __repr__(self):
+        return "ContextTrie(%i contexts)" % self._size
+
+    def _dump(self):
+        """
+        Internal method returning the structure of the trie as flat lists.
+
+        Returns a tuple with the symbols (indexed by their identifiers), the
+        keys of the edges, the child node of each edge, the nodes holding a
+        value, and their values.
+        """
+
+        nodes = [node for node, value in enumerate(self._values) if value is not _EMPTY]
+
+        return (
+            list(self._symbols),
+            list(self._edges),
+            list(self._edges.values()),
+            nodes,
+            [self._values[node] for node in nodes],
+        )
+
+    def _load(self, symbols, keys, children):
+        """
+        Internal method restoring the structure of the trie from the flat
+        lists returned by `._dump()`, without values.
+        """
+
+        self._symbols.clear()
+        self._symbols.update((symbol, sid) for sid, symbol in enumerate(symbols))
+        self._edges.clear()
+        self._edges.update(zip(keys, children))
+
+    def _load_values(self, nodes, values):
+        """
+        Internal method setting the values of nodes, as returned by
+        `._dump()`, replacing all the previous values.
+        """
+
+        self._values = [_EMPTY] * (len(self._edges) + 1)
+        self._size = 0
+        for node, value in zip(nodes, values):
+            self._values[node] = value
+            self._size += 1
+
+    def walk(self, pre_context, post_context):
+        """
+        Build an iterator over all the stored contexts around a position.
+
+        Parameters
+        ----------
+        pre_context: tuple
+            The symbols preceding the position, starting from the nearest
+            one (i.e., in reverse order).
+
+        post_context: tuple
+            The symbols following the position, starting from the nearest
+            one.
+
+        Returns
+        -------
+        out: iterable
+            An iterable over tuples of the preceding order, the following
+            order, and the node of each stored context, whose value can be
+            retrieved with `.node_value()`.
+        """
+
+        child = self._edges.get
+        symbols = self._symbols
+        values = self._values
+        n_values = len(values)
+        elm_sid = symbols.get(self._elm)
+        if elm_sid is None:
+            return
+
+        node = 0
+        for pre_len in range(len(pre_context) + 1):
+            slot = child(node << _SHIFT | elm_sid)
+            if slot is not None:
+                if slot < n_values and values[slot] is not _EMPTY:
+                    yield pre_len, 0, slot
+
+                post_node = slot
+                for post_len, symbol in enumerate(post_context, 1):
+                    sid = symbols.get(symbol)
+                    if sid is None:
+                        break
+                    post_node = child(post_node << _SHIFT | sid)
+                    if post_node is None:
+                        break
+                    if post_node < n_values and values[post_node] is not _EMPTY:
+                        yield pre_len, post_len, post_node
+
+            if pre_len == len(pre_context):
+                break
+            sid = symbols.get(pre_context[pre_len])
+            if sid is None:
+                break
+            node = child(node << _SHIFT | sid)
+            if node is None:
+                break
+
+    def node_value(self, node):
+        """
+        Returns the value stored in a node, as returned by `.walk()`.
+        """
+
+        return self._values[node]
+
+
+class _TrieItemsView(ItemsView):
+    """
+    View of the items of a ContextTrie, iterated with a single traversal.
+    """
+
+    def __iter__(self):
+        return self._mapping._iter_items()
+
+
+class _TrieValuesView(ValuesView):
+    """
+    View of the values of a ContextTrie, iterated with a single traversal.
+    """
+
+    def __iter__(self):
+        for _, value in self._mapping._iter_items():
+            yield value
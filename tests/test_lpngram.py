@@ -12,8 +12,14 @@ Tests for the `lpngram` package.
 import unittest
 from collections import Counter
 import itertools
+import json
+import math
+import os
 import random
 import string
+import subprocess
+import sys
+import tempfile
 
 # Import the library itself
 # TODO: don't import with *
@@ -457,6 +463,975 @@ class TestLPNgram(unittest.TestCase):
         model.random_seqs(k=15, seq_len=5)
         model.random_seqs(k=15, seq_len=(3, 4, 5, 6))
 
+    def test_merge_counts(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+
+        # Reference model, trained on the full corpus.
+        ref = NgramModel(2, 1, sequences=words)
+        ref.train(method="lidstone", gamma=0.1)
+
+        # Merge two models trained on different shards.
+        model = NgramModel(2, 1, sequences=words[:2])
+        model.merge(NgramModel(2, 1, sequences=words[2:]))
+        model.train(method="lidstone", gamma=0.1)
+        assert model._ngrams == ref._ngrams
+        assert model._seqlens == ref._seqlens
+        assert model._p == ref._p
+
+        # Build from the raw counts.
+        model = NgramModel.from_counts(ref._ngrams, ref._seqlens, 2, 1)
+        model.train(method="lidstone", gamma=0.1)
+        assert model._p == ref._p
+
+        # Counts with different parameters cannot be merged.
+        self.assertRaises(ValueError, model.merge, NgramModel(1, 1))
+        self.assertRaises(ValueError, model.merge, NgramModel(2, 1, pad_symbol="#"))
+
+        # Write and read shards from disk.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            shards = [
+                os.path.join(tmpdir, "shard1.jsonl"),
+                os.path.join(tmpdir, "shard2.jsonl.gz"),
+            ]
+            NgramModel(2, 1, sequences=words[:3]).save_counts(shards[0])
+            NgramModel(2, 1, sequences=words[3:]).save_counts(shards[1])
+
+            model = NgramModel.load_counts(shards)
+            model.train(method="lidstone", gamma=0.1)
+            assert model._ngrams == ref._ngrams
+            assert model._seqlens == ref._seqlens
+            assert model.score("Italy") == ref.score("Italy")
+
+            NgramModel(1, 1, sequences=words).save_counts(shards[1])
+            self.assertRaises(ValueError, NgramModel.load_counts, shards)
+
+    def test_remove_sequences(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+
+        # Removing sequences must be the inverse of adding them.
+        ref = NgramModel(2, 1, sequences=words[:4])
+        model = NgramModel(2, 1, sequences=words)
+        model.remove_sequences(words[4:])
+        assert model._ngrams == ref._ngrams
+        assert model._seqlens == ref._seqlens
+        assert ("$$$", "S", "###") not in model._ngrams
+
+        # Unobserved sequences cannot be removed, and the model is unchanged.
+        self.assertRaises(ValueError, model.remove_sequences, ["Italy", "Chile"])
+        assert model._ngrams == ref._ngrams
+
+    def test_multichar_states(self):
+        # States that are strings of more than one character are counted as
+        # single states, and not character by character.
+        sequences = [["ab", "cd"], ["ab", "e"]]
+        model = NgramModel(1, 0, sequences=sequences)
+        assert model._ngrams[("###",)] == Counter({"ab": 2, "cd": 1, "e": 1})
+        assert model._ngrams[("ab", "###")] == Counter({"cd": 1, "e": 1})
+        assert "a" not in model._ngrams[("###",)]
+
+        model.remove_sequences([["ab", "e"]])
+        assert model._ngrams[("###",)] == Counter({"ab": 1, "cd": 1})
+
+    def test_kfold_perplexity(self):
+        words = [
+            "Germany",
+            "Italy",
+            "Brazil",
+            "France",
+            "Portugal",
+            "Spain",
+            "Argentina",
+            "Belgium",
+            "Peru",
+            "Ireland",
+        ]
+
+        # Compare with the perplexities of models trained from scratch.
+        for bins in [None, 30]:
+            ppl = kfold_perplexity(words, 3, 2, 1, method="ele", bins=bins, seed=42)
+            indices = list(range(len(words)))
+            random.Random(42).shuffle(indices)
+            for fold, value in enumerate(ppl):
+                heldout = [words[idx] for idx in indices[fold::3]]
+                model = NgramModel(
+                    2, 1, sequences=[word for word in words if word not in heldout]
+                )
+                model.train(method="ele", bins=bins)
+                score = sum([model.score(word) for word in heldout])
+                length = sum([len(word) for word in heldout])
+                self.assertAlmostEqual(value, 2.0 ** (-score / math.log(2) / length))
+
+        self.assertRaises(ValueError, kfold_perplexity, words, 1)
+        self.assertRaises(ValueError, kfold_perplexity, words + [""], len(words) + 1)
+
+    def test_sweep(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        heldout = ["Argentina", "Belgium", "Peru"]
+        configs = [
+            ("laplace",),
+            ("lidstone", {"gamma": 0.1}),
+            ("lidstone", {"gamma": 0.1}, True),
+            ("lidstone", {"gamma": 0.5}, False, 50),
+            ("wittenbell", None, True),
+            ("certaintydegree",),
+            ("sgt", {"allow_fail": False}),
+            ("mle",),
+        ]
+
+        model = NgramModel(2, 1, sequences=words)
+        ppl = sweep(model, heldout, configs)
+        assert ppl == sweep(model, heldout, configs, n_jobs=2)
+        assert not model._trained
+
+        # Compare with the perplexities of the trained models.
+        length = sum([len(word) for word in heldout])
+        for config, value in zip(configs, ppl):
+            config = tuple(config) + ({}, False, None)[len(config) - 1 :]
+            model.train(
+                method=config[0], normalize=config[2], bins=config[3], **(config[1] or {})
+            )
+            score = sum([model.score(word) for word in heldout])
+            self.assertAlmostEqual(math.log2(value), -score / math.log(2) / length)
+
+        # Held-out sets without states have no perplexity.
+        self.assertRaises(ValueError, sweep, model, ["", []], configs)
+
+    def test_import_time(self):
+        # Import the package in a fresh interpreter, making sure the
+        # scientific libraries are not loaded and guarding the import time.
+        code = (
+            "import sys, time; start = time.perf_counter(); import lpngram; "
+            "print(time.perf_counter() - start, "
+            "'numpy' in sys.modules or 'scipy' in sys.modules)"
+        )
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.run(
+            [sys.executable, "-c", code], env=env, stdout=subprocess.PIPE, check=True
+        )
+        elapsed, heavy = output.stdout.decode("utf-8").split()
+        assert heavy == "False"
+        assert float(elapsed) < 0.25
+
+    def test_context_trie(self):
+        # Test the mapping interface.
+        trie = ContextTrie(Counter)
+        trie["a", "###"]["b"] += 1
+        trie["b", "a", "###", "c"]["d"] += 2
+        trie["###",] = Counter({"e": 1})
+        assert len(trie) == 3
+        assert ("b", "a", "###", "c") in trie
+        assert ("a", "###", "c") not in trie
+        assert trie.get(("a", "###", "c")) is None
+        assert ("a", "###", "c") not in trie
+        assert set(trie) == {("a", "###"), ("b", "a", "###", "c"), ("###",)}
+        assert [
+            (pre_len, post_len) for pre_len, post_len, _ in trie.walk(("a", "b"), ("c",))
+        ] == [(0, 0), (1, 0), (2, 1)]
+        del trie["a", "###"]
+        assert set(trie) == {("b", "a", "###", "c"), ("###",)}
+
+        # Models with a trie store must have the same results.
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        model = NgramModel(2, 1, sequences=words)
+        model.train()
+        trie_model = NgramModel(2, 1, sequences=words[:4], store="trie")
+        trie_model.add_sequences(words[4:] + ["Chile"])
+        trie_model.remove_sequences(["Chile"])
+        trie_model.train()
+        assert dict(trie_model._ngrams) == dict(model._ngrams)
+        for word in words + ["Argentina", "Belgium"]:
+            assert trie_model.state_score(word) == model.state_score(word)
+
+        # Trie stores must take less memory than dictionaries, also once
+        # unpickled, with the smoothed tries sharing the nodes of the counts.
+        import pickle
+        from lpngram import benchmark
+
+        corpus = benchmark.zipf_corpus(2000, vocab_size=20, seed=1)
+        sizes = {}
+        for store in ["dict", "trie"]:
+            model = NgramModel(2, 2, sequences=corpus, store=store)
+            model.train()
+            sizes[store] = model.memory_usage()["total"]
+        assert sizes["trie"] < 0.9 * sizes["dict"]
+        restored = pickle.loads(pickle.dumps(model))
+        assert restored._p._edges is restored._ngrams._edges
+        assert restored.memory_usage()["total"] < 0.9 * sizes["dict"]
+        assert restored.state_score(corpus[0]) == model.state_score(corpus[0])
+
+        self.assertRaises(ValueError, NgramModel, store="list")
+
+    def test_random_seqs_seed(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        model = NgramModel(2, 1, sequences=words)
+        model.train()
+
+        # The global random number generator must not be affected.
+        random.seed(1305)
+        ref = random.random()
+        random.seed(1305)
+        seqs = model.random_seqs(k=1200, seq_len=[4, 6], seed="lpngram")
+        assert random.random() == ref
+
+        # The sequences must be reproducible no matter the number of workers.
+        assert len(seqs) == 1200
+        assert all([len(seq) in [4, 6] for seq in seqs])
+        assert seqs == model.random_seqs(k=1200, seq_len=[4, 6], seed="lpngram", n_jobs=2)
+        assert seqs != model.random_seqs(k=1200, seq_len=[4, 6], seed="other")
+
+        # Without following contexts, the last state must not be dropped.
+        model = NgramModel(2, 0, sequences=words)
+        model.train()
+        assert all([len(seq) == 5 for seq in model.random_seqs(k=10, seq_len=5)])
+
+    def test_batch_random_seqs(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        model = NgramModel(1, 1, sequences=words)
+        model.train()
+
+        seqs = model.batch_random_seqs(k=3000, seed="lpngram", batch_size=500)
+        assert len(seqs) == 3000
+        assert all([len(seq) in [5, 6, 7, 8] for seq in seqs])
+        assert seqs == model.batch_random_seqs(k=3000, seed="lpngram", batch_size=500)
+
+        # The distribution must follow the one of sequential generation.
+        batch = Counter(seqs)
+        serial = Counter(model.random_seqs(k=3000, seed="lpngram"))
+        for seq, count in serial.most_common(3):
+            assert abs(batch[seq] - count) < 0.25 * count
+
+    def test_random_seqs_viable(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        words += ["Paraguay", "Uruguay", "Guyana"]
+        model = NgramModel(2, 0, sequences=words)
+        model.train()
+
+        # With only the longest ngrams, no sequence of length 30 can be
+        # generated, so all sequences must have length 6.
+        for seqs in [
+            model.random_seqs(k=200, seq_len=[6, 30], only_longest=True),
+            model.batch_random_seqs(k=200, seq_len=[6, 30], only_longest=True),
+        ]:
+            assert len(seqs) == 200
+            assert all([len(seq) == 6 for seq in seqs])
+
+        assert model.random_seqs(k=10, seq_len=30, only_longest=True) == []
+        assert model.batch_random_seqs(k=10, seq_len=30, only_longest=True) == []
+
+        # Long sequences must not hit the recursion limit.
+        assert len(model.random_seqs(k=1, seq_len=2000)[0]) == 2000
+
+        # Long sequences must be generated even if the probability of
+        # completing them (about 2 ** -1500 here) underflows.
+        model = NgramModel(1, 0, sequences=["aba", "abc"])
+        model.train()
+        for seqs in [
+            model.random_seqs(k=5, seq_len=3000, seed=1),
+            model.batch_random_seqs(k=5, seq_len=3000, seed=1),
+        ]:
+            assert [len(seq) for seq in seqs] == [3000] * 5
+            assert "c" not in seqs[0][:-1]
+
+    def test_score_at_least(self):
+        from lpngram import benchmark
+
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        for store in ["dict", "trie"]:
+            model = NgramModel(2, 1, sequences=words, store=store)
+            model.train()
+
+            candidates = words + ["Ipaly", "Grmny", "xyz"]
+            scores = [model.score(candidate) for candidate in candidates]
+            middle = len(scores) // 2
+            threshold = sum(sorted(scores)[middle - 1 : middle + 1]) / 2.0
+            results = model.score_at_least(candidates, threshold)
+
+            for score, (passed, partial) in zip(scores, results):
+                assert passed == (score >= threshold)
+                if passed:
+                    assert partial == score
+                else:
+                    assert partial >= score
+                    assert partial < threshold
+
+            # Scores must be exactly those of `.score()`, so that every
+            # sequence reaches its own score as threshold.
+            corpus = benchmark.zipf_corpus(300, vocab_size=15, seed=1)
+            model = NgramModel(2, 2, sequences=corpus, store=store)
+            model.train(method="ele", normalize=True)
+            for use_length in [True, False]:
+                for sequence in corpus:
+                    score = model.score(sequence, use_length)
+                    assert model.score_at_least([sequence], score, use_length) == [
+                        (True, score)
+                    ]
+
+        # The highest log-probability is computed once per training.
+        assert model._max_p == max(
+            [max(list(model._p[context].values())) for context in model._p]
+        )
+        model.add_sequences(corpus[:1])
+        assert model._max_p == 0.0
+
+    def test_score_cache(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        model = NgramModel(2, 1, sequences=words)
+        model.train()
+        assert model.cache_info() is None
+
+        ref = [model.score(word) for word in words]
+        model.enable_cache(maxsize=4)
+        assert [model.score(word) for word in words] == ref
+        assert [model.score(list(word)) for word in words[-2:]] == ref[-2:]
+        assert model.perplexity("Italy") == model.perplexity(list("Italy"))
+
+        info = model.cache_info()
+        assert info["hits"] == 3
+        assert info["size"] == 4
+        assert info["evictions"] > 0
+
+        # Cached values must not be changed by the caller.
+        model.state_score("Spain")[0] = 0.0
+        assert model.state_score("Spain")[0] != 0.0
+
+        # The cache is invalidated when the model changes.
+        model.add_sequences(["Austria"])
+        assert model.cache_info()["size"] == 0
+        model.train()
+        assert model.score("Spain") != ref[-1]
+
+        # Strings of states separated by spaces are scored as the equivalent
+        # lists, with and without cache, also when counted.
+        model = NgramModel(1, 1, sequences=["a b c", ["a", "c"]])
+        model.train()
+        for cached in [False, True]:
+            if cached:
+                model.enable_cache()
+            assert len(model.state_score("a b c")) == 3
+            assert model.score("a b c") == model.score(["a", "b", "c"])
+            assert model.score("a b c") == model.score("abc")
+        assert model._seqlens == Counter({3: 1, 2: 1})
+
+    def test_sparse(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        model = NgramModel(2, 1, sequences=words)
+        model.train(method="wittenbell")
+
+        counts, logprobs, p0, contexts, states = model.to_sparse()
+        assert counts.shape == logprobs.shape == (len(contexts), len(states))
+        assert (counts.indptr == logprobs.indptr).all()
+        assert (counts.indices == logprobs.indices).all()
+        assert counts.sum() == sum(
+            [sum(counter.values()) for counter in model._ngrams.values()]
+        )
+
+        # The rebuilt model must score and generate as the original one.
+        rebuilt = NgramModel.from_sparse(
+            counts, logprobs, p0, contexts, states, model._seqlens, 2, 1
+        )
+        for word in words + ["Ipaly"]:
+            assert math.isclose(rebuilt.score(word), model.score(word))
+        assert rebuilt._get_ngram_space() == model._get_ngram_space()
+
+    def test_normalize(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        model = NgramModel(2, 1, sequences=words)
+        model.train(method="wittenbell", normalize=True)
+
+        for context in model._p:
+            # The probabilities of each context must sum to one...
+            total = sum([math.exp(prob) for prob in model._p[context].values()])
+            assert math.isclose(total + math.exp(model._p0[context]), 1.0)
+
+            # ...and match the normalization of a single context.
+            probs, prob0 = model._smooth(model._ngrams[context])
+            assert math.isclose(prob0, model._p0[context])
+            for state, prob in probs.items():
+                assert math.isclose(prob, model._p[context][state])
+
+    def test_model_entropy(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        model = NgramModel(2, 1, sequences=words)
+        model.train()
+
+        ref = -sum(
+            [
+                math.exp(prob) * prob / math.log(2.0)
+                for context in model._p
+                for prob in list(model._p[context].values()) + [model._p0[context]]
+            ]
+        )
+        assert math.isclose(model.model_entropy(), ref)
+        assert math.isclose(sum(model.model_entropy(by="context").values()), ref)
+        by_order = model.model_entropy(by="order")
+        assert sorted(by_order) == sorted(itertools.product(range(3), range(2)))
+        assert math.isclose(sum(by_order.values()), ref)
+        self.assertRaises(ValueError, model.model_entropy, by="state")
+
+        # The cached value must be updated after training.
+        model.train(method="wittenbell")
+        assert not math.isclose(model.model_entropy(), ref)
+
+    def test_evaluate(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        model = NgramModel(2, 1, sequences=words)
+        model.train()
+
+        corpus = ["Italy", "Ipaly", "Wales", "Spain"]
+        records = list(evaluate_records(model, iter(corpus), chunk_size=3))
+        for word, record in zip(corpus, records):
+            assert math.isclose(record["score"], model.score(word))
+            assert math.isclose(record["entropy"], model.entropy(word))
+            assert math.isclose(record["perplexity"], model.perplexity(word))
+        assert [record["oov"] for record in records] == [0, 0, 2, 0]
+        assert records[0]["backoff"] == 0
+        assert records[1]["backoff"] > 0
+
+        for n_jobs in [1, 2]:
+            report = evaluate(model, corpus, n_jobs=n_jobs)
+            assert report["sequences"] == 4
+            assert report["states"] == 20
+            assert math.isclose(report["oov_rate"], 0.1)
+            assert 0.0 < report["backoff_rate"] < 1.0
+            assert math.isclose(
+                report["perplexity"],
+                2.0 ** (-(report["score"] / math.log(2.0)) / 20),
+            )
+
+        # Invalid arguments are reported when called, not when iterated.
+        self.assertRaises(ValueError, evaluate_records, model, corpus, chunk_size=0)
+        self.assertRaises(ValueError, evaluate_records, NgramModel(), corpus)
+        model.compact(keep=("generate",))
+        self.assertRaises(ValueError, evaluate, model, corpus)
+
+    def test_benchmark(self):
+        from lpngram import benchmark, smoothing
+        from lpngram.__main__ import main
+
+        corpus = benchmark.zipf_corpus(50, vocab_size=10, seed=1)
+        assert len(corpus) == 50
+        assert corpus == benchmark.zipf_corpus(50, vocab_size=10, seed=1)
+
+        results = benchmark.run_benchmarks(
+            sizes=[20, 40], orders=[(1, 0)], methods=["laplace"], seed=1
+        )
+        assert len(results) == 10
+        assert all([result["throughput"] > 0 for result in results])
+        assert ("count", (1, 0)) in benchmark.scaling(results)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "bench.json")
+            benchmark.save_results(results, filename)
+            baseline = benchmark.load_results(filename)
+            assert not any(
+                [entry["regression"] for entry in benchmark.compare(results, baseline)]
+            )
+
+            # Make a baseline impossible to reach, detected as regression.
+            for result in baseline:
+                result["throughput"] *= 1000
+            benchmark.save_results(baseline, filename)
+            argv = ["bench", "--sizes", "20", "--orders", "1,0", "--no-memory"]
+            assert main(argv + ["--baseline", filename]) == 1
+
+        # All smoothing methods are trained by default.
+        results = benchmark.run_benchmarks(sizes=[30], orders=[(1, 1)], memory=False)
+        trained = [result["name"] for result in results if "train:" in result["name"]]
+        methods = smoothing._SMOOTHING_METHODS
+        assert trained == ["train:%s" % method for method in methods]
+        assert len(trained) == 9
+
+        # Scoring is timed from collected ngrams, with the same perplexity
+        # as the evaluation of the corpus.
+        from lpngram.evaluation import evaluate, _corpus_perplexity
+        from lpngram.evaluation import _heldout_ngrams, _heldout_scores
+
+        assert "score" in [result["name"] for result in results]
+        corpus = benchmark.zipf_corpus(30, seed=1)
+        model = NgramModel(1, 1, sequences=corpus)
+        model.train("laplace")
+        heldout = _heldout_ngrams(model, corpus)
+        scored = _heldout_scores(model._p, model._p0, (model._l, model._l0), heldout)
+        perplexity = _corpus_perplexity(scored)[3]
+        self.assertAlmostEqual(perplexity, evaluate(model, corpus)["perplexity"])
+
+    def test_rank(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        model = NgramModel(2, 1, sequences=words)
+        model.train()
+
+        candidates = ["".join(seq) for seq in itertools.product("aiBrlty", repeat=4)]
+        candidates += candidates
+        ref = sorted(
+            [(candidate, model.score(candidate)) for candidate in candidates],
+            key=lambda entry: entry[1],
+            reverse=True,
+        )[:15]
+
+        # Candidates are consumed lazily, as a generator, and scores must be
+        # exactly those of `.score()`, ranking tied candidates (here, the
+        # repeated ones) in their original order.
+        for n_jobs in [1, 2]:
+            ranked = model.rank(
+                (candidate for candidate in candidates),
+                k=15,
+                n_jobs=n_jobs,
+                chunk_size=100,
+            )
+            assert ranked == ref
+
+        self.assertRaises(ValueError, model.rank, candidates, k=0)
+
+    def test_unique_random_seqs(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        model = NgramModel(2, 0, sequences=words)
+        model.train()
+
+        seqs = model.random_seqs(k=20, seq_len=5, unique=True, exclude=words, seed=1)
+        assert len(seqs) == 20
+        assert len(set(seqs)) == 20
+        assert ("I", "t", "a", "l", "y") not in seqs
+        assert seqs == model.random_seqs(
+            k=20, seq_len=5, unique=True, exclude=words, seed=1, n_jobs=2
+        )
+
+        # Small distributions are saturated, returning fewer sequences.
+        seqs, saturation = model.unique_random_seqs(k=1000, seq_len=3, seed=1)
+        assert len(seqs) < 1000
+        assert saturation > 0.99
+        _, saturation = model.unique_random_seqs(k=5, seq_len=8, seed=1)
+        assert saturation < 0.5
+
+    def test_best_seqs(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        vocab = sorted(set("".join(words)))
+
+        for pre_order, post_order in [(2, 0), (1, 1)]:
+            model = NgramModel(pre_order, post_order, sequences=words)
+            model.train()
+
+            # The exact search must match a brute-force ranking, and the beam
+            # search can only return sequences with lower or equal scores.
+            ref = sorted(
+                [model.score(seq) for seq in itertools.product(vocab, repeat=3)],
+                reverse=True,
+            )[:5]
+            exact = model.best_seqs(k=5, seq_len=3, beam_width=None)
+            assert [round(score, 6) for _, score in exact] == [
+                round(score, 6) for score in ref
+            ]
+            beam = model.best_seqs(k=5, seq_len=3, beam_width=10)
+            assert all([beam[idx][1] <= ref[idx] + 1e-9 for idx in range(5)])
+
+            for seq, score in exact + beam:
+                assert len(seq) == 3
+                assert math.isclose(model.score(seq), score)
+
+        # Multiple lengths are ranked together.
+        seqs = model.best_seqs(k=3, seq_len=[4, 5])
+        assert len(seqs) == 3
+        assert seqs[0][1] >= seqs[1][1] >= seqs[2][1]
+
+    def test_stats(self):
+        from lpngram.__main__ import main
+
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        model = NgramModel(2, 1)
+        assert model.stats() is None
+
+        calls = []
+        model.enable_stats(callback=lambda *args: calls.append(args))
+        model.add_sequences(words)
+        model.train()
+        model.score("Italy")
+        model.score("Xyz")
+        model.random_seqs(k=5, seed=1)
+
+        stats = model.stats()
+        assert stats["add_sequences"]["sequences"] == 6
+        assert stats["add_sequences"]["states"] == len("".join(words))
+        assert stats["train"]["contexts"] == len(model._ngrams)
+        assert stats["state_score"]["calls"] == 2
+        assert stats["state_score"]["states"] == 8
+        assert stats["state_score"]["backoffs"] > 0
+        assert stats["generation"]["sequences"] == 5
+        assert stats["generation"]["contexts"] > 0
+
+        assert [call[0] for call in calls] == [
+            "add_sequences",
+            "train",
+            "state_score",
+            "state_score",
+            "generation",
+        ]
+
+        # The caches of the search space only last for each call.
+        space = model._spaces[2]
+        assert space.info()["contexts"] == space.info()["viable"] == 0
+        model.batch_random_seqs(k=5, seed=1)
+        assert model.stats()["generation"]["sequences"] == 10
+        assert space.info()["contexts"] == space.info()["viable"] == 0
+
+        # Known sequences only use observed contexts.
+        model.enable_stats()
+        model.score("Italy")
+        assert model.stats()["state_score"]["backoffs"] == 0
+        model.disable_stats()
+        assert model.stats() is None
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            corpus = os.path.join(tmpdir, "corpus.txt")
+            output = os.path.join(tmpdir, "stats.json")
+            with open(corpus, "w", encoding="utf-8") as handler:
+                handler.write("\n".join([" ".join(word) for word in words]))
+            argv = ["stats", corpus, "--generate", "3", "--output", output]
+            assert main(argv) == 0
+            with open(output, encoding="utf-8") as handler:
+                stats = json.load(handler)
+            assert stats["state_score"]["calls"] == 6
+            assert stats["generation"]["sequences"] == 3
+
+    def test_memory_usage(self):
+        from lpngram import benchmark
+        from lpngram.memory import deep_sizeof, _KMVSketch, _fit_costs
+
+        assert deep_sizeof([]) < deep_sizeof([1, 2, 3])
+        shared = ("a", "b")
+        seen = set()
+        assert deep_sizeof([shared], seen) > deep_sizeof([shared], seen)
+
+        sketch = _KMVSketch(256)
+        for value in range(10000):
+            sketch.add(("x", value % 5000))
+        assert 3500 < sketch.estimate() < 6500
+
+        # Estimates do not depend on the hash randomization of the process.
+        code = (
+            "from lpngram.memory import _KMVSketch\n"
+            "sketch = _KMVSketch(256)\n"
+            "for value in range(10000):\n"
+            "    sketch.add(('x', str(value % 5000)))\n"
+            "print(repr(sketch.estimate()))\n"
+        )
+        estimates = set()
+        for seed in ["1", "2"]:
+            env = dict(
+                os.environ, PYTHONPATH=os.pathsep.join(sys.path), PYTHONHASHSEED=seed
+            )
+            output = subprocess.run(
+                [sys.executable, "-c", code], env=env, stdout=subprocess.PIPE, check=True
+            )
+            estimates.add(output.stdout.decode("utf-8"))
+        assert len(estimates) == 1
+
+        corpus = benchmark.zipf_corpus(2000, vocab_size=20, seed=1)
+        model = NgramModel(1, 1, sequences=corpus)
+        usage = model.memory_usage()
+        model.train()
+        trained = model.memory_usage()
+        assert trained["p"] > usage["p"]
+        assert trained["ngrams"] == usage["ngrams"]
+        assert trained["total"] >= sum(
+            [size for name, size in trained.items() if name != "total"]
+        )
+
+        # The estimate includes the ngram and search spaces built by
+        # generation.
+        model.random_seqs(k=5, seed=1)
+        generated = model.memory_usage()
+        assert generated["ngram_space"] > trained["ngram_space"]
+        estimate = NgramModel.estimate_memory(corpus, 1, 1, sample=0.25, seed=1)
+        assert estimate["sampled"] == 500
+        assert 0.5 < estimate["contexts"] / len(model._ngrams) < 2.0
+        for name in ["ngram_space", "caches"]:
+            assert 0.5 < estimate["bytes"][name] / generated[name] < 2.0
+        assert 0.5 < estimate["total"] / generated["total"] < 2.0
+        with self.assertRaises(ValueError):
+            NgramModel.estimate_memory(corpus, 1, 1, sample=0)
+        with self.assertRaises(ValueError):
+            NgramModel.estimate_memory([], 1, 1)
+        assert _fit_costs([(0, 0, 10), (0, 0, 20)]) == (0.0, 0.0)
+
+    def test_compact(self):
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        tests = ["Italy", "Xyzzy", "Spanish"]
+
+        for store in ["dict", "trie"]:
+            model = NgramModel(2, 1, sequences=words, store=store)
+            model.train()
+            assert model._ngram_space is None
+            scores = [model.score(test) for test in tests]
+            states = model.state_score("Xyzzy")
+            entropy = model.model_entropy()
+            seqs = model.random_seqs(k=5, seed=1)
+            before = model.memory_usage()["total"]
+
+            model.compact(keep=("score", "generate"))
+            assert isinstance(model._p, CompactTable)
+            assert model._ngrams is None
+            assert model.memory_usage()["total"] < before
+            assert [model.score(test) for test in tests] == scores
+            assert model.state_score("Xyzzy") == states
+            assert math.isclose(model.model_entropy(), entropy)
+            assert model.random_seqs(k=5, seed=1) == seqs
+
+            model.compact()
+            assert [model.score(test) for test in tests] == scores
+            with self.assertRaises(AssertionError):
+                model.random_seqs(k=5)
+            with self.assertRaises(AssertionError):
+                model.add_sequences(["Spain"])
+            with self.assertRaises(AssertionError):
+                model.train()
+
+        model = NgramModel(2, 1, sequences=words)
+        model.train()
+        model.compact(keep=["generate"])
+        assert model.random_seqs(k=5, seed=1) == seqs
+        with self.assertRaises(AssertionError):
+            model.score("Italy")
+        with self.assertRaises(ValueError):
+            model.compact(keep=["train"])
+
+    def test_pickle(self):
+        import pickle
+
+        words = ["Germany", "Italy", "Brazil", "France", "Portugal", "Spain"]
+        tests = ["Italy", "Xyzzy", "Spanish"]
+
+        # Untrained models keep their counts.
+        model = NgramModel(2, 1, sequences=words)
+        loaded = pickle.loads(pickle.dumps(model))
+        assert loaded._ngrams == model._ngrams
+        assert not loaded._trained
+
+        for store, keep in itertools.product(["dict", "trie"], [None, "generate"]):
+            model = NgramModel(2, 1, sequences=words, store=store)
+            model.train("lidstone", gamma=0.5)
+            model.enable_cache(10)
+            if keep:
+                model.compact(keep=("score", keep))
+            scores = [model.score(test) for test in tests]
+            seqs = model.random_seqs(k=5, seed=1)
+
+            for protocol in [4, 5]:
+                loaded = pickle.loads(pickle.dumps(model, protocol=protocol))
+                assert [loaded.score(test) for test in tests] == scores
+                assert loaded.random_seqs(k=5, seed=1) == seqs
+                assert loaded.cache_info()["maxsize"] == 10
+                if keep is None:
+                    assert dict(loaded._ngrams.items()) == dict(model._ngrams.items())
+
+            # Arrays of compacted models are not copied with out-of-band buffers.
+            buffers = []
+            data = pickle.dumps(model, protocol=5, buffer_callback=buffers.append)
+            loaded = pickle.loads(data, buffers=buffers)
+            assert [loaded.score(test) for test in tests] == scores
+            if keep:
+                assert isinstance(loaded._p._values, memoryview)
+                assert pickle.loads(pickle.dumps(loaded)).score("Italy") == scores[0]
+
+    def test_progress(self):
+        from lpngram import benchmark
+
+        corpus = benchmark.zipf_corpus(2500, vocab_size=10, seed=1)
+        reference = NgramModel(1, 1, sequences=corpus)
+        reference.train()
+
+        # Progress is reported after each chunk, with the ETA of the last one
+        # being zero; sequences given as an iterator have no total.
+        events = []
+        model = NgramModel(1, 1)
+        model.add_sequences(corpus, progress=events.append)
+        assert [event["done"] for event in events] == [1000, 2000, 2500]
+        assert events[-1]["total"] == 2500 and events[-1]["eta"] == 0.0
+        events = []
+        NgramModel(1, 1).add_sequences(iter(corpus), progress=events.append)
+        assert events[-1]["done"] == 2500 and events[-1]["eta"] is None
+
+        events = []
+        model.train(progress=events.append)
+        assert events[-1]["done"] == len(model._ngrams) == events[-1]["total"]
+        assert model.score("s1 s2".split()) == reference.score("s1 s2".split())
+        events = []
+        seqs = model.random_seqs(k=1500, seed=1, progress=events.append)
+        assert [event["done"] for event in events] == [1000, 1500]
+        assert seqs == reference.random_seqs(k=1500, seed=1)
+
+        # A token cancelled after the first chunk leaves the counts of exactly
+        # the sequences of that chunk.
+        token = CancelToken()
+        model = NgramModel(1, 1)
+        with self.assertRaises(OperationCancelled) as context:
+            model.add_sequences(
+                corpus, progress=lambda _: token.cancel(), cancel=token
+            )
+        assert context.exception.done == 1000
+        assert model._ngrams == NgramModel(1, 1, sequences=corpus[:1000])._ngrams
+        assert sum(model._seqlens.values()) == 1000
+
+        # Cancelled training leaves the model untrained, and cancelled
+        # generation returns nothing; a complete operation is never cancelled.
+        model = NgramModel(1, 1, sequences=corpus)
+        with self.assertRaises(OperationCancelled):
+            model.train(cancel=CancelToken(timeout=0))
+        assert not model._trained and not model._p
+        model.train()
+        with self.assertRaises(OperationCancelled):
+            model.random_seqs(k=1500, seed=1, cancel=CancelToken(timeout=0))
+        with self.assertRaises(OperationCancelled):
+            model.random_seqs(k=5, unique=True, cancel=CancelToken(timeout=0))
+        token = CancelToken()
+        seqs = model.random_seqs(
+            k=1000, seed=1, progress=lambda _: token.cancel(), cancel=token
+        )
+        assert len(seqs) == 1000
+
+    def test_checkpoint(self):
+        from lpngram import benchmark
+
+        corpus = benchmark.zipf_corpus(2500, vocab_size=10, seed=1)
+        reference = NgramModel(2, 1, sequences=corpus)
+        reference.train("lidstone", normalize=True, gamma=0.5)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "model.ckpt")
+
+            # Counting cancelled after two chunks is resumed from the
+            # checkpoint, skipping the sequences already counted.
+            token = CancelToken()
+            model = NgramModel(2, 1)
+            with self.assertRaises(OperationCancelled):
+                model.add_sequences(
+                    corpus,
+                    progress=lambda event: event["done"] == 2000 and token.cancel(),
+                    cancel=token,
+                    checkpoint=filename,
+                    checkpoint_every=1000,
+                )
+
+            model = NgramModel(2, 1)
+            with self.assertRaises(ValueError):
+                model.add_sequences(corpus[::-1], checkpoint=filename, resume=True)
+            assert not model._ngrams
+
+            events = []
+            model.add_sequences(
+                corpus, progress=events.append, checkpoint=filename, resume=True
+            )
+            assert [event["done"] for event in events] == [2500]
+            assert model._ngrams == reference._ngrams
+            assert model._seqlens == reference._seqlens
+
+            # Training cancelled after the first chunk of contexts is resumed
+            # with the same parameters only.
+            token = CancelToken()
+            with self.assertRaises(OperationCancelled):
+                model.train(
+                    "lidstone",
+                    normalize=True,
+                    progress=lambda _: token.cancel(),
+                    cancel=token,
+                    checkpoint=filename,
+                    gamma=0.5,
+                )
+            assert not model._trained
+            with self.assertRaises(ValueError):
+                model.train("laplace", checkpoint=filename, resume=True)
+
+            events = []
+            model.train(
+                "lidstone",
+                normalize=True,
+                progress=events.append,
+                checkpoint=filename,
+                resume=True,
+                gamma=0.5,
+            )
+            assert [event["done"] for event in events] == [len(model._ngrams)]
+            for sequence in corpus[:20]:
+                assert math.isclose(model.score(sequence), reference.score(sequence))
+
+            # A complete checkpoint restores the trained model.
+            model = NgramModel(2, 1, sequences=corpus)
+            model.train(
+                "lidstone", normalize=True, checkpoint=filename, resume=True, gamma=0.5
+            )
+            assert model.score(corpus[0]) == reference.score(corpus[0])
+
+            # Each checkpoint only appends the contexts smoothed since the
+            # previous one, and a record cut by a killed process is dropped.
+            from lpngram.checkpoint import counts_digest, read_log
+
+            model = NgramModel(2, 1, sequences=corpus)
+            model.train("laplace", checkpoint=filename, checkpoint_every=1000)
+            header, records = read_log(filename, "train")
+            assert header["counts"] == counts_digest(reference)
+            assert len(records) > 1
+            assert sum([len(record["dists"]) for record in records]) == len(
+                model._ngrams
+            )
+            with open(filename, "ab") as handler:
+                handler.write(b"\x80\x05truncated")
+            assert len(read_log(filename, "train")[1]) == len(records)
+            score = model.score(corpus[0])
+            model = NgramModel(2, 1, sequences=corpus)
+            model.train("laplace", checkpoint=filename, resume=True)
+            assert model.score(corpus[0]) == score
+
+    def test_count_external(self):
+        from lpngram import benchmark, external
+
+        corpus = benchmark.zipf_corpus(2500, vocab_size=10, seed=1)
+        reference = NgramModel(2, 1, sequences=corpus)
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            # A small budget spills a run after each chunk of sequences.
+            events = []
+            model = NgramModel.count_external(
+                iter(corpus),
+                2,
+                1,
+                memory_budget=10000,
+                tmpdir=tmpdir,
+                progress=events.append,
+            )
+            assert model._ngrams == reference._ngrams
+            assert model._seqlens == reference._seqlens
+            assert [event["done"] for event in events] == [1000, 2000, 2500]
+            assert not os.listdir(tmpdir)
+
+            model = NgramModel.count_external(corpus, 2, 1, store="trie")
+            assert isinstance(model._ngrams, ContextTrie)
+            assert model._ngrams == reference._ngrams
+
+            filename = os.path.join(tmpdir, "counts.jsonl.gz")
+            NgramModel.count_external(
+                corpus, 2, 1, memory_budget=10000, output=filename
+            )
+            model = NgramModel.load_counts(filename)
+            assert model._ngrams == reference._ngrams
+            model.train()
+            reference.train()
+            assert model.score(corpus[0]) == reference.score(corpus[0])
+
+            # Runs are merged in groups when there are too many of them.
+            runs = []
+            for idx in range(5):
+                runs.append(os.path.join(tmpdir, "%i.run" % idx))
+                external.write_run(
+                    external.run_entries(Counter({(("a", "###"), "b"): idx + 1})),
+                    runs[-1],
+                )
+            runs = external.reduce_runs(runs, tmpdir, fan_in=2)
+            assert len(runs) == 2
+            entries = external.merge_runs([external.read_run(run) for run in runs])
+            contexts = list(external.group_contexts(entries))
+            assert contexts == [(("a", "###"), [["b", 15]])]
+
+            with self.assertRaises(ValueError):
+                NgramModel.count_external(corpus, memory_budget=0)
+
     def test_all_ngrams(self):
         assert get_all_ngrams("lingpy")[0] == "lingpy"
 